@@ -0,0 +1,302 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import numpy as np
+import threading
+import datetime
+import random
+import json
+import time
+import os
+import uuid
+import urllib.parse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from data_source.data_source import DataSourceInterface
+from data_source.data import CapturedData
+from data_source.local_cache import LocalImageCache
+from data_source.image_encoder import ImageEncoding, EncoderPool, encode_frame
+from object_store.object_store import ObjectStoreInterface, VALIDATION_NONE
+from object_store.providers.s3_object_store import S3ObjectStore
+from botocore.awsrequest import AWSResponse
+import paho.mqtt.client as mqtt
+
+class SyntheticCamera(DataSourceInterface):
+    """
+    A data source that generates frames with NumPy instead of reading them from a camera.
+
+    A bright square moves across a fixed noise background so consecutive frames differ slightly,
+    like a real scene. Generating a frame costs a few slices, so the benchmarks measure the
+    encoding and the rest of the pipeline rather than the generation of the frames.
+    """
+    def initialize(self, jsonArgs):
+        args = json.loads(jsonArgs)
+
+        # Setup default values
+        self.image_resolution = args.get('image_resolution', [1024, 768])
+        self.image_filename_extension = args.get('image_filename_extension', '.jpg')
+        self.image_storage_folder = args.get('image_storage_folder', '/tmp')
+        self.in_memory_capture = args.get('in_memory_capture', True)
+        self.jpeg_quality = args.get('jpeg_quality', 95)
+        self.image_scale = 1.0
+        self.image_encoding = ImageEncoding(self.image_filename_extension, args.get('jpeg_optimize', False),
+            args.get('jpeg_progressive', False), args.get('png_compression', 1))
+        self.encoder_pool = None
+        if args.get('encoding_workers', 0) > 0:
+            self.encoder_pool = EncoderPool(args['encoding_workers'], self.image_resolution[0] * self.image_resolution[1] * 3)
+        self.local_cache = LocalImageCache(self.image_storage_folder, 'synthetic-', self.image_filename_extension,
+            args.get('image_cache_size', 10))
+
+        width, height = self.image_resolution
+        self._background = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        self._frame = np.empty_like(self._background)
+        self._square_size = max(min(width, height) // 8, 1)
+        self._position = 0
+
+    def capture_data(self):
+        creation_timestamp = datetime.datetime.now().timestamp()
+        np.copyto(self._frame, self._background)
+        width, height = self.image_resolution
+        x = self._position % max(width - self._square_size, 1)
+        y = (self._position // 2) % max(height - self._square_size, 1)
+        self._frame[y:y + self._square_size, x:x + self._square_size] = 255
+        self._position += 7
+
+        parameters = self.image_encoding.get_parameters(self.jpeg_quality)
+        filename = "synthetic-" + str(uuid.uuid4()) + self.image_filename_extension
+        filepath = None
+        if not self.in_memory_capture:
+            filepath = os.path.join(self.image_storage_folder, filename)
+            self.local_cache.add(filepath)
+        if self.encoder_pool is not None:
+            data = CapturedData(creation_timestamp, upload_file_path=filepath,
+                upload_filename=filename if self.in_memory_capture else None)
+            data.set_pending_encoding(self.encoder_pool.submit(self._frame, self.image_scale,
+                self.image_filename_extension, parameters, filepath))
+        else:
+            encoded_image, encode_duration = encode_frame(self._frame, self.image_scale, self.image_filename_extension,
+                parameters, filepath)
+            if self.in_memory_capture:
+                data = CapturedData(creation_timestamp, upload_data=memoryview(encoded_image), upload_filename=filename)
+            else:
+                data = CapturedData(creation_timestamp, upload_file_path=filepath)
+            data.set_encode_duration(encode_duration)
+        data.set_encoding(self.image_encoding.describe(self.jpeg_quality, self.image_scale))
+        return data
+
+    def clean_local_cache(self):
+        self.local_cache.evict()
+
+    def set_encoding_parameters(self, jpeg_quality, image_scale):
+        self.jpeg_quality = jpeg_quality
+        self.image_scale = image_scale
+
+class InMemoryObjectStore(ObjectStoreInterface):
+    """
+    An object store that keeps the objects in a dictionary, with injectable latency and failures.
+    """
+    def __init__(self, latency_seconds=0.0, failure_rate=0.0, bucket_name='benchmark'):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.bucket_name = bucket_name
+        self.bytes_uploaded = 0
+        self.objects_deleted = 0
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def initialize(self, jsonArgs=None):
+        pass
+
+    def upload(self, filepath, bucket_name=None, object_name=None):
+        with open(filepath, 'rb') as upload_file:
+            return self.upload_data(object_name or os.path.basename(filepath), upload_file.read(), bucket_name)
+
+    def upload_data(self, filename, data, bucket_name=None):
+        self.simulate_request()
+        content = bytes(data)
+        with self._lock:
+            self._objects[filename] = (content, datetime.datetime.now())
+            self.bytes_uploaded += len(content)
+        return (bucket_name or self.bucket_name) + '/' + filename
+
+    def download(self, filename, download_path, bucket_name=None):
+        self.simulate_request()
+        with self._lock:
+            content = self._objects[filename][0]
+        with open(download_path, 'wb') as download_file:
+            download_file.write(content)
+
+    def delete(self, filename, bucket_name=None):
+        self.simulate_request()
+        with self._lock:
+            self._objects.pop(filename, None)
+            self.objects_deleted += 1
+
+    def delete_many(self, filenames, bucket_name=None):
+        self.simulate_request()
+        with self._lock:
+            for filename in filenames:
+                self._objects.pop(filename, None)
+            self.objects_deleted += len(filenames)
+        return []
+
+    def list_objects(self, bucket_name=None, prefix=None):
+        self.simulate_request()
+        with self._lock:
+            objects = [(name, value[1]) for name, value in self._objects.items() if name.startswith(prefix or '')]
+        for obj in objects:
+            yield obj
+
+    def list_prefixes(self, prefix='', bucket_name=None):
+        self.simulate_request()
+        with self._lock:
+            prefixes = set(prefix + name[len(prefix):].split('/', 1)[0] + '/' for name in self._objects
+                if name.startswith(prefix) and '/' in name[len(prefix):])
+        for common_prefix in sorted(prefixes):
+            yield common_prefix
+
+    def simulate_request(self):
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        if self.failure_rate > 0 and random.random() < self.failure_rate:
+            raise Exception("Simulated object store failure")
+
+S3_XML_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+# Bodies of the responses of the stubbed S3 requests that do not depend on the objects
+S3_RESPONSE_BODIES = {
+    'CreateMultipartUpload': '<InitiateMultipartUploadResult xmlns="{0}"><UploadId>benchmark</UploadId></InitiateMultipartUploadResult>'
+        .format(S3_XML_NAMESPACE),
+    'CompleteMultipartUpload': '<CompleteMultipartUploadResult xmlns="{0}"></CompleteMultipartUploadResult>'.format(S3_XML_NAMESPACE),
+    'DeleteObjects': '<DeleteResult xmlns="{0}"></DeleteResult>'.format(S3_XML_NAMESPACE)
+}
+S3_ERROR_BODY = '<Error><Code>InternalError</Code><Message>Simulated object store failure</Message></Error>'
+
+class StubbedResponseBody():
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+class StubbedS3ObjectStore(S3ObjectStore):
+    """
+    The S3 object store whose HTTP requests are answered in process, with injectable latency and failures.
+
+    The requests are still built, signed, and their responses parsed by the S3 client, so the benchmarks
+    measure the cost of the client along with the rest of the pipeline. The names and sizes of the objects
+    are kept, but not their content. Failures are answered with a server error, which the client retries
+    like it would against S3.
+    """
+    def __init__(self, latency_seconds=0.0, failure_rate=0.0, bucket_name='benchmark'):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.bytes_uploaded = 0
+        self.objects = {}
+        self._lock = threading.Lock()
+        self.initialize(json.dumps({'host': 'localhost:9000', 'accessKey': 'benchmark', 'secretKey': 'benchmark',
+            'httpsEnabled': False, 'bucketName': bucket_name, 'validation': VALIDATION_NONE}))
+        self.s3_client.meta.events.register('before-send.s3', self.send)
+
+    def send(self, request, event_name, **kwargs):
+        # Answers a request instead of sending it. Returning a response skips the HTTP layer of the client
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        if self.failure_rate > 0 and random.random() < self.failure_rate:
+            return AWSResponse(request.url, 500, {}, StubbedResponseBody(S3_ERROR_BODY.encode('utf-8')))
+        operation = event_name.rsplit('.', 1)[-1]
+        url = urllib.parse.urlsplit(request.url)
+        # Paths are /bucket/key since the client uses the path addressing style
+        key = urllib.parse.unquote(url.path).split('/', 2)[-1]
+        headers = {}
+        body = S3_RESPONSE_BODIES.get(operation, '')
+        with self._lock:
+            if operation in ['PutObject', 'UploadPart']:
+                size = int(request.headers.get('Content-Length', 0))
+                self.bytes_uploaded += size
+                if operation == 'PutObject':
+                    self.objects[key] = (size, datetime.datetime.now(datetime.timezone.utc))
+                headers['ETag'] = '"{0}"'.format(uuid.uuid4().hex)
+            elif operation == 'CompleteMultipartUpload':
+                self.objects[key] = (0, datetime.datetime.now(datetime.timezone.utc))
+            elif operation == 'DeleteObjects':
+                for element in ElementTree.fromstring(request.body).iter('{' + S3_XML_NAMESPACE + '}Key'):
+                    self.objects.pop(element.text, None)
+            elif operation == 'ListObjectsV2':
+                body = self.list_response(urllib.parse.parse_qs(url.query))
+        return AWSResponse(request.url, 200, headers, StubbedResponseBody(body.encode('utf-8')))
+
+    def list_response(self, query):
+        # Lists the objects in a single page, grouped under common prefixes when a delimiter is given
+        prefix = query.get('prefix', [''])[0]
+        delimiter = query.get('delimiter', [None])[0]
+        contents = []
+        common_prefixes = set()
+        for name in sorted(self.objects):
+            if not name.startswith(prefix):
+                continue
+            if delimiter is not None and delimiter in name[len(prefix):]:
+                common_prefixes.add(prefix + name[len(prefix):].split(delimiter, 1)[0] + delimiter)
+                continue
+            size, last_modified = self.objects[name]
+            contents.append('<Contents><Key>{0}</Key><LastModified>{1}</LastModified><Size>{2}</Size></Contents>'
+                .format(escape(name), last_modified.isoformat(), size))
+        common_prefix_elements = ['<CommonPrefixes><Prefix>{0}</Prefix></CommonPrefixes>'.format(escape(common_prefix))
+            for common_prefix in sorted(common_prefixes)]
+        return '<ListBucketResult xmlns="{0}"><KeyCount>{1}</KeyCount><IsTruncated>false</IsTruncated>{2}{3}</ListBucketResult>'.format(
+            S3_XML_NAMESPACE, len(contents) + len(common_prefix_elements), ''.join(contents), ''.join(common_prefix_elements))
+
+class PublishResult():
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+class FakeMQTTClient():
+    """
+    A stand-in for the paho MQTT client that records what is published, with injectable latency and failures.
+    """
+    def __init__(self, latency_seconds=0.0, failure_rate=0.0):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.connected = True
+        self.on_connect = None
+        self.on_publish = None
+        self.published = []
+        self.message_callbacks = {}
+        self._mid = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=0):
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        with self._lock:
+            self._mid += 1
+            if not self.connected or (self.failure_rate > 0 and random.random() < self.failure_rate):
+                return PublishResult(mqtt.MQTT_ERR_NO_CONN, self._mid)
+            self.published.append((time.time(), topic, payload))
+            mid = self._mid
+        if self.on_publish is not None:
+            self.on_publish(self, None, mid)
+        return PublishResult(mqtt.MQTT_ERR_SUCCESS, mid)
+
+    def is_connected(self):
+        return self.connected
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def max_queued_messages_set(self, queue_size):
+        pass
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def message_callback_add(self, topic, callback):
+        self.message_callbacks[topic] = callback
+
+    def subscribe(self, topic, qos=0):
+        return (mqtt.MQTT_ERR_SUCCESS, 0)
+
+    def loop_stop(self):
+        pass
@@ -0,0 +1,212 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Runs the ingestion pipeline end to end without hardware or network services and reports
+# throughput, capture-to-publish latency, CPU usage and peak memory for a set of scenarios.
+#
+# Usage (from the root of the repository):
+#   python3 -m benchmarks.run_benchmarks [--duration SECONDS] [--scenario NAME ...]
+#
+import argparse
+import subprocess
+import resource
+import logging
+import json
+import threading
+import time
+import sys
+import os
+
+# Each scenario is run in its own process so the threads and the peak memory of one scenario
+# never affect the next one
+SCENARIOS = {
+    'baseline-640x480': {
+        'cameras': [{'image_resolution': [640, 480]}],
+        'daemon_arguments': ['-i', '0.1']
+    },
+    'baseline-1920x1080': {
+        'cameras': [{'image_resolution': [1920, 1080]}],
+        'daemon_arguments': ['-i', '0.1']
+    },
+    'disk-capture-1024x768': {
+        'cameras': [{'image_resolution': [1024, 768], 'in_memory_capture': False}],
+        'daemon_arguments': ['-i', '0.1']
+    },
+    'slow-store-1-worker': {
+        'cameras': [{'image_resolution': [1024, 768]}],
+        'daemon_arguments': ['-i', '0.1', '-w', '1'],
+        'object_store_latency_seconds': 0.2
+    },
+    'slow-store-8-workers': {
+        'cameras': [{'image_resolution': [1024, 768]}],
+        'daemon_arguments': ['-i', '0.1', '-w', '8'],
+        'object_store_latency_seconds': 0.2
+    },
+    'flaky-store': {
+        'cameras': [{'image_resolution': [1024, 768]}],
+        'daemon_arguments': ['-i', '0.1'],
+        'object_store_failure_rate': 0.2
+    },
+    'four-cameras': {
+        'cameras': [{'image_resolution': [1024, 768], 'device_id': 'camera-{0}'.format(i)} for i in range(4)],
+        'daemon_arguments': ['-i', '0.1', '-w', '4']
+    },
+    'mqtt-batching': {
+        'cameras': [{'image_resolution': [640, 480]}],
+        'daemon_arguments': ['-i', '0.05', '--mqtt-batch-size', '20', '--mqtt-batch-interval', '500'],
+        'mqtt_latency_seconds': 0.01
+    },
+    'people-counting-count-change': {
+        'cameras': [{'image_resolution': [640, 480], 'people_counting': {'upload_policy': 'count_change'}}],
+        'daemon_arguments': ['-i', '0.1']
+    },
+    'encode-inline-1920x1080': {
+        'cameras': [{'image_resolution': [1920, 1080]}],
+        'daemon_arguments': ['-i', '0.01', '-w', '4']
+    },
+    'encode-4-workers-1920x1080': {
+        'cameras': [{'image_resolution': [1920, 1080], 'encoding_workers': 4}],
+        'daemon_arguments': ['-i', '0.01', '-w', '4']
+    },
+    'packing-640x480': {
+        'cameras': [{'image_resolution': [640, 480]}],
+        'daemon_arguments': ['-i', '0.02', '--pack-frames', '25', '--pack-interval', '1'],
+        'object_store_latency_seconds': 0.05
+    },
+    's3-640x480': {
+        'cameras': [{'image_resolution': [640, 480]}],
+        'daemon_arguments': ['-i', '0.05', '-w', '4'],
+        'object_store': 's3',
+        'object_store_latency_seconds': 0.02
+    },
+    'async-core-four-cameras': {
+        'cameras': [{'image_resolution': [1024, 768], 'device_id': 'camera-{0}'.format(i)} for i in range(4)],
+        'daemon_arguments': ['-i', '0.1', '-w', '4', '--async-core'],
+        'object_store_latency_seconds': 0.05
+    }
+}
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def decode_records(payload):
+    # Extracts the records of a single or a batch MQTT message
+    if isinstance(payload, bytes):
+        import msgpack
+        message = msgpack.unpackb(payload, raw=False)
+    else:
+        message = json.loads(payload)
+    if message.get('type') == 'batch':
+        return message['records']
+    return [message]
+
+def run_scenario(name, duration_seconds):
+    # Imported here so the parent process does not pay for OpenCV and the daemon
+    from image_capture_daemon import App
+    from pipeline.async_runner import AsyncRunner
+    from benchmarks.fakes import SyntheticCamera, InMemoryObjectStore, StubbedS3ObjectStore, FakeMQTTClient
+    logging.getLogger().setLevel(logging.ERROR)
+
+    scenario = SCENARIOS[name]
+    # The objects are kept in memory unless the scenario runs the S3 client against stubbed responses
+    object_store_class = StubbedS3ObjectStore if scenario.get('object_store') == 's3' else InMemoryObjectStore
+    object_store = object_store_class(scenario.get('object_store_latency_seconds', 0.0),
+        scenario.get('object_store_failure_rate', 0.0))
+    mqtt_client = FakeMQTTClient(scenario.get('mqtt_latency_seconds', 0.0), scenario.get('mqtt_failure_rate', 0.0))
+    argv = ['-n', 'benchmark', '-p', 'benchmark', '-s', 'localhost', '-e', '1883', '-v', 'benchmark',
+        '-b', '{}', '-a', json.dumps(scenario['cameras'])] + scenario['daemon_arguments']
+    app = App(argv, mqtt_client=mqtt_client, object_store=object_store, data_source_class=SyntheticCamera)
+    app.seed_retention_index()
+
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    if app.args.async_core:
+        runner = AsyncRunner(app)
+        runner_thread = threading.Thread(target=runner.run_pipeline, daemon=True)
+        runner_thread.start()
+        time.sleep(duration_seconds)
+        runner.stop()
+        runner_thread.join()
+    else:
+        app.start_threads()
+        time.sleep(duration_seconds)
+    elapsed = time.time() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    # Stops the encoding and inference workers. The usage of the worker processes is only reported once
+    # they are joined, and includes their startup
+    app.close_encoder_pools()
+    if app.inference_pool is not None:
+        app.inference_pool.close()
+    children_usage_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    latencies = []
+    for publish_time, _, payload in list(mqtt_client.published):
+        for record in decode_records(payload):
+            # A pack advertises several frames in a single record
+            for frame in record.get('frames', [record]):
+                latencies.append(publish_time - frame['creationTimestamp'])
+    cpu_seconds = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    cpu_seconds += ((children_usage_end.ru_utime - children_usage_start.ru_utime) +
+        (children_usage_end.ru_stime - children_usage_start.ru_stime))
+
+    return {
+        'scenario': name,
+        'frames_per_second': len(latencies) / elapsed,
+        'messages_per_second': len(mqtt_client.published) / elapsed,
+        'upload_megabytes_per_second': object_store.bytes_uploaded / elapsed / (1024 * 1024),
+        'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'cpu_cores': cpu_seconds / elapsed,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_megabytes': usage_end.ru_maxrss / 1024,
+        # Peak of the largest worker process, 0 without workers
+        'worker_peak_rss_megabytes': children_usage_end.ru_maxrss / 1024,
+        'dropped_captures': app.upload_queue.dropped_count + app.publish_queue.dropped_count
+    }
+
+def print_report(results):
+    columns = [('scenario', '{0:<24}'), ('frames_per_second', '{0:>8.1f}'), ('messages_per_second', '{0:>8.1f}'),
+        ('upload_megabytes_per_second', '{0:>8.2f}'), ('latency_p50_ms', '{0:>8.1f}'), ('latency_p99_ms', '{0:>8.1f}'),
+        ('cpu_cores', '{0:>6.2f}'), ('peak_rss_megabytes', '{0:>8.1f}'), ('worker_peak_rss_megabytes', '{0:>9.1f}'),
+        ('dropped_captures', '{0:>8d}')]
+    print('{0:<24}{1:>8}{2:>8}{3:>8}{4:>8}{5:>8}{6:>6}{7:>8}{8:>9}{9:>8}'.format(
+        'scenario', 'frames/s', 'msgs/s', 'MB/s', 'p50 ms', 'p99 ms', 'cpu', 'RSS MB', 'wRSS MB', 'dropped'))
+    for result in results:
+        print(''.join(column_format.format(result[key]) for key, column_format in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description='People counter ingestion benchmarks')
+    parser.add_argument('--duration', '-t', dest='duration_seconds', type=float, default=10,
+        help='Number of seconds each scenario runs (default: 10)')
+    parser.add_argument('--scenario', '-s', dest='scenarios', action='append', choices=sorted(SCENARIOS),
+        help='Scenario to run. Can be repeated (default: all the scenarios)')
+    parser.add_argument('--json', dest='json_output', action='store_true',
+        help='Print the results as JSON lines instead of a table')
+    parser.add_argument('--run-one', dest='run_one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(run_scenario(args.run_one, args.duration_seconds)))
+        sys.stdout.flush()
+        # The pipeline threads never stop on their own. Exit without waiting for the interpreter to
+        # tear them down while they are still encoding frames
+        os._exit(0)
+
+    results = []
+    for name in args.scenarios or sorted(SCENARIOS):
+        output = subprocess.check_output([sys.executable, '-m', 'benchmarks.run_benchmarks',
+            '--run-one', name, '--duration', str(args.duration_seconds)])
+        results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+        if args.json_output:
+            print(json.dumps(results[-1]))
+    if not args.json_output:
+        print_report(results)
+
+if __name__ == '__main__':
+    main()
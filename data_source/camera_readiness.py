@@ -0,0 +1,40 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import logging
+import time
+
+# Delay in seconds between two readings of the exposure of a camera while it warms up
+READINESS_POLL_INTERVAL_SECONDS = 0.05
+# Max relative change between two readings for the exposure to be considered settled
+READINESS_TOLERANCE = 0.05
+
+def wait_for_camera(read_level, timeout_seconds, name):
+    """
+    Waits until a camera delivers images and its automatic exposure has settled, instead of a fixed delay.
+
+    Parameters:
+    read_level (function): Returns a number that follows the exposure of the camera, e.g. the mean
+        brightness of a frame, or None while the camera does not deliver images yet
+    timeout_seconds (float): Max number of seconds to wait. The camera is used as is past this delay
+    name (string): Name of the camera in the logs
+
+    Returns:
+    float: The number of seconds the camera took to get ready
+    """
+    start = time.monotonic()
+    previous_level = None
+    while True:
+        level = read_level()
+        elapsed = time.monotonic() - start
+        if level is not None and previous_level is not None and \
+            abs(level - previous_level) <= READINESS_TOLERANCE * max(abs(previous_level), 1.0):
+            logging.info("Camera %s ready after %.2f seconds", name, elapsed)
+            return elapsed
+        if elapsed >= timeout_seconds:
+            logging.warning("Camera %s exposure did not settle within %.2f seconds. Using it anyway", name, timeout_seconds)
+            return elapsed
+        previous_level = level
+        time.sleep(READINESS_POLL_INTERVAL_SECONDS)
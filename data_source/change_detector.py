@@ -0,0 +1,127 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import numpy as np
+import logging
+import time
+
+class ChangeDetector():
+    """
+    A class used to decide whether a frame differs enough from the scene the camera usually sees to be worth uploading.
+
+    Frames are downscaled by slicing, converted to grayscale with integer arithmetic and compared to a
+    running background. A frame is considered changed when the fraction of pixels that differ from the
+    background by more than a threshold exceeds a limit. The work happens on a few thousand pixels so it
+    stays within a few milliseconds on a Raspberry Pi.
+    """
+    def __init__(self, jsonArgs):
+        # Setup default values
+        downscale_factor_default = 8
+        pixel_threshold_default = 25
+        changed_pixel_fraction_default = 0.01
+        background_learning_rate_default = 0.05
+        activity_hold_seconds_default = 10
+        idle_upload_interval_seconds_default = None
+
+        # Initialize variables to defaults if they were not provided in the JSON payload
+        args = jsonArgs
+        if 'downscale_factor' in args:
+            self.downscale_factor = args['downscale_factor']
+        else:
+            self.downscale_factor = downscale_factor_default
+        if 'pixel_threshold' in args:
+            self.pixel_threshold = args['pixel_threshold']
+        else:
+            self.pixel_threshold = pixel_threshold_default
+        if 'changed_pixel_fraction' in args:
+            self.changed_pixel_fraction = args['changed_pixel_fraction']
+        else:
+            self.changed_pixel_fraction = changed_pixel_fraction_default
+        if 'background_learning_rate' in args:
+            self.background_learning_rate = args['background_learning_rate']
+        else:
+            self.background_learning_rate = background_learning_rate_default
+        if 'activity_hold_seconds' in args:
+            self.activity_hold_seconds = args['activity_hold_seconds']
+        else:
+            self.activity_hold_seconds = activity_hold_seconds_default
+        if 'idle_upload_interval_seconds' in args:
+            self.idle_upload_interval_seconds = args['idle_upload_interval_seconds']
+        else:
+            self.idle_upload_interval_seconds = idle_upload_interval_seconds_default
+
+        self.validate()
+        self._background = None
+        self._last_activity_time = None
+        self._last_capture_time = None
+
+    def should_capture(self, frame, downscale=True):
+        """
+        Updates the background with the frame given and decides whether the frame should be captured.
+
+        Parameters:
+        frame (numpy.ndarray): A BGR or grayscale frame with dtype uint8
+        downscale (bool): Whether the frame still needs to be downscaled by the configured factor
+
+        Returns:
+        bool: True when the scene changed recently or the idle upload interval elapsed
+        """
+        start = time.monotonic()
+        gray = self.to_grayscale(frame[::self.downscale_factor, ::self.downscale_factor] if downscale else frame)
+        changed = self.update_background(gray)
+        now = time.monotonic()
+        logging.debug("Change detection took %.2f ms. Changed: %s", (now - start) * 1000, changed)
+
+        if changed:
+            self._last_activity_time = now
+        capture = False
+        if self._last_activity_time is not None and now - self._last_activity_time <= self.activity_hold_seconds:
+            capture = True
+        elif self.idle_upload_interval_seconds is not None and \
+            (self._last_capture_time is None or now - self._last_capture_time >= self.idle_upload_interval_seconds):
+            capture = True
+
+        if capture:
+            self._last_capture_time = now
+        return capture
+
+    ######################HELPER METHODS########################
+
+    def to_grayscale(self, frame):
+        # Approximates the luma of a BGR frame as (B + 2G + R) / 4 using integer arithmetic
+        if frame.ndim == 2:
+            return frame.astype(np.int16)
+        gray = frame[..., 1].astype(np.int16) << 1
+        gray += frame[..., 0]
+        gray += frame[..., 2]
+        gray >>= 2
+        return gray
+
+    def update_background(self, gray):
+        # Compares the frame to the running background and blends the frame into it
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return True
+
+        difference = np.abs(gray - self._background)
+        changed_pixels = np.count_nonzero(difference > self.pixel_threshold)
+        self._background *= 1 - self.background_learning_rate
+        self._background += self.background_learning_rate * gray
+
+        return changed_pixels > self.changed_pixel_fraction * gray.size
+
+    def validate(self):
+        if self.downscale_factor < 1:
+            raise Exception("The downscale factor for change detection must be at least 1. Value given: {0}"
+                .format(self.downscale_factor))
+        if self.changed_pixel_fraction < 0 or self.changed_pixel_fraction > 1:
+            raise Exception("The fraction of changed pixels for change detection must be between 0 and 1. Value given: {0}"
+                .format(self.changed_pixel_fraction))
+        if self.background_learning_rate <= 0 or self.background_learning_rate > 1:
+            raise Exception("The background learning rate for change detection must be greater than 0 and at most 1. Value given: {0}"
+                .format(self.background_learning_rate))
+        if self.idle_upload_interval_seconds is not None and self.idle_upload_interval_seconds <= 0:
+            raise Exception("The idle upload interval for change detection must be a number greater than 0. Value given: {0}"
+                .format(self.idle_upload_interval_seconds))
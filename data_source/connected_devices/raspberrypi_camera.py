@@ -5,15 +5,22 @@
 # SPDX-License-Identifier: BSD-2-Clause
 #
 from picamera import PiCamera
-from time import sleep
+import numpy as np
 import logging
 import json
 import os
+import io
 from data_source.data_source import DataSourceInterface
 from data_source.data import CapturedData
+from data_source.change_detector import ChangeDetector
+from data_source.local_cache import LocalImageCache
+from data_source.camera_readiness import wait_for_camera
 import datetime
 import uuid
 
+# Splitter port of the video port used by change detection. Port 0 is left to the video port capture mode
+DETECTION_SPLITTER_PORT = 1
+
 class RaspberryPiCamera(DataSourceInterface):
     
     def initialize(self, jsonArgs):
@@ -32,7 +39,10 @@ class RaspberryPiCamera(DataSourceInterface):
         image_storage_folder_default = '/tmp'
         image_resolution_default = [1024, 768]
         image_cache_size_default = 10
-        camera_warmup_delay = 2
+        in_memory_capture_default = False
+        jpeg_quality_default = 95
+        video_port_capture_default = False
+        warmup_timeout_seconds_default = 2
         self._filename_counter = 1
 
         # Initialize variables to defaults if they were not provided in the JSON payload
@@ -56,77 +66,135 @@ class RaspberryPiCamera(DataSourceInterface):
             self.image_cache_size = args['image_cache_size']
         else:
             self.image_cache_size = image_cache_size_default
+        if 'in_memory_capture' in args:
+            self.in_memory_capture = args['in_memory_capture']
+        else:
+            self.in_memory_capture = in_memory_capture_default
+        if 'jpeg_quality' in args:
+            self.jpeg_quality = args['jpeg_quality']
+        else:
+            self.jpeg_quality = jpeg_quality_default
+        self.image_scale = 1.0
+        if 'video_port_capture' in args:
+            self.video_port_capture = args['video_port_capture']
+        else:
+            self.video_port_capture = video_port_capture_default
+        if 'warmup_timeout_seconds' in args:
+            self.warmup_timeout_seconds = args['warmup_timeout_seconds']
+        else:
+            self.warmup_timeout_seconds = warmup_timeout_seconds_default
+        if 'change_detection' in args:
+            self.change_detector = ChangeDetector(args['change_detection'])
+        else:
+            self.change_detector = None
             
+        self._detection_frame = None
+        self._continuous_capture = None
+        self._continuous_capture_options = None
+        self._video_stream = io.BytesIO()
         self.camera = PiCamera()
         self.validate()
+        self.local_cache = LocalImageCache(self.image_storage_folder, self.image_filename_prefix,
+            self.image_filename_extension, self.image_cache_size)
+        if not self.in_memory_capture:
+            self.local_cache.adopt_existing()
 
         # Change the camera settings  
         self.camera.resolution = tuple(self.image_resolution)
         self.camera.start_preview()
-        # Camera warm-up time
-        sleep(camera_warmup_delay)
+        # Camera warm-up time. The gains are polled until the automatic exposure settles
+        wait_for_camera(self.read_exposure, self.warmup_timeout_seconds, 'PiCamera')
 
     def capture_data(self):
         """
         Takes a picture with the Raspberry PI 3 camera module
 
         Returns:
-        CapturedData: Object that holds the file location and the creation timestamp
+        CapturedData: Object that holds the file location (or the encoded image when capturing in memory)
+        and the creation timestamp. None when change detection is enabled and the scene did not change
         """
-        logging.info("Capturing image to folder %s...", self.image_storage_folder)
         filename = self.generate_image_filename()
         try:
-            filepath = os.path.join(self.image_storage_folder, filename)
-            self.camera.capture(filepath)
-            data = CapturedData(datetime.datetime.now().timestamp(), upload_file_path=filepath)
+            if self.change_detector is not None and not self.change_detector.should_capture(
+                self.capture_detection_frame(), downscale=False):
+                logging.debug("No change detected in the scene. Skipping image")
+                return None
+            if self.video_port_capture:
+                creation_timestamp = datetime.datetime.now().timestamp()
+                image = self.capture_video_port_image()
+                if self.in_memory_capture:
+                    logging.info("Captured image in memory from the video port...")
+                    data = CapturedData(creation_timestamp, upload_data=image, upload_filename=filename)
+                else:
+                    logging.info("Capturing image to folder %s from the video port...", self.image_storage_folder)
+                    filepath = os.path.join(self.image_storage_folder, filename)
+                    with open(filepath, 'wb') as image_file:
+                        image_file.write(image)
+                    self.local_cache.add(filepath)
+                    data = CapturedData(creation_timestamp, upload_file_path=filepath)
+            elif self.in_memory_capture:
+                logging.info("Capturing image in memory...")
+                stream = io.BytesIO()
+                self.camera.capture(stream, format=self.get_capture_format(), **self.get_capture_options())
+                data = CapturedData(datetime.datetime.now().timestamp(), upload_data=stream.getbuffer(),
+                    upload_filename=filename)
+            else:
+                logging.info("Capturing image to folder %s...", self.image_storage_folder)
+                filepath = os.path.join(self.image_storage_folder, filename)
+                self.camera.capture(filepath, **self.get_capture_options())
+                self.local_cache.add(filepath)
+                data = CapturedData(datetime.datetime.now().timestamp(), upload_file_path=filepath)
         except Exception as e:
             logging.error("An error occurred that prevented the capture of the image with the camera. Error: %s", str(e))
+            raise e
+        data.set_encoding(self.get_encoding())
                 
         logging.debug("Captured image %s", filename)
 
         return data
 
-    def clean_local_cache(self):
-        try:
-            filenames = os.listdir(self.image_storage_folder)
-        except Exception as e:
-            logging.error("An error occurred that prevented the listing of images in the image folder. Error: %s", str(e))
-            return
-
-        full_file_paths = []
-        logging.debug("Looking for files with extention %s", self.image_filename_extension)
+    def set_encoding_parameters(self, jpeg_quality, image_scale):
+        """
+        Changes the parameters used to encode the next images.
 
-        # Find all the files with a particualar extention
-        for filename in filenames:
-            if self.image_filename_extension in filename:
-                full_file_paths.append(os.path.join(self.image_storage_folder, filename))
+        Parameters:
+        jpeg_quality (int): Quality between 1 and 100 of JPEG images. Ignored for PNG images
+        image_scale (float): Factor between 0 and 1 applied to the resolution of the images
+        """
+        if jpeg_quality != self.jpeg_quality or image_scale != self.image_scale:
+            logging.info("Encoding images with JPEG quality %d at scale %.2f", jpeg_quality, image_scale)
+        self.jpeg_quality = jpeg_quality
+        self.image_scale = image_scale
 
-        # Exit the function if no images are present
-        file_list_size = len(full_file_paths)
-        if file_list_size <= self.image_cache_size:
-            logging.debug("Image storage folder has not exceeded the max number of files allowed: %d. No clean up performed", self.image_cache_size)
+    def clean_local_cache(self):
+        # Images are evicted from the local cache as soon as new ones are written, so this only
+        # enforces the capacity in case it was exceeded
+        if self.in_memory_capture:
+            logging.debug("Images are captured in memory. No local cache to clean up")
             return
-        
-        # Delete all images past the max number of images allowed. Oldest files are deleted first.
-        if file_list_size > 0:
-            try:
-                full_file_paths.sort(key=os.path.getctime)
-            except Exception as e:
-                logging.error("An error occurred that prevented the access to creation time of files in the image folder. Error: %s", str(e))
-                return
-            logging.debug("Files found: {0}".format(full_file_paths))
-            number_of_items_to_delete = file_list_size - self.image_cache_size
-            for i in range(number_of_items_to_delete):
-                logging.debug("Deleting file: %s", full_file_paths[i])
-                try:
-                    os.remove(full_file_paths[i])
-                except Exception as e:
-                    logging.error("An error occurred that prevented the deletion of the file ({0}) in the image folder. Error: {1}".format(full_file_paths[i], str(e)))
-                    continue
+
+        self.local_cache.evict()
 
     ######################HELPER METHODS########################
 
     def validate(self):
+        if not self.in_memory_capture:
+            self.validate_storage_folder()
+        if self.image_resolution[0] > self.camera.MAX_RESOLUTION[0] or self.image_resolution[1] > self.camera.MAX_RESOLUTION[1]:
+            raise Exception("The resolution provided ({0}) exceeds the max allowed resolution ({1}) for the camera"
+                .format(self.image_resolution, self.camera.MAX_RESOLUTION))
+        if 'jpg' not in self.image_filename_extension and 'png' not in self.image_filename_extension:
+            logging.warn("The image filename extension provided '{0}' is not supported. Supported filename extensions are: .jpg and .png. The default extension: {1} will be used"
+                .format(self.image_filename_extension, self.image_filename_extension_default))
+            self.image_filename_extension = self.image_filename_extension_default
+        if self.jpeg_quality < 1 or self.jpeg_quality > 100:
+            raise Exception("The JPEG quality must be a number between 1 and 100. Value given: {0}"
+                .format(self.jpeg_quality))
+        if self.image_cache_size <= 1:
+            raise Exception("The number of images to keep on disk must be at least 2. Value given: {0}"
+                .format(self.image_cache_size))
+        
+    def validate_storage_folder(self):
         if not os.access(self.image_storage_folder, os.F_OK):
             raise Exception("The folder ({0}) specified for image storage does not exist"
                 .format(self.image_storage_folder))
@@ -139,17 +207,66 @@ class RaspberryPiCamera(DataSourceInterface):
         if not os.access(self.image_storage_folder, os.W_OK):
             raise Exception("The folder ({0}) specified for image storage is not writtable"
                 .format(self.image_storage_folder))
-        if self.image_resolution[0] > self.camera.MAX_RESOLUTION[0] or self.image_resolution[1] > self.camera.MAX_RESOLUTION[1]:
-            raise Exception("The resolution provided ({0}) exceeds the max allowed resolution ({1}) for the camera"
-                .format(self.image_resolution, self.camera.MAX_RESOLUTION))
-        if 'jpg' not in self.image_filename_extension and 'png' not in self.image_filename_extension:
-            logging.warn("The image filename extension provided '{0}' is not supported. Supported filename extensions are: .jpg and .png. The default extension: {1} will be used"
-                .format(self.image_filename_extension, self.image_filename_extension_default))
-            self.image_filename_extension = self.image_filename_extension_default
-        if self.image_cache_size <= 1:
-            raise Exception("The number of images to keep on disk must be at least 2. Value given: {0}"
-                .format(self.image_cache_size))
-        
+
+    def read_exposure(self):
+        # Helper function to get the overall exposure chosen by the camera, None until the sensor reports one
+        exposure = self.camera.exposure_speed * float(self.camera.analog_gain) * float(self.camera.digital_gain)
+        if exposure == 0:
+            return None
+        return exposure
+
+    def capture_detection_frame(self):
+        # Helper function to capture a small frame through the video port for change detection.
+        # The camera pads the frame to a width multiple of 32 and a height multiple of 16. It uses splitter
+        # port 1 since the continuous capture of the video port capture mode keeps an encoder on port 0
+        if self._detection_frame is None:
+            width = max(self.image_resolution[0] // self.change_detector.downscale_factor, 32)
+            height = max(self.image_resolution[1] // self.change_detector.downscale_factor, 16)
+            self._detection_resize = (width, height)
+            self._detection_frame = np.empty(((height + 15) // 16 * 16, (width + 31) // 32 * 32, 3), dtype=np.uint8)
+        self.camera.capture(self._detection_frame, format='bgr', resize=self._detection_resize, use_video_port=True,
+            splitter_port=DETECTION_SPLITTER_PORT)
+        return self._detection_frame[:self._detection_resize[1], :self._detection_resize[0]]
+
+    def capture_video_port_image(self):
+        # Helper function to capture an encoded image through the video port. Unlike the still port, the
+        # video port does not switch the sensor mode for every shot. The continuous capture generator and
+        # its stream are kept between captures and only recreated when the encoding parameters change
+        options = self.get_capture_options()
+        if self._continuous_capture is None or options != self._continuous_capture_options:
+            if self._continuous_capture is not None:
+                self._continuous_capture.close()
+            self._continuous_capture = self.camera.capture_continuous(self._video_stream,
+                format=self.get_capture_format(), use_video_port=True, **options)
+            self._continuous_capture_options = options
+        self._video_stream.seek(0)
+        self._video_stream.truncate()
+        next(self._continuous_capture)
+        # The stream is reused by the next capture so the image is copied out of it
+        return self._video_stream.getvalue()
+
+    def get_capture_format(self):
+        # Helper function to map the image filename extension to the format expected by the camera
+        if 'png' in self.image_filename_extension:
+            return 'png'
+        return 'jpeg'
+
+    def get_capture_options(self):
+        # Helper function to get the encoder options of the camera for the current encoding parameters
+        options = {}
+        if self.get_capture_format() == 'jpeg':
+            options['quality'] = self.jpeg_quality
+        if self.image_scale < 1:
+            options['resize'] = (int(self.image_resolution[0] * self.image_scale), int(self.image_resolution[1] * self.image_scale))
+        return options
+
+    def get_encoding(self):
+        # Helper function to describe how the images are encoded to the consumers of the images
+        encoding = {"scale": self.image_scale}
+        if self.get_capture_format() == 'jpeg':
+            encoding["quality"] = self.jpeg_quality
+        return encoding
+
     def generate_image_filename(self):
         # Helper function to get the formatted filename for continues image capturing
 
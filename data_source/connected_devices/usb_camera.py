@@ -12,9 +12,20 @@ import json
 import os
 from data_source.data_source import DataSourceInterface
 from data_source.data import CapturedData
+from data_source.change_detector import ChangeDetector
+from data_source.local_cache import LocalImageCache
+from data_source.camera_readiness import wait_for_camera
+from data_source.regions_of_interest import RegionsOfInterest, ROI_MODE_SEPARATE
+from data_source.image_encoder import ImageEncoding, EncoderPool, encode_frame, IMAGE_FORMATS
 import datetime
 import uuid
 import atexit
+import time
+import threading
+
+# Max age of the newest frame grabbed in continuous grab mode before captures fail
+FRAME_GRABBER_TIMEOUT_SECONDS = 5
+FRAME_GRABBER_RETRY_DELAY_SECONDS = 0.5
 
 class USBCamera(DataSourceInterface):
     
@@ -34,7 +45,15 @@ class USBCamera(DataSourceInterface):
         image_storage_folder_default = '/tmp'
         image_resolution_default = [1024, 768]
         image_cache_size_default = 10
-        camera_warmup_delay = 2
+        in_memory_capture_default = False
+        jpeg_quality_default = 95
+        continuous_grab_default = False
+        warmup_timeout_seconds_default = 2
+        regions_of_interest_mode_default = ROI_MODE_SEPARATE
+        jpeg_optimize_default = False
+        jpeg_progressive_default = False
+        png_compression_default = 1
+        encoding_workers_default = 0
         self._filename_counter = 1
 
         # Initialize variables to defaults if they were not provided in the JSON payload
@@ -58,6 +77,52 @@ class USBCamera(DataSourceInterface):
             self.image_cache_size = args['image_cache_size']
         else:
             self.image_cache_size = image_cache_size_default
+        if 'in_memory_capture' in args:
+            self.in_memory_capture = args['in_memory_capture']
+        else:
+            self.in_memory_capture = in_memory_capture_default
+        if 'jpeg_quality' in args:
+            self.jpeg_quality = args['jpeg_quality']
+        else:
+            self.jpeg_quality = jpeg_quality_default
+        self.image_scale = 1.0
+        if 'continuous_grab' in args:
+            self.continuous_grab = args['continuous_grab']
+        else:
+            self.continuous_grab = continuous_grab_default
+        if 'change_detection' in args:
+            self.change_detector = ChangeDetector(args['change_detection'])
+        else:
+            self.change_detector = None
+        if 'warmup_timeout_seconds' in args:
+            self.warmup_timeout_seconds = args['warmup_timeout_seconds']
+        else:
+            self.warmup_timeout_seconds = warmup_timeout_seconds_default
+        if 'regions_of_interest_mode' in args:
+            regions_of_interest_mode = args['regions_of_interest_mode']
+        else:
+            regions_of_interest_mode = regions_of_interest_mode_default
+        if 'regions_of_interest' in args:
+            self.regions_of_interest = RegionsOfInterest(args['regions_of_interest'], regions_of_interest_mode,
+                self.image_resolution)
+        else:
+            self.regions_of_interest = None
+        if 'jpeg_optimize' in args:
+            jpeg_optimize = args['jpeg_optimize']
+        else:
+            jpeg_optimize = jpeg_optimize_default
+        if 'jpeg_progressive' in args:
+            jpeg_progressive = args['jpeg_progressive']
+        else:
+            jpeg_progressive = jpeg_progressive_default
+        if 'png_compression' in args:
+            png_compression = args['png_compression']
+        else:
+            png_compression = png_compression_default
+        if 'encoding_workers' in args:
+            self.encoding_workers = args['encoding_workers']
+        else:
+            self.encoding_workers = encoding_workers_default
         if 'device_index' in args:
             self.device_index = args['device_index']
         else:
@@ -65,77 +130,97 @@ class USBCamera(DataSourceInterface):
             
         self.camera = cv.VideoCapture(self.device_index)
         self.validate()
+        self.image_encoding = ImageEncoding(self.image_filename_extension, jpeg_optimize, jpeg_progressive, png_compression)
+        self.encoder_pool = None
+        if self.encoding_workers > 0:
+            # A slot holds a full frame. Regions of interest and scaled images are smaller
+            self.encoder_pool = EncoderPool(self.encoding_workers, self.image_resolution[0] * self.image_resolution[1] * 3)
+        self.local_cache = LocalImageCache(self.image_storage_folder, self.image_filename_prefix,
+            self.image_filename_extension, self.image_cache_size)
+        if not self.in_memory_capture:
+            self.local_cache.adopt_existing()
 
         # Change the camera settings  
         self.camera.set(cv.CAP_PROP_FRAME_WIDTH, self.image_resolution[0])
         self.camera.set(cv.CAP_PROP_FRAME_HEIGHT, self.image_resolution[1])
-        # Camera warm-up time
-        sleep(camera_warmup_delay)
+        # Camera warm-up time. Frames are read until the automatic exposure settles
+        wait_for_camera(self.read_brightness, self.warmup_timeout_seconds, self.device_index)
+        if self.continuous_grab:
+            self.start_frame_grabber()
 
     def capture_data(self):
         """
         Takes a picture with the USB camera
 
         Returns:
-        CapturedData: Object that holds the file location and the creation timestamp
+        CapturedData: Object that holds the file location (or the encoded image when capturing in memory)
+        and the creation timestamp. None when change detection is enabled and the scene did not change.
+        A list with one object per region when regions of interest are uploaded separately
         """
-        logging.info("Capturing image to folder %s...", self.image_storage_folder)
-        filename = self.generate_image_filename()
-        filepath = os.path.join(self.image_storage_folder, filename)
         try:
-            ret, frame = self.camera.read()
-            if not ret:
-                raise Exception("Can't receive frame (stream end?). Exiting ...")
-            cv.imwrite(filepath, frame)
+            frame, creation_timestamp = self.read_frame()
+            if self.change_detector is not None and not self.change_detector.should_capture(frame):
+                logging.debug("No change detected in the scene. Skipping image")
+                return None
+            if self.regions_of_interest is None:
+                return self.encode_image(frame, creation_timestamp, self.generate_image_filename())
+            # The regions are cropped before encoding so only their pixels are encoded and uploaded
+            captures = []
+            for image, regions, name in self.regions_of_interest.extract(frame):
+                data = self.encode_image(image, creation_timestamp, self.generate_image_filename(name))
+                data.set_regions(regions)
+                captures.append(data)
         except Exception as e:
             logging.error("An error occurred that prevented the capture of the image with the camera. Error: %s", str(e))
             raise e
-        data = CapturedData(datetime.datetime.now().timestamp(), upload_file_path=filepath)
-        logging.debug("Captured image %s", filename)
+        if len(captures) == 1:
+            return captures[0]
+        return captures
 
-        return data
+    def set_encoding_parameters(self, jpeg_quality, image_scale):
+        """
+        Changes the parameters used to encode the next images.
+
+        Parameters:
+        jpeg_quality (int): Quality between 1 and 100 of JPEG and WebP images. Ignored for PNG images
+        image_scale (float): Factor between 0 and 1 applied to the resolution of the images
+        """
+        if jpeg_quality != self.jpeg_quality or image_scale != self.image_scale:
+            logging.info("Encoding images with JPEG quality %d at scale %.2f", jpeg_quality, image_scale)
+        self.jpeg_quality = jpeg_quality
+        self.image_scale = image_scale
 
     def clean_local_cache(self):
-        try:
-            filenames = os.listdir(self.image_storage_folder)
-        except Exception as e:
-            logging.error("An error occurred that prevented the listing of images in the image folder. Error: %s", str(e))
+        # Images are evicted from the local cache as soon as new ones are written, so this only
+        # enforces the capacity in case it was exceeded
+        if self.in_memory_capture:
+            logging.debug("Images are captured in memory. No local cache to clean up")
             return
 
-        full_file_paths = []
-        logging.debug("Looking for files with extention %s", self.image_filename_extension)
-
-        # Find all the files with a particualar extention
-        for filename in filenames:
-            if self.image_filename_extension in filename:
-                full_file_paths.append(os.path.join(self.image_storage_folder, filename))
-
-        # Exit the function if no images are present
-        file_list_size = len(full_file_paths)
-        if file_list_size <= self.image_cache_size:
-            logging.debug("Image storage folder has not exceeded the max number of files allowed: %d. No clean up performed", self.image_cache_size)
-            return
-        
-        # Delete all images past the max number of images allowed. Oldest files are deleted first.
-        if file_list_size > 0:
-            try:
-                full_file_paths.sort(key=os.path.getctime)
-            except Exception as e:
-                logging.error("An error occurred that prevented the access to creation time of files in the image folder. Error: %s", str(e))
-                return
-            logging.debug("Files found: {0}".format(full_file_paths))
-            number_of_items_to_delete = file_list_size - self.image_cache_size
-            for i in range(number_of_items_to_delete):
-                logging.debug("Deleting file: %s", full_file_paths[i])
-                try:
-                    os.remove(full_file_paths[i])
-                except Exception as e:
-                    logging.error("An error occurred that prevented the deletion of the file ({0}) in the image folder. Error: {1}".format(full_file_paths[i], str(e)))
-                    continue
+        self.local_cache.evict()
 
     ######################HELPER METHODS########################
 
     def validate(self):
+        if not self.in_memory_capture:
+            self.validate_storage_folder()
+        if self.image_filename_extension.lower() not in IMAGE_FORMATS:
+            logging.warn("The image filename extension provided '{0}' is not supported. Supported filename extensions are: {1}. The default extension: {2} will be used"
+                .format(self.image_filename_extension, sorted(IMAGE_FORMATS), self.image_filename_extension_default))
+            self.image_filename_extension = self.image_filename_extension_default
+        if self.jpeg_quality < 1 or self.jpeg_quality > 100:
+            raise Exception("The JPEG quality must be a number between 1 and 100. Value given: {0}"
+                .format(self.jpeg_quality))
+        if self.encoding_workers < 0:
+            raise Exception("The number of encoding workers must be a number greater than or equal to 0. Value given: {0}"
+                .format(self.encoding_workers))
+        if self.image_cache_size <= 1:
+            raise Exception("The number of images to keep on disk must be at least 2. Value given: {0}"
+                .format(self.image_cache_size))
+        if not self.camera.isOpened():
+            raise Exception("Could not open video device to use to capture pictures. Check the permissions of the user running the program and try again.")
+
+    def validate_storage_folder(self):
         if not os.access(self.image_storage_folder, os.F_OK):
             raise Exception("The folder ({0}) specified for image storage does not exist"
                 .format(self.image_storage_folder))
@@ -148,21 +233,103 @@ class USBCamera(DataSourceInterface):
         if not os.access(self.image_storage_folder, os.W_OK):
             raise Exception("The folder ({0}) specified for image storage is not writtable"
                 .format(self.image_storage_folder))
-        if 'jpg' not in self.image_filename_extension and 'png' not in self.image_filename_extension:
-            logging.warn("The image filename extension provided '{0}' is not supported. Supported filename extensions are: .jpg and .png. The default extension: {1} will be used"
-                .format(self.image_filename_extension, self.image_filename_extension_default))
-            self.image_filename_extension = self.image_filename_extension_default
-        if self.image_cache_size <= 1:
-            raise Exception("The number of images to keep on disk must be at least 2. Value given: {0}"
-                .format(self.image_cache_size))
-        if not self.camera.isOpened():
-            raise Exception("Could not open video device to use to capture pictures. Check the permissions of the user running the program and try again.")
         
-    def generate_image_filename(self):
+    def read_brightness(self):
+        # Helper function to get the mean brightness of a sparse sample of a new frame, None if no frame was read
+        ret, frame = self.camera.read()
+        if not ret:
+            return None
+        return float(frame[::16, ::16].mean())
+
+    def read_frame(self):
+        # Helper function to get the newest frame from the camera along with the time it was grabbed
+        if not self.continuous_grab:
+            ret, frame = self.camera.read()
+            if not ret:
+                raise Exception("Can't receive frame (stream end?). Exiting ...")
+            return frame, datetime.datetime.now().timestamp()
+
+        if not self._frame_ready.wait(FRAME_GRABBER_TIMEOUT_SECONDS):
+            raise Exception("No frame was grabbed from the camera in the last {0} seconds".format(FRAME_GRABBER_TIMEOUT_SECONDS))
+        with self._frame_lock:
+            if self._latest_frame_time < time.monotonic() - FRAME_GRABBER_TIMEOUT_SECONDS:
+                raise Exception("No frame was grabbed from the camera in the last {0} seconds".format(FRAME_GRABBER_TIMEOUT_SECONDS))
+            if self._capture_frame is None or self._capture_frame.shape != self._latest_frame.shape:
+                self._capture_frame = np.empty_like(self._latest_frame)
+            np.copyto(self._capture_frame, self._latest_frame)
+            return self._capture_frame, self._latest_frame_timestamp
+
+    def start_frame_grabber(self):
+        # Helper function to start the thread that keeps the newest frame of the camera in memory
+        self._frame_lock = threading.Lock()
+        self._frame_ready = threading.Event()
+        self._latest_frame = None
+        self._latest_frame_time = None
+        self._latest_frame_timestamp = None
+        self._back_frame = None
+        self._capture_frame = None
+        grabber_thread = threading.Thread(target=self.grab_frames,
+            name='FrameGrabberThread-{0}'.format(self.device_index), daemon=True)
+        grabber_thread.start()
+
+    def grab_frames(self):
+        # Grabs frames at the rate of the device so the driver never hands out stale buffered frames.
+        # Each frame is decoded into a preallocated back buffer which is then swapped with the newest frame
+        logging.info("Starting continuous frame grabbing for device %s", self.device_index)
+        while True:
+            if not self.camera.grab():
+                logging.error("Can't grab frame from device %s (stream end?). Retrying ...", self.device_index)
+                sleep(FRAME_GRABBER_RETRY_DELAY_SECONDS)
+                continue
+            grabbed_at = time.monotonic()
+            grabbed_timestamp = datetime.datetime.now().timestamp()
+            ret, frame = self.camera.retrieve(self._back_frame)
+            if not ret:
+                continue
+            with self._frame_lock:
+                self._back_frame = self._latest_frame
+                self._latest_frame = frame
+                self._latest_frame_time = grabbed_at
+                self._latest_frame_timestamp = grabbed_timestamp
+            self._frame_ready.set()
+
+    def encode_image(self, image, creation_timestamp, filename):
+        # Helper function to encode an image in memory or to the storage folder. With encoding workers, the
+        # image is encoded in the background and the captured data is complete once its encoding finished
+        filepath = None
+        if self.in_memory_capture:
+            logging.info("Capturing image in memory...")
+        else:
+            logging.info("Capturing image to folder %s...", self.image_storage_folder)
+            filepath = os.path.join(self.image_storage_folder, filename)
+        parameters = self.image_encoding.get_parameters(self.jpeg_quality)
+        if self.encoder_pool is not None:
+            data = CapturedData(creation_timestamp, upload_file_path=filepath,
+                upload_filename=filename if self.in_memory_capture else None)
+            data.set_pending_encoding(self.encoder_pool.submit(image, self.image_scale, self.image_filename_extension,
+                parameters, filepath))
+        else:
+            encoded_image, encode_duration = encode_frame(image, self.image_scale, self.image_filename_extension,
+                parameters, filepath)
+            if self.in_memory_capture:
+                data = CapturedData(creation_timestamp, upload_data=memoryview(encoded_image), upload_filename=filename)
+            else:
+                data = CapturedData(creation_timestamp, upload_file_path=filepath)
+            data.set_encode_duration(encode_duration)
+        if filepath is not None:
+            self.local_cache.add(filepath)
+        data.set_encoding(self.image_encoding.describe(self.jpeg_quality, self.image_scale))
+        logging.debug("Captured image %s", filename)
+        return data
+
+    def generate_image_filename(self, suffix=None):
         # Helper function to get the formatted filename for continues image capturing
 
         logging.debug("Generating filename with prefix '%s' and extension '%s'", self.image_filename_prefix, self.image_filename_extension)
-        formatted_filename =  self.image_filename_prefix + str(uuid.uuid4()) + self.image_filename_extension
+        formatted_filename =  self.image_filename_prefix + str(uuid.uuid4())
+        if suffix is not None:
+            formatted_filename += '-' + suffix
+        formatted_filename += self.image_filename_extension
 
         return formatted_filename
 
@@ -1,23 +1,63 @@
 import json
+import os
 
 class CapturedData():
     """
     A class used to hold the values returned from an analytics platform
     """
-    def __init__(self, creation_timestamp, device_id=None, upload_file_path=None):
+    def __init__(self, creation_timestamp, device_id=None, upload_file_path=None, upload_data=None, upload_filename=None):
         self.device_id = device_id
         self.creation_timestamp = creation_timestamp
         self.upload_file_path = upload_file_path
+        self.upload_data = upload_data
+        self.upload_filename = upload_filename
         self.storage_path = ""
+        self.encoding = None
+        self.encode_duration_seconds = None
+        self.people_count = None
+        self.regions = None
+        self.uploaded_size = 0
+        self.object_name = None
+        self.burst_id = None
+        self.pending_encoding = None
+        self.pack_format = None
+        self.frames = None
 
-    def to_json(self):
+    def to_dict(self):
         x = {
             "type": "data",
             "deviceID": self.device_id,
             "filePath": self.storage_path,
             "creationTimestamp": self.creation_timestamp
         }
-        return json.dumps(x)
+        if self.encoding is not None:
+            x["encoding"] = self.encoding
+        if self.people_count is not None:
+            x["peopleCount"] = self.people_count
+        if self.regions is not None:
+            x["regions"] = self.regions
+        if self.burst_id is not None:
+            x["burstID"] = self.burst_id
+        if self.frames is not None:
+            x["packFormat"] = self.pack_format
+            x["frames"] = self.frames
+        return x
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, x):
+        # Rebuilds the metadata of captured data from the dictionary produced by to_dict
+        data = cls(x["creationTimestamp"], device_id=x["deviceID"])
+        data.set_storage_path(x["filePath"])
+        data.set_encoding(x.get("encoding"))
+        data.set_people_count(x.get("peopleCount"))
+        data.set_regions(x.get("regions"))
+        data.set_burst_id(x.get("burstID"))
+        if "frames" in x:
+            data.set_pack(x["packFormat"], x["frames"])
+        return data
 
     def upload_file_exists(self):
         if self.upload_file_path is None:
@@ -27,6 +67,82 @@ class CapturedData():
     def get_upload_file_path(self):
         return self.upload_file_path
 
+    def upload_data_exists(self):
+        if self.upload_data is None:
+            return False
+        return True
+
+    def get_upload_data(self):
+        return self.upload_data
+
+    def load_upload_file(self):
+        # Reads the file to upload into memory, so the upload no longer depends on the file being on disk
+        with open(self.upload_file_path, 'rb') as upload_file:
+            self.upload_data = upload_file.read()
+
+    def get_upload_filename(self):
+        return self.upload_filename
+
+    def get_upload_size(self):
+        # Number of bytes to upload to the object store
+        if self.upload_data is not None:
+            return memoryview(self.upload_data).nbytes
+        if self.upload_file_path is not None:
+            return os.path.getsize(self.upload_file_path)
+        return 0
+
+    def set_pending_encoding(self, pending_encoding):
+        # Future of an encoding running in the background. The image to upload is only available once it finished
+        self.pending_encoding = pending_encoding
+
+    def encoding_pending(self):
+        return self.pending_encoding is not None
+
+    def wait_for_encoding(self):
+        # Waits for the encoding running in the background and keeps the encoded image. Raises its error if it failed
+        encoded_image, encode_duration_seconds = self.pending_encoding.result()
+        self.pending_encoding = None
+        if encoded_image is not None:
+            self.upload_data = memoryview(encoded_image)
+        self.encode_duration_seconds = encode_duration_seconds
+
+    def set_encoding(self, encoding):
+        # Parameters the image was encoded with, e.g. {"quality": 80, "scale": 0.5}
+        self.encoding = encoding
+
+    def set_encode_duration(self, encode_duration_seconds):
+        # Time spent encoding the image, when the data source can measure it separately from the capture
+        self.encode_duration_seconds = encode_duration_seconds
+
+    def set_people_count(self, people_count):
+        # Number of people counted in the image on the device, when people counting is enabled
+        self.people_count = people_count
+
+    def set_regions(self, regions):
+        # Regions of the camera frame the image holds, e.g. [{"name": "door", "x": 0, "y": 0, "width": 320, "height": 480}].
+        # Tiled images also give the position of each region in the image with "tileX" and "tileY"
+        self.regions = regions
+
+    def set_uploaded_size(self, uploaded_size):
+        # Number of bytes uploaded to the object store, 0 until the upload succeeds
+        self.uploaded_size = uploaded_size
+
+    def set_object_name(self, object_name):
+        # Name of the object to create in the object store, chosen by the daemon according to its key layout
+        self.object_name = object_name
+
+    def set_burst_id(self, burst_id):
+        # ID of the burst the image was captured in, when it was requested over the MQTT control topic
+        self.burst_id = burst_id
+
+    def set_pack(self, pack_format, frames):
+        # Format of an object packing several images, and the metadata of each image along with its byte offset and length
+        self.pack_format = pack_format
+        self.frames = frames
+
+    def is_pack(self):
+        return self.frames is not None
+
     def set_storage_path(self, storage_path):
         self.storage_path = storage_path
 
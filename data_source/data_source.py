@@ -15,11 +15,18 @@ class DataSourceInterface(abc.ABC):
 
     @abc.abstractmethod
     def capture_data(self):
-        # The function should capture a single data point from a source or device
+        # The function should capture a single data point from a source or device.
+        # It can return None when the data point is not worth reporting (e.g. nothing changed)
+        # or a list of data points when a capture produces several (e.g. one per region of interest)
         pass
 
     @abc.abstractmethod
     def clean_local_cache(self):
         # The function should clear the local disk if it is being used
         pass
-    
\ No newline at end of file
+
+    @abc.abstractmethod
+    def set_encoding_parameters(self, jpeg_quality, image_scale):
+        # The function should change the quality and the scale used to encode the next data points.
+        # The quality is ignored by lossless formats
+        pass
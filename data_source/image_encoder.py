@@ -0,0 +1,189 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+from data_source.worker_pool import get_worker_context, create_worker_pool
+import concurrent.futures
+import logging
+import queue
+import time
+import numpy as np
+import cv2 as cv
+
+FORMAT_JPEG = 'jpeg'
+FORMAT_WEBP = 'webp'
+FORMAT_PNG = 'png'
+# Image filename extensions and the format they are encoded with
+IMAGE_FORMATS = {'.jpg': FORMAT_JPEG, '.jpeg': FORMAT_JPEG, '.webp': FORMAT_WEBP, '.png': FORMAT_PNG}
+
+# Number of frames each worker process can have waiting in shared memory
+SLOTS_PER_WORKER = 2
+
+# Shared memory slots of the worker process, received when the process starts
+_slots = None
+
+class ImageEncoding():
+    """
+    A class used to hold how the images of a camera are encoded, based on the extension of their filenames.
+
+    JPEG and WebP images are lossy and encoded with a quality between 1 and 100. JPEG images can also be
+    optimized, which makes them smaller for more CPU time, and progressive. PNG images are lossless and
+    encoded with a compression level between 0 (fastest) and 9 (smallest).
+    """
+    def __init__(self, extension, jpeg_optimize=False, jpeg_progressive=False, png_compression=1):
+        self.extension = extension
+        self.format = IMAGE_FORMATS.get(extension.lower())
+        self.jpeg_optimize = jpeg_optimize
+        self.jpeg_progressive = jpeg_progressive
+        self.png_compression = png_compression
+        self.validate()
+
+    def is_lossy(self):
+        return self.format != FORMAT_PNG
+
+    def get_parameters(self, quality):
+        # The OpenCV parameters of the format, with the given quality for lossy formats
+        if self.format == FORMAT_JPEG:
+            return [cv.IMWRITE_JPEG_QUALITY, quality, cv.IMWRITE_JPEG_OPTIMIZE, int(self.jpeg_optimize),
+                cv.IMWRITE_JPEG_PROGRESSIVE, int(self.jpeg_progressive)]
+        if self.format == FORMAT_WEBP:
+            return [cv.IMWRITE_WEBP_QUALITY, quality]
+        return [cv.IMWRITE_PNG_COMPRESSION, self.png_compression]
+
+    def describe(self, quality, scale):
+        # Describes the encoding of an image to its consumers
+        encoding = {"format": self.format, "scale": scale}
+        if self.is_lossy():
+            encoding["quality"] = quality
+        else:
+            encoding["compression"] = self.png_compression
+        return encoding
+
+    ######################HELPER METHODS########################
+
+    def validate(self):
+        if self.format is None:
+            raise Exception("The image filename extension '{0}' is not supported. Supported filename extensions are: {1}"
+                .format(self.extension, sorted(IMAGE_FORMATS)))
+        if self.png_compression < 0 or self.png_compression > 9:
+            raise Exception("The PNG compression level must be a number between 0 and 9. Value given: {0}"
+                .format(self.png_compression))
+
+def encode_frame(image, scale, extension, parameters, filepath=None):
+    """
+    Encodes an image, in memory or to a file.
+
+    Parameters:
+    image (numpy.ndarray): The image to encode
+    scale (float): Factor between 0 and 1 applied to the resolution of the image before it is encoded
+    extension (string): The image filename extension giving the format
+    parameters (list): The OpenCV parameters of the format
+    filepath (string): Optional path of the file to write. The image is encoded in memory otherwise
+
+    Returns:
+    tuple: The encoded image (numpy.ndarray), None when it was written to a file, and the time spent in seconds
+    """
+    start = time.monotonic()
+    if scale < 1:
+        image = cv.resize(image, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    if filepath is not None:
+        if not cv.imwrite(filepath, image, parameters):
+            raise Exception("Could not write frame to file {0}".format(filepath))
+        return None, time.monotonic() - start
+    ret, encoded_image = cv.imencode(extension, image, parameters)
+    if not ret:
+        raise Exception("Could not encode frame with extension {0}".format(extension))
+    return encoded_image, time.monotonic() - start
+
+def initialize_worker(slots):
+    global _slots
+    _slots = slots
+
+def encode_slot(slot, shape, dtype, scale, extension, parameters, filepath):
+    # Encodes the image held in a shared memory slot. Runs in a worker process
+    image = np.frombuffer(_slots[slot], dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    encoded_image, duration = encode_frame(image, scale, extension, parameters, filepath)
+    if encoded_image is not None:
+        encoded_image = encoded_image.tobytes()
+    return encoded_image, duration
+
+def encode_image(image, scale, extension, parameters, filepath):
+    # Encodes an image passed by value, when it does not fit in a slot. Runs in a worker process
+    encoded_image, duration = encode_frame(image, scale, extension, parameters, filepath)
+    if encoded_image is not None:
+        encoded_image = encoded_image.tobytes()
+    return encoded_image, duration
+
+class EncoderPool():
+    """
+    A class used to encode images on all the cores of the device, so encoding does not limit the capture rate.
+
+    Frames are copied once into slots of shared memory allocated when the pool starts, instead of being
+    pickled through a pipe, and the workers encode them in place. Only the encoded image, which is far
+    smaller, is sent back. When every slot is in use, submitting blocks until a worker is done, which
+    bounds the memory held by pending frames and slows the capture down to the rate the workers sustain.
+    """
+    def __init__(self, workers, slot_size_bytes):
+        if workers <= 0:
+            raise Exception("The number of encoding workers must be a number greater than 0. Value given: {0}"
+                .format(workers))
+        self.slot_size_bytes = slot_size_bytes
+        self._slots = [get_worker_context().RawArray('B', slot_size_bytes) for _ in range(workers * SLOTS_PER_WORKER)]
+        self._free_slots = queue.Queue()
+        for slot in range(len(self._slots)):
+            self._free_slots.put(slot)
+        self._pool = create_worker_pool(workers, initializer=initialize_worker, initargs=(self._slots,))
+        logging.info("Started %d encoding workers", workers)
+
+    def submit(self, image, scale, extension, parameters, filepath=None):
+        """
+        Encodes an image in a worker process. The image can be reused by the caller as soon as this returns.
+
+        Parameters:
+        image (numpy.ndarray): The image to encode
+        scale (float): Factor between 0 and 1 applied to the resolution of the image before it is encoded
+        extension (string): The image filename extension giving the format
+        parameters (list): The OpenCV parameters of the format
+        filepath (string): Optional path of the file to write. The image is encoded in memory otherwise
+
+        Returns:
+        concurrent.futures.Future: Resolves to the encoded image (bytes), None when it was written to a file,
+        and the time spent in seconds
+        """
+        future = concurrent.futures.Future()
+        slot = None
+        if image.nbytes <= self.slot_size_bytes:
+            slot = self._free_slots.get()
+            shared_image = np.frombuffer(self._slots[slot], dtype=image.dtype, count=image.size).reshape(image.shape)
+            np.copyto(shared_image, image)
+            task, args = encode_slot, (slot, image.shape, image.dtype.str, scale, extension, parameters, filepath)
+        else:
+            logging.warning("Image of %d bytes larger than the encoding slots. Passing it by value", image.nbytes)
+            task, args = encode_image, (np.ascontiguousarray(image), scale, extension, parameters, filepath)
+
+        def on_result(result):
+            self.release(slot)
+            future.set_result(result)
+
+        def on_error(e):
+            self.release(slot)
+            future.set_exception(e)
+
+        try:
+            self._pool.apply_async(task, args, callback=on_result, error_callback=on_error)
+        except Exception:
+            # The pool is closed
+            self.release(slot)
+            raise
+        return future
+
+    def release(self, slot):
+        if slot is not None:
+            self._free_slots.put(slot)
+
+    def close(self):
+        # Waits for the images being encoded. Terminating the workers while one of them sends back an
+        # encoded image can deadlock the pool, since the image does not fit in the pipe
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,62 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import collections
+import logging
+import os
+
+class LocalImageCache():
+    """
+    A class used to keep a bounded number of images on the local disk.
+
+    The files written by a data source are tracked in a ring buffer so the oldest file is evicted
+    as soon as a new one is written, without listing the folder or reading file metadata.
+    """
+    def __init__(self, folder, filename_prefix, filename_extension, capacity):
+        self.folder = folder
+        self.filename_prefix = filename_prefix
+        self.filename_extension = filename_extension
+        self.capacity = capacity
+        self._filepaths = collections.deque()
+
+    def adopt_existing(self):
+        # One-time scan of the folder to track images left over by a previous run, oldest first
+        try:
+            filenames = os.listdir(self.folder)
+        except Exception as e:
+            logging.error("An error occurred that prevented the listing of images in the image folder. Error: %s", str(e))
+            return
+
+        existing = []
+        for filename in filenames:
+            if filename.startswith(self.filename_prefix) and filename.endswith(self.filename_extension):
+                filepath = os.path.join(self.folder, filename)
+                try:
+                    existing.append((os.path.getctime(filepath), filepath))
+                except Exception as e:
+                    logging.error("An error occurred that prevented the access to the creation time of the file ({0}). Error: {1}"
+                        .format(filepath, str(e)))
+        existing.sort()
+        logging.debug("Adopting %d images left in the image folder", len(existing))
+        for _, filepath in existing:
+            self._filepaths.append(filepath)
+        self.evict()
+
+    def add(self, filepath):
+        # Tracks a newly written image and evicts the oldest images past the capacity
+        self._filepaths.append(filepath)
+        self.evict()
+
+    def evict(self):
+        while len(self._filepaths) > self.capacity:
+            filepath = self._filepaths.popleft()
+            logging.debug("Deleting file: %s", filepath)
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logging.error("An error occurred that prevented the deletion of the file ({0}) in the image folder. Error: {1}"
+                    .format(filepath, str(e)))
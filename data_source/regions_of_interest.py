@@ -0,0 +1,96 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import numpy as np
+
+ROI_MODE_SEPARATE = 'separate'
+ROI_MODE_TILED = 'tiled'
+ROI_MODES = [ROI_MODE_SEPARATE, ROI_MODE_TILED]
+
+class RegionsOfInterest():
+    """
+    A class used to extract the regions of interest of a frame before it is encoded.
+
+    Regions are cropped with NumPy slices, which are views of the frame and copy nothing. In "separate" mode
+    each region is encoded and uploaded as its own image. In "tiled" mode the regions are copied side by side
+    into a single composite image, which is kept between frames.
+    """
+    def __init__(self, regions_args, mode, image_resolution):
+        self.regions = []
+        for region_args in regions_args:
+            self.regions.append({
+                "name": region_args['name'],
+                "x": region_args['x'],
+                "y": region_args['y'],
+                "width": region_args['width'],
+                "height": region_args['height']
+            })
+        self.mode = mode
+        self._composite = None
+        self._composite_regions = None
+        self._frame_shape = None
+        self.validate(image_resolution)
+
+    def extract(self, frame):
+        """
+        Crops the regions of interest of a frame.
+
+        Parameters:
+        frame (numpy.ndarray): The full frame of the camera
+
+        Returns:
+        list: Tuples of (image, regions, name) with the image to encode, the description of the regions
+        it holds and a name to tell the images of a frame apart
+        """
+        if self.mode == ROI_MODE_SEPARATE:
+            images = []
+            for region in self.regions:
+                crop = self.crop(frame, region)
+                cropped_region = dict(region, width=crop.shape[1], height=crop.shape[0])
+                images.append((crop, [cropped_region], region['name']))
+            return images
+
+        if self._composite is None or frame.shape != self._frame_shape:
+            self.layout_composite(frame)
+        for region, composite_region in zip(self.regions, self._composite_regions):
+            tile_x, tile_y = composite_region['tileX'], composite_region['tileY']
+            self._composite[tile_y:tile_y + composite_region['height'], tile_x:tile_x + composite_region['width']] = \
+                self.crop(frame, region)
+        return [(self._composite, self._composite_regions, 'tiled')]
+
+    ######################HELPER METHODS########################
+
+    def crop(self, frame, region):
+        # Slicing clips the region to the frame, in case the camera delivers a smaller resolution than requested
+        return frame[region['y']:region['y'] + region['height'], region['x']:region['x'] + region['width']]
+
+    def layout_composite(self, frame):
+        # Places the regions from left to right in a single row and allocates the composite image
+        self._frame_shape = frame.shape
+        self._composite_regions = []
+        tile_x = 0
+        composite_height = 0
+        for region in self.regions:
+            crop = self.crop(frame, region)
+            self._composite_regions.append(dict(region, width=crop.shape[1], height=crop.shape[0], tileX=tile_x, tileY=0))
+            tile_x += crop.shape[1]
+            composite_height = max(composite_height, crop.shape[0])
+        self._composite = np.zeros((composite_height, tile_x) + frame.shape[2:], dtype=frame.dtype)
+
+    def validate(self, image_resolution):
+        if self.mode not in ROI_MODES:
+            raise Exception("The regions of interest mode '{0}' is not supported. Supported modes are: {1}"
+                .format(self.mode, ROI_MODES))
+        if len(self.regions) == 0:
+            raise Exception("At least one region of interest must be given")
+        names = set()
+        for region in self.regions:
+            if region['name'] in names:
+                raise Exception("More than one region of interest is named '{0}'".format(region['name']))
+            names.add(region['name'])
+            if region['x'] < 0 or region['y'] < 0 or region['width'] <= 0 or region['height'] <= 0 or \
+                region['x'] + region['width'] > image_resolution[0] or region['y'] + region['height'] > image_resolution[1]:
+                raise Exception("The region of interest '{0}' does not fit in the resolution of the images ({1})"
+                    .format(region['name'], image_resolution))
@@ -0,0 +1,24 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import multiprocessing
+
+def get_worker_context():
+    # The workers are spawned rather than forked so they do not inherit the camera and the threads of the daemon
+    return multiprocessing.get_context('spawn')
+
+def create_worker_pool(workers, initializer=None, initargs=()):
+    """
+    Starts a pool of worker processes to run CPU-bound work, e.g. encoding or inference, on all the cores.
+
+    Parameters:
+    workers (int): Number of worker processes
+    initializer (function): Optional function run by each worker process when it starts
+    initargs (tuple): Arguments of the initializer
+
+    Returns:
+    multiprocessing.pool.Pool: The pool of worker processes
+    """
+    return get_worker_context().Pool(workers, initializer=initializer, initargs=initargs)
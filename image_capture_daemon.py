@@ -4,6 +4,8 @@
 # SPDX-License-Identifier: BSD-2-Clause
 #
 import time
+# Taken before the other imports so the startup report includes them
+PROCESS_START_TIME = time.monotonic()
 from time import sleep
 import argparse
 import os
@@ -16,8 +18,23 @@ import datetime
 import paho.mqtt.client as mqtt
 import json
 import socket
-from object_store.providers.minio_object_store import MinioObjectStore as store
-from data_source.connected_devices.usb_camera import USBCamera as device
+import importlib
+import concurrent.futures
+from object_store.retention_index import RetentionIndex
+from object_store.key_layout import create_key_layout, KEY_LAYOUTS, LAYOUT_FLAT, LAYOUT_TIME_PARTITIONED
+from pipeline.async_runner import AsyncRunner
+from pipeline.bandwidth_controller import BandwidthController
+from pipeline.capture_log import CaptureLog
+from pipeline.frame_packer import FramePacker, PACK_FORMATS, PACK_FORMAT_TAR
+from pipeline.burst import BurstCommand, BurstTracker
+from pipeline.bounded_queue import BoundedQueue, DROP_POLICIES, DROP_OLDEST
+from pipeline.metrics import MetricsRegistry, start_metrics_server
+from pipeline.people_counter import InferencePool, PeopleCountPolicy
+from pipeline.payload_encoder import PayloadEncoder, PAYLOAD_FORMATS, FORMAT_JSON
+from pipeline.scheduler import FixedRateScheduler, OVERRUN_POLICIES, OVERRUN_SKIP, OVERRUN_CATCH_UP
+from pipeline.spool import Spool, DrainBackoff, RECORD_UPLOAD, RECORD_MQTT_MESSAGE
+from pipeline.startup_timer import StartupTimer
+from data_source.data import CapturedData
 
 format = "%(asctime)s - %(levelname)s: %(threadName)s - %(message)s"
 logging.basicConfig(format=format, level=logging.DEBUG,
@@ -25,6 +42,18 @@ logging.basicConfig(format=format, level=logging.DEBUG,
 
 mqtt_client_connection_error = ""
 
+# Object store implementations that can be selected from the command line. They are imported
+# only when selected so their client libraries do not have to be installed otherwise
+OBJECT_STORE_MODULES = {
+    'minio': ('object_store.providers.minio_object_store', 'MinioObjectStore'),
+    'minio-sharded': ('object_store.providers.sharded_minio_object_store', 'ShardedMinioObjectStore'),
+    's3': ('object_store.providers.s3_object_store', 'S3ObjectStore')
+}
+# Max number of objects listed under an expired prefix before they are deleted
+PREFIX_DELETE_BATCH_SIZE = 1000
+# The data source is imported the same way so OpenCV and numpy are only loaded when it is created
+DATA_SOURCE_MODULE = ('data_source.connected_devices.usb_camera', 'USBCamera')
+
 # Define event callbacks for MQTT client
 def on_connect(client, userdata, flags, rc):
     global mqtt_client_connection_error
@@ -35,30 +64,78 @@ def on_connect(client, userdata, flags, rc):
 def on_publish(client, obj, mid):
     logging.debug("mid: " + str(mid))
 
+class DataSourceContext():
+    """
+    A class used to hold a data source along with the settings the daemon uses to schedule it
+    """
+    def __init__(self, device, device_id, image_capture_interval_seconds, overrun_policy, bandwidth_controller=None,
+        people_count_policy=None):
+        self.device = device
+        self.device_id = device_id
+        self.image_capture_interval_seconds = image_capture_interval_seconds
+        self.scheduler = FixedRateScheduler(device_id, image_capture_interval_seconds, overrun_policy)
+        self.bandwidth_controller = bandwidth_controller
+        self.people_count_policy = people_count_policy
+        # Each camera has its own lock so captures of different cameras never wait on each other
+        self.folder_lock = threading.RLock()
+
 class App():
-    def __init__(self):
-        # Initialization function which parses command-line arguments from the user as well as set defaults
+    def __init__(self, argv=None, mqtt_client=None, object_store=None, data_source_class=None):
+        # Initialization function which parses command-line arguments from the user as well as set defaults.
+        # The MQTT client, the object store and the data source class can be injected, e.g. to run benchmarks
+        # without hardware. An injected object store must already be initialized
 
         # Variables needed for the internal mechanisms of the class
-        self.folder_lock = threading.RLock()
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_qos_level = 0
+        self.startup_timer = StartupTimer(PROCESS_START_TIME)
+        self.startup_timer.record('imports', time.monotonic() - PROCESS_START_TIME)
+        self.mqtt_connected = threading.Event()
+        if mqtt_client is None:
+            mqtt_client = mqtt.Client()
+        self.mqtt_client = mqtt_client
 
         # Assign event callbacks for MQTT client
-        self.mqtt_client.on_connect = on_connect
-        self.mqtt_client.on_publish = on_publish
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_publish = self.on_publish
 
         # Default values for the command line arguments
         image_capture_interval_seconds_default = 10
         image_cache_size_default = 10
         image_cleanup_interval_minutes_default = 1
         mqtt_topic_default = 'image/latest'
+        mqtt_connect_timeout_seconds_default = 10
+        upload_workers_default = 2
+        queue_size_default = 10
+        queue_drop_policy_default = DROP_OLDEST
+        spool_max_size_mb_default = 512
+        spool_drain_rate_default = 10
+        spool_batch_size_default = 50
+        capture_log_max_size_mb_default = 64
+        mqtt_qos_default = 0
+        mqtt_max_inflight_default = 20
+        mqtt_batch_size_default = 1
+        mqtt_batch_interval_ms_default = 1000
+        mqtt_payload_format_default = FORMAT_JSON
+        object_store_module_default = 'minio'
+        object_key_layout_default = LAYOUT_FLAT
+        capture_overrun_policy_default = OVERRUN_SKIP
+        inference_workers_default = os.cpu_count() or 1
+        burst_max_frames_default = 100
+        burst_max_fps_default = 30
+        burst_upload_workers_default = 4
+        burst_max_duration_seconds_default = 60
+        pack_frames_default = 0
+        pack_interval_seconds_default = 10
+        pack_format_default = PACK_FORMAT_TAR
 
         # Parse values from the command line
         parser = argparse.ArgumentParser(description='People counter image ingestion service')
-        parser.add_argument('--image-capture-interval', '-i', dest='image_capture_interval_seconds', type=int, 
+        parser.add_argument('--image-capture-interval', '-i', dest='image_capture_interval_seconds', type=float, 
             default=image_capture_interval_seconds_default,
-            help="Delay in seconds between image captures (default: {0})".format(str(image_capture_interval_seconds_default)))
+            help="Period in seconds between image captures. Fractions of a second are allowed (default: {0})".format(str(image_capture_interval_seconds_default)))
+        parser.add_argument('--capture-overrun-policy', dest='capture_overrun_policy', choices=OVERRUN_POLICIES,
+            default=capture_overrun_policy_default,
+            help="What to do with the captures that were due while a capture took longer than the capture period: " \
+                "skip them or catch up by running them back-to-back (default: {0})".format(capture_overrun_policy_default))
         parser.add_argument('--image-cache-size', '-c', dest='image_cache_size', type=int, default=image_cache_size_default,
             help="Number of files to keep in the object store (default: {0})".format(image_cache_size_default))
         parser.add_argument('--image-cleanup-interval', '-u', dest='image_cleanup_interval_minutes', type=int,
@@ -75,18 +152,337 @@ class App():
             help="Host port to use to connect to MQTT instance to publish messages about new available images (default: none)")
         parser.add_argument('--mqtt-topic', '-o', dest='mqtt_topic', default=mqtt_topic_default, 
             help="MQTT topic to publish mesages about new available images (default: {0})".format(mqtt_topic_default))
+        parser.add_argument('--mqtt-connect-timeout', dest='mqtt_connect_timeout_seconds', type=float,
+            default=mqtt_connect_timeout_seconds_default,
+            help="Max number of seconds to wait for the MQTT broker to accept the connection on startup (default: {0})"
+                .format(mqtt_connect_timeout_seconds_default))
+        parser.add_argument('--mqtt-qos', dest='mqtt_qos_level', type=int, choices=[0, 1, 2], default=mqtt_qos_default,
+            help="QoS level of the MQTT messages about new available images (default: {0})".format(mqtt_qos_default))
+        parser.add_argument('--mqtt-max-inflight', dest='mqtt_max_inflight', type=int, default=mqtt_max_inflight_default,
+            help="Max number of QoS 1 and 2 MQTT messages waiting to be acknowledged by the broker (default: {0})"
+                .format(mqtt_max_inflight_default))
+        parser.add_argument('--mqtt-batch-size', dest='mqtt_batch_size', type=int, default=mqtt_batch_size_default,
+            help="Max number of images advertised in a single MQTT message. Values greater than 1 publish " \
+                "messages of type 'batch' (default: {0})".format(mqtt_batch_size_default))
+        parser.add_argument('--mqtt-batch-interval', dest='mqtt_batch_interval_ms', type=int, default=mqtt_batch_interval_ms_default,
+            help="Max delay in milliseconds an image waits for a batch to fill up before it is published (default: {0})"
+                .format(mqtt_batch_interval_ms_default))
+        parser.add_argument('--mqtt-payload-format', dest='mqtt_payload_format', choices=PAYLOAD_FORMATS,
+            default=mqtt_payload_format_default,
+            help="Encoding of the MQTT messages (default: {0})".format(mqtt_payload_format_default))
+        parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=None,
+            help='Port of the HTTP endpoint serving metrics in the Prometheus text format at /metrics ' \
+                '(default: none, endpoint disabled)')
         parser.add_argument('--pulse-device-id', '-v', dest='pulse_device_id', required=True,
-            help='Pulse ID associated with the camera device (default: none)')
+            help='Pulse ID associated with the camera device. Used for every camera that does not set its own ' \
+                '"device_id" in the data source module arguments (default: none)')
+        parser.add_argument('--object-store-module', '-m', dest='object_store_module', choices=sorted(OBJECT_STORE_MODULES),
+            default=object_store_module_default,
+            help="Object store implementation to upload images to (default: {0})".format(object_store_module_default))
+        parser.add_argument('--object-key-layout', dest='object_key_layout', choices=KEY_LAYOUTS,
+            default=object_key_layout_default,
+            help="Names of the objects in the object store. 'flat' uses the names of the images and 'time-partitioned' " \
+                "uses <device>/<yyyy>/<mm>/<dd>/<hh>/<timestamp>-<seq> in UTC (default: {0})".format(object_key_layout_default))
+        parser.add_argument('--image-retention-hours', dest='image_retention_hours', type=float, default=None,
+            help='Age in hours past which images are deleted from the object store, a whole hour of a device at a time. ' \
+                'Requires the time-partitioned key layout and replaces the count-based retention of ' \
+                '--image-cache-size (default: none, count-based retention)')
         parser.add_argument('--object-store-module-arguments', '-b', dest='object_store_module_arguments', required=True,
             help='JSON string with the arguments to the object store module (default: none)')
         parser.add_argument('--data-source-module-arguments', '-a', dest='data_source_module_arguments', required=True,
-            help='JSON string with the arguments to the data source module (default: none)')
-        self.args = parser.parse_args()
+            help='JSON string with the arguments to the data source module. A JSON list of arguments drives ' \
+                'several cameras from this process; each entry may set its own "device_id" and ' \
+                '"image_capture_interval_seconds" (default: none)')
+        parser.add_argument('--upload-workers', '-w', dest='upload_workers', type=int, default=upload_workers_default,
+            help="Number of threads uploading captured data to the object store concurrently (default: {0})"
+                .format(upload_workers_default))
+        parser.add_argument('--queue-size', '-q', dest='queue_size', type=int, default=queue_size_default,
+            help="Max number of captures waiting to be uploaded or published before captures are dropped. " \
+                "When images are written to disk, keep it below the image cache size of the data source (default: {0})"
+                .format(queue_size_default))
+        parser.add_argument('--queue-drop-policy', '-d', dest='queue_drop_policy', choices=DROP_POLICIES,
+            default=queue_drop_policy_default,
+            help="Capture to drop when the uplink falls behind and a queue is full (default: {0})"
+                .format(queue_drop_policy_default))
+        parser.add_argument('--inference-workers', dest='inference_workers', type=int, default=inference_workers_default,
+            help="Number of processes counting people in the images of the cameras that enable people counting " \
+                "(default: the number of CPU cores, {0})".format(inference_workers_default))
+        parser.add_argument('--spool-directory', dest='spool_directory', default=None,
+            help='Folder used to keep uploads and MQTT messages on disk while the object store or the MQTT broker ' \
+                'is unreachable. They are sent when connectivity returns (default: none, spooling disabled)')
+        parser.add_argument('--spool-max-size', dest='spool_max_size_mb', type=int, default=spool_max_size_mb_default,
+            help="Max size in MB of the spool. The oldest records are discarded past this size (default: {0})"
+                .format(spool_max_size_mb_default))
+        parser.add_argument('--spool-drain-rate', dest='spool_drain_rate', type=float, default=spool_drain_rate_default,
+            help="Max number of spooled records sent per second once connectivity returns (default: {0})"
+                .format(spool_drain_rate_default))
+        parser.add_argument('--spool-batch-size', dest='spool_batch_size', type=int, default=spool_batch_size_default,
+            help="Number of spooled records read from disk at a time (default: {0})"
+                .format(spool_batch_size_default))
+        parser.add_argument('--capture-log', dest='capture_log_path', default=None,
+            help='Path of a compact binary log on disk recording every advertised capture: its timestamps, device ID, ' \
+                'storage path, size and encoding. When enabled, the cleanup is seeded from the log instead of a listing ' \
+                'of the object store (default: none, log disabled)')
+        parser.add_argument('--capture-log-max-size', dest='capture_log_max_size_mb', type=int,
+            default=capture_log_max_size_mb_default,
+            help="Max size in MB of the capture log before it is rotated. One rotated log is kept (default: {0})"
+                .format(capture_log_max_size_mb_default))
+        parser.add_argument('--mqtt-control-topic', dest='mqtt_control_topic', default=None,
+            help='MQTT topic to subscribe to for burst commands, e.g. {"deviceID": "camera-1", "frames": 20, "fps": 10}. ' \
+                'Bursts are disabled when not given (default: none)')
+        parser.add_argument('--burst-max-frames', dest='burst_max_frames', type=int, default=burst_max_frames_default,
+            help='Max number of frames a burst command can request (default: {0})'.format(burst_max_frames_default))
+        parser.add_argument('--burst-max-fps', dest='burst_max_fps', type=float, default=burst_max_fps_default,
+            help='Max capture rate in frames per second a burst command can request (default: {0})'.format(burst_max_fps_default))
+        parser.add_argument('--burst-max-duration', dest='burst_max_duration_seconds', type=float,
+            default=burst_max_duration_seconds_default,
+            help='Max number of seconds a burst command can last, i.e. its frames divided by its frame rate (default: {0})'
+                .format(burst_max_duration_seconds_default))
+        parser.add_argument('--burst-upload-workers', dest='burst_upload_workers', type=int,
+            default=burst_upload_workers_default,
+            help='Number of threads uploading the frames of bursts concurrently (default: {0})'.format(burst_upload_workers_default))
+        parser.add_argument('--pack-frames', dest='pack_frames', type=int, default=pack_frames_default,
+            help='Number of images packed into a single object, uploaded and advertised at once. Packing is ' \
+                'disabled with 0 (default: {0})'.format(pack_frames_default))
+        parser.add_argument('--pack-interval', dest='pack_interval_seconds', type=float, default=pack_interval_seconds_default,
+            help='Max time in seconds an image waits in an incomplete pack before the pack is uploaded (default: {0})'
+                .format(pack_interval_seconds_default))
+        parser.add_argument('--pack-format', dest='pack_format', choices=PACK_FORMATS, default=pack_format_default,
+            help='Format of the packs: a tar archive, or a segment of concatenated images followed by their offset ' \
+                'table (default: {0})'.format(pack_format_default))
+        parser.add_argument('--async-core', dest='async_core', action='store_true',
+            help='Run the pipeline on a single asyncio event loop instead of a thread per stage. Blocking ' \
+                'captures and object store calls run in a shared thread pool (default: disabled)')
+        self.args = parser.parse_args(argv)
         self.validate()
-        self.object_store = store()
-        self.object_store.initialize(self.args.object_store_module_arguments)
-        self.device = device()
-        self.device.initialize(self.args.data_source_module_arguments)
+        self.create_metrics()
+        self.payload_encoder = PayloadEncoder(self.args.mqtt_payload_format)
+        self.mqtt_client.max_inflight_messages_set(self.args.mqtt_max_inflight)
+        # Bound the messages paho keeps in memory past the in-flight window. Publishing beyond it fails and spools
+        self.mqtt_client.max_queued_messages_set(self.args.queue_size)
+        self.spool = None
+        if self.args.spool_directory is not None:
+            self.spool = Spool(self.args.spool_directory, self.args.spool_max_size_mb * 1024 * 1024)
+        self.capture_log = None
+        if self.args.capture_log_path is not None:
+            self.capture_log = CaptureLog(self.args.capture_log_path, self.args.capture_log_max_size_mb * 1024 * 1024)
+        self.upload_queue = BoundedQueue('upload', self.args.queue_size, self.args.queue_drop_policy)
+        self.publish_queue = BoundedQueue('publish', self.args.queue_size, self.args.queue_drop_policy)
+        # Objects are only indexed when they are retained by count. Age-based retention lists the prefixes instead
+        self.retention_index = None
+        if self.args.image_retention_hours is None:
+            self.retention_index = RetentionIndex(self.args.image_cache_size)
+        self.burst_tracker = BurstTracker(self.burst_latency)
+        self.burst_executor = None
+        if self.args.mqtt_control_topic is not None:
+            self.burst_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.args.burst_upload_workers,
+                thread_name_prefix='BurstUploadThread')
+            self.mqtt_client.message_callback_add(self.args.mqtt_control_topic, self.on_control_message)
+        self.key_layout = create_key_layout(self.args.object_key_layout)
+        device_args_list = self.parse_data_source_module_arguments()
+        self.inference_pool = None
+        if any('people_counting' in device_args for device_args in device_args_list):
+            self.inference_pool = InferencePool(self.args.inference_workers, self.args.queue_size)
+        if data_source_class is None:
+            module_name, class_name = DATA_SOURCE_MODULE
+            with self.startup_timer.step('data source import'):
+                data_source_class = getattr(importlib.import_module(module_name), class_name)
+
+        # The object store and the cameras are initialized concurrently since most of their initialization
+        # is spent waiting on the network or on the camera warm-up
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(device_args_list) + 1) as executor:
+            object_store_future = None
+            if object_store is None:
+                object_store_future = executor.submit(self.create_object_store)
+            data_source_futures = [executor.submit(self.create_data_source, data_source_class, device_args)
+                for device_args in device_args_list]
+            if object_store_future is not None:
+                object_store = object_store_future.result()
+            data_sources = [future.result() for future in data_source_futures]
+        self.object_store = object_store
+        self.data_sources = []
+        self.data_sources_by_device_id = {}
+        for device_args, data_source in zip(device_args_list, data_sources):
+            interval = device_args.get('image_capture_interval_seconds', self.args.image_capture_interval_seconds)
+            bandwidth_controller = None
+            if 'adaptive_encoding' in device_args:
+                bandwidth_controller = BandwidthController(device_args['adaptive_encoding'], data_source.jpeg_quality, interval,
+                    lossy=not data_source.image_filename_extension.lower().endswith('.png'))
+            people_count_policy = None
+            if 'people_counting' in device_args:
+                people_count_policy = PeopleCountPolicy(device_args['people_counting'])
+            data_source_context = DataSourceContext(
+                data_source,
+                device_args.get('device_id', self.args.pulse_device_id),
+                interval,
+                self.args.capture_overrun_policy,
+                bandwidth_controller,
+                people_count_policy)
+            self.data_sources.append(data_source_context)
+            self.data_sources_by_device_id[data_source_context.device_id] = data_source_context
+        self.frame_packers = None
+        if self.args.pack_frames > 0:
+            self.frame_packers = {data_source.device_id: FramePacker(data_source.device_id, self.args.pack_format,
+                self.args.pack_frames, self.args.pack_interval_seconds) for data_source in self.data_sources}
+
+    def create_metrics(self):
+        # Metrics are always recorded. They are only served when a metrics port is given
+        self.metrics = MetricsRegistry()
+        prefix = 'people_counter_ingestion_'
+        self.capture_duration = self.metrics.histogram(prefix + 'capture_duration_seconds',
+            'Time spent capturing an image, including its encoding')
+        self.encode_duration = self.metrics.histogram(prefix + 'encode_duration_seconds',
+            'Time spent encoding an image, for the data sources that measure it')
+        self.upload_duration = self.metrics.histogram(prefix + 'upload_duration_seconds',
+            'Time spent uploading an image to the object store')
+        self.publish_duration = self.metrics.histogram(prefix + 'publish_duration_seconds',
+            'Time spent handing an MQTT message to the client')
+        self.cleanup_duration = self.metrics.histogram(prefix + 'cleanup_duration_seconds',
+            'Time spent cleaning up the local cache and the object store')
+        self.captures_skipped = self.metrics.counter(prefix + 'captures_skipped_total',
+            'Captures the data sources decided not to report, e.g. because nothing changed')
+        self.bytes_uploaded = self.metrics.counter(prefix + 'uploaded_bytes_total',
+            'Bytes uploaded to the object store')
+        self.objects_deleted = self.metrics.counter(prefix + 'objects_deleted_total',
+            'Objects deleted from the object store by the cleanup')
+        self.messages_published = self.metrics.counter(prefix + 'mqtt_messages_published_total',
+            'MQTT messages handed to the client')
+        self.inference_duration = self.metrics.histogram(prefix + 'inference_duration_seconds',
+            'Time spent counting the people in an image, including its decoding')
+        self.uploads_avoided = self.metrics.counter(prefix + 'uploads_avoided_total',
+            'Images not uploaded because of the upload policy of people counting. Their count is still published')
+        self.burst_latency = self.metrics.histogram(prefix + 'burst_latency_seconds',
+            'Time from the receipt of a burst command to the publish of the first capture of the burst')
+        self.errors = self.metrics.counter(prefix + 'errors_total',
+            'Errors by pipeline stage')
+        self.mqtt_inflight = self.metrics.gauge(prefix + 'mqtt_inflight_messages',
+            'MQTT messages handed to the client and not yet sent or acknowledged')
+        self.metrics.gauge(prefix + 'queue_depth', 'Captures waiting in the queues of the pipeline',
+            lambda: [((('queue', queue.name),), queue.qsize()) for queue in self.get_queues()])
+        self.metrics.counter(prefix + 'captures_dropped_total', 'Captures dropped because a queue of the pipeline was full',
+            lambda: [((('queue', queue.name),), queue.dropped_count) for queue in self.get_queues()])
+
+        self.metrics.gauge(prefix + 'startup_duration_seconds', 'Time spent in each step of the startup of the daemon',
+            lambda: [((('step', name),), duration) for name, duration in self.startup_timer.steps.items()])
+
+    def get_queues(self):
+        # The stages of the pipeline that hold captures, for the metrics
+        queues = [self.upload_queue, self.publish_queue]
+        if self.inference_pool is not None:
+            queues.append(self.inference_pool)
+        return queues
+
+    def create_object_store(self):
+        module_name, class_name = OBJECT_STORE_MODULES[self.args.object_store_module]
+        with self.startup_timer.step('object store'):
+            store = getattr(importlib.import_module(module_name), class_name)
+            object_store = store()
+            object_store.initialize(self.args.object_store_module_arguments)
+        return object_store
+
+    def create_data_source(self, data_source_class, device_args):
+        device_id = device_args.get('device_id', self.args.pulse_device_id)
+        with self.startup_timer.step('camera {0}'.format(device_id)):
+            data_source = data_source_class()
+            data_source.initialize(json.dumps(device_args))
+        return data_source
+
+    def on_connect(self, client, userdata, flags, rc):
+        on_connect(client, userdata, flags, rc)
+        # Subscriptions do not survive a new session, so they are made again on every connection
+        if rc == 0 and self.args.mqtt_control_topic is not None:
+            client.subscribe(self.args.mqtt_control_topic, self.args.mqtt_qos_level)
+        self.mqtt_connected.set()
+
+    def on_publish(self, client, obj, mid):
+        on_publish(client, obj, mid)
+        self.mqtt_inflight.dec()
+
+    def on_control_message(self, client, userdata, message):
+        # Starts the burst requested on the control topic. This runs on the network thread of the MQTT client,
+        # so the burst runs on its own thread
+        try:
+            command = BurstCommand.from_payload(message.payload, self.args.pulse_device_id,
+                self.args.burst_max_frames, self.args.burst_max_fps, self.args.burst_max_duration_seconds)
+            if command.device_id not in self.data_sources_by_device_id:
+                raise Exception("The device '{0}' is unknown".format(command.device_id))
+        except Exception as e:
+            logging.error("An error occurred that prevented the burst requested on the control topic. Error: %s", str(e))
+            self.errors.inc(stage='burst')
+            return
+        if not self.burst_tracker.start(command):
+            logging.warning("Ignoring burst '%s' since a burst of device '%s' is already in progress",
+                command.burst_id, command.device_id)
+            return
+        burst_thread = threading.Thread(target=self.run_burst,
+            args=(self.data_sources_by_device_id[command.device_id], command),
+            name='BurstThread-{0}'.format(command.device_id), daemon=True)
+        burst_thread.start()
+
+    def run_burst(self, data_source, command):
+        # Captures the frames of a burst back-to-back and uploads them concurrently. The lock of the camera is
+        # only held while a frame is captured, so the regular schedule and the cleanup go on during the burst
+        logging.info("Starting burst '%s' of %d frames at %.1f fps for device '%s'", command.burst_id, command.frames,
+            command.fps, command.device_id)
+        scheduler = FixedRateScheduler('burst {0}'.format(command.burst_id), 1.0 / command.fps, OVERRUN_CATCH_UP)
+        uploads = []
+        try:
+            for _ in range(command.frames):
+                scheduler.wait()
+                for data in self.capture_burst_frame(data_source):
+                    data.set_burst_id(command.burst_id)
+                    uploads.append(self.burst_executor.submit(self.upload_burst_capture, data))
+            uploaded = sum(1 for upload in uploads if upload.result())
+            if uploaded == 0:
+                self.burst_tracker.discard(command.burst_id)
+            logging.info("Burst '%s' done: %d of %d captures uploaded", command.burst_id, uploaded, len(uploads))
+        finally:
+            self.burst_tracker.finish(command)
+
+    def capture_burst_frame(self, data_source):
+        # Burst frames are captured in memory, since on disk the local cache would evict the files of the first
+        # frames of a long burst before their upload. They bypass change detection, which would suppress a
+        # burst of a static scene
+        device = data_source.device
+        with data_source.folder_lock:
+            in_memory_capture = device.in_memory_capture
+            change_detector = getattr(device, 'change_detector', None)
+            device.in_memory_capture = True
+            device.change_detector = None
+            try:
+                return self.capture(data_source)
+            finally:
+                device.in_memory_capture = in_memory_capture
+                device.change_detector = change_detector
+
+    def upload_burst_capture(self, data):
+        # Burst captures skip the upload queue so they are neither dropped by it nor delayed behind regular captures
+        if self.try_upload(data):
+            self.publish_queue.put(data)
+            return True
+        return False
+
+    def parse_data_source_module_arguments(self):
+        # The data source module arguments can either be a single JSON object or a list of them, one per camera
+        device_args_list = json.loads(self.args.data_source_module_arguments)
+        if isinstance(device_args_list, dict):
+            device_args_list = [device_args_list]
+        if not isinstance(device_args_list, list) or len(device_args_list) == 0:
+            raise Exception("The data source module arguments must be a JSON object or a non-empty list of JSON objects. Value given: {0}"
+                .format(self.args.data_source_module_arguments))
+
+        device_ids = []
+        for device_args in device_args_list:
+            interval = device_args.get('image_capture_interval_seconds', self.args.image_capture_interval_seconds)
+            if interval <= 0:
+                raise Exception("The interval to capture images must be a number greater than 0. Value given: {0}"
+                    .format(interval))
+            device_id = device_args.get('device_id', self.args.pulse_device_id)
+            if device_id in device_ids:
+                logging.warning("More than one camera publishes data with the device ID '%s'", device_id)
+            device_ids.append(device_id)
+
+        return device_args_list
     
     def validate(self):
         # This function does validation of the command-line arguments
@@ -99,6 +495,43 @@ class App():
         if self.args.image_cleanup_interval_minutes <= 0:
             raise Exception("The interval to clean up images must be a number greater than 0. Value given: {0}"
                 .format(self.args.image_cleanup_interval_minutes))
+        if self.args.upload_workers <= 0:
+            raise Exception("The number of upload workers must be a number greater than 0. Value given: {0}"
+                .format(self.args.upload_workers))
+        if self.args.queue_size <= 0:
+            raise Exception("The size of the queues must be a number greater than 0. Value given: {0}"
+                .format(self.args.queue_size))
+        if self.args.mqtt_connect_timeout_seconds <= 0:
+            raise Exception("The MQTT connection timeout must be a number greater than 0. Value given: {0}"
+                .format(self.args.mqtt_connect_timeout_seconds))
+        if self.args.mqtt_max_inflight <= 0:
+            raise Exception("The max number of in-flight MQTT messages must be a number greater than 0. Value given: {0}"
+                .format(self.args.mqtt_max_inflight))
+        if self.args.mqtt_batch_size <= 0:
+            raise Exception("The MQTT batch size must be a number greater than 0. Value given: {0}"
+                .format(self.args.mqtt_batch_size))
+        if self.args.mqtt_batch_interval_ms < 0:
+            raise Exception("The MQTT batch interval must be a number greater than or equal to 0. Value given: {0}"
+                .format(self.args.mqtt_batch_interval_ms))
+        if self.args.image_retention_hours is not None:
+            if self.args.image_retention_hours <= 0:
+                raise Exception("The retention period of images must be a number greater than 0. Value given: {0}"
+                    .format(self.args.image_retention_hours))
+            if self.args.object_key_layout != LAYOUT_TIME_PARTITIONED:
+                raise Exception("The retention period of images requires the '{0}' object key layout"
+                    .format(LAYOUT_TIME_PARTITIONED))
+        if self.args.spool_drain_rate <= 0:
+            raise Exception("The drain rate of the spool must be a number greater than 0. Value given: {0}"
+                .format(self.args.spool_drain_rate))
+        if self.args.spool_batch_size <= 0:
+            raise Exception("The batch size of the spool must be a number greater than 0. Value given: {0}"
+                .format(self.args.spool_batch_size))
+        if self.args.pack_frames < 0 or self.args.pack_interval_seconds <= 0:
+            raise Exception("The number of packed images must be a number greater than or equal to 0 and the pack " \
+                "interval a number greater than 0")
+        if (self.args.burst_max_frames <= 0 or self.args.burst_max_fps <= 0 or self.args.burst_max_duration_seconds <= 0 or
+            self.args.burst_upload_workers <= 0):
+            raise Exception("The max frames, the max frame rate, the max duration and the upload workers of bursts must be numbers greater than 0")
 
     def start_garbage_collection(self):
         # This function cleans up the directory where images are stored based on a limit on a number of images to keep defined by the user
@@ -106,95 +539,484 @@ class App():
         while True:
             logging.debug("Sleeping for %d minutes", self.args.image_cleanup_interval_minutes)
             sleep(self.args.image_cleanup_interval_minutes * 60)
-            with self.folder_lock:
+            self.clean_up()
+
+    def clean_up(self):
+        cleanup_start = time.monotonic()
+        for data_source in self.data_sources:
+            with data_source.folder_lock:
                 logging.debug('Lock acquired')
-                self.device.clean_local_cache()
-                self.clean_object_store()
+                data_source.device.clean_local_cache()
                 logging.debug('About to release lock')
+        # The object store is cleaned outside the lock so a slow listing or deletion never stalls captures
+        self.clean_object_store()
+        self.cleanup_duration.observe(time.monotonic() - cleanup_start)
 
-    def clean_object_store(self):
+    def seed_retention_index(self):
+        # Adopts the objects already in the object store so they are evicted before the new ones
+        if self.args.image_retention_hours is not None:
+            logging.debug("Images are retained by age. No index of the object store needed")
+            return
+        if self.capture_log is not None and len(self.capture_log.newest(1)) > 0:
+            records = self.get_logged_records()
+            # A truncated storage path does not name an actual object, which would then never be deleted
+            if not any(record.truncated for record in records):
+                logging.info("Indexing the objects in the capture log...")
+                self.retention_index.seed(self.list_logged_objects(records))
+                return
+            logging.warning("Storage paths are truncated in the capture log. Listing the object store instead")
+        logging.info("Indexing the objects in the object store...")
         try:
-            filename_tup = self.object_store.list_objects()
+            self.retention_index.seed(self.object_store.list_objects())
         except Exception as e:
-            logging.error("An error occurred that prevented the listing of images in the image folder. Error: %s", str(e))
-            return
+            logging.error("An error occurred that prevented the listing of images in the object store. Error: %s", str(e))
+
+    def get_logged_records(self):
+        # The objects that may still be in the object store are the newest ones within the cache size, along with
+        # the ones uploaded since the last cleanup before the daemon stopped
+        records = self.capture_log.newest(self.args.image_cache_size)
+        last_logged_at = self.capture_log.newest(1)[0].logged_at
+        records += self.capture_log.between(last_logged_at - self.args.image_cleanup_interval_minutes * 60, float('inf'))
+        return records
+
+    def list_logged_objects(self, records):
+        for record in records:
+            storage_path = record.storage_path
+            if '://' in storage_path:
+                # The storage path is a URL when the object store has several endpoints
+                storage_path = storage_path.split('://', 1)[1].split('/', 1)[-1]
+            if record.size > 0 and not record.truncated and '/' in storage_path:
+                # The storage path is the bucket followed by the object name
+                yield (storage_path.split('/', 1)[1], record.logged_at)
 
-        # Exit the function if no images are present
-        file_list_size = len(filename_tup)
-        if file_list_size <= self.args.image_cache_size:
-            logging.debug("Image storage folder has not exceeded the max number of files allowed: %d. No clean up performed", self.args.image_cache_size)
+    def clean_object_store(self):
+        if self.args.image_retention_hours is not None:
+            self.clean_expired_prefixes()
             return
-        
         # Delete all images past the max number of images allowed. Oldest files are deleted first.
-        if file_list_size > 0:
-            filename_tup.sort(key= lambda x: x[1])
-            logging.debug("Files found: {0}".format(filename_tup))
-            number_of_items_to_delete = file_list_size - self.args.image_cache_size
-            for i in range(number_of_items_to_delete):
-                target_file = filename_tup[i][0]
+        expired = self.retention_index.pop_expired()
+        if len(expired) == 0:
+            logging.debug("Object store has not exceeded the max number of files allowed: %d. No clean up performed", self.args.image_cache_size)
+            return
+
+        logging.debug("Deleting %d files from the object store", len(expired))
+        try:
+            failed = self.object_store.delete_many(expired)
+        except Exception as e:
+            logging.error("An error occurred that prevented the deletion of files in the object store. Error: %s", str(e))
+            failed = expired
+        self.objects_deleted.inc(len(expired) - len(failed))
+        if len(failed) > 0:
+            self.errors.inc(stage='cleanup')
+            self.retention_index.restore(failed)
+
+    def clean_expired_prefixes(self):
+        # Deletes the hours, days, months or years of images of each device that are past the retention period
+        cutoff = time.time() - self.args.image_retention_hours * 3600
+        for device_id in self.data_sources_by_device_id:
+            try:
+                for prefix in self.key_layout.expired_prefixes(self.object_store, device_id, cutoff):
+                    self.delete_prefix(prefix)
+            except Exception as e:
+                logging.error("An error occurred that prevented the deletion of expired images of device '%s'. Error: %s",
+                    device_id, str(e))
+                self.errors.inc(stage='cleanup')
+
+    def delete_prefix(self, prefix):
+        # Deletes the objects under a prefix a batch at a time so the listing is never held in memory
+        logging.debug("Deleting the objects under '%s' from the object store", prefix)
+        batch = []
+        for name, _ in self.object_store.list_objects(prefix=prefix):
+            batch.append(name)
+            if len(batch) == PREFIX_DELETE_BATCH_SIZE:
+                self.delete_batch(batch)
+                batch = []
+        if len(batch) > 0:
+            self.delete_batch(batch)
+
+    def delete_batch(self, names):
+        failed = self.object_store.delete_many(names)
+        self.objects_deleted.inc(len(names) - len(failed))
+        if len(failed) > 0:
+            # The objects are listed again by the next cleanup
+            self.errors.inc(stage='cleanup')
+
+    def start_image_collection(self, data_source):
+        # Capture stage of the pipeline. Captures are handed to the upload workers so the capture
+        # cadence does not depend on the latency of the object store
+        logging.info("Starting data collection for device '%s'", data_source.device_id)
+        while True:
+            data_source.scheduler.wait()
+            for data in self.capture(data_source):
+                self.dispatch(data_source, data)
+
+    def capture(self, data_source):
+        # Captures a single data point with the device. Returns the captured data to upload, which may be
+        # empty when there is nothing to upload or hold several images, e.g. one per region of interest
+        interval = None
+        if data_source.bandwidth_controller is not None:
+            jpeg_quality, image_scale, interval = data_source.bandwidth_controller.get_parameters()
+            data_source.device.set_encoding_parameters(jpeg_quality, image_scale)
+            data_source.scheduler.set_interval(interval)
+        try:
+            capture_start = time.monotonic()
+            with data_source.folder_lock:
+                logging.debug('Lock acquired')
+                data = data_source.device.capture_data()
+                logging.debug('About to release lock')
+            self.capture_duration.observe(time.monotonic() - capture_start)
+            if data is None:
+                self.captures_skipped.inc()
+                return []
+            if not isinstance(data, list):
+                data = [data]
+            for captured_data in data:
+                if captured_data.encode_duration_seconds is not None:
+                    self.encode_duration.observe(captured_data.encode_duration_seconds)
+                captured_data.set_device_id(data_source.device_id)
+                if interval is not None:
+                    # The capture interval is adapted along with the encoding
+                    captured_data.set_encoding(dict(captured_data.encoding or {}, interval=interval))
+                captured_data.set_object_name(self.key_layout.object_name(captured_data))
+            return data
+        except Exception as e:
+            logging.error("An error occurred that prevented the capture of data with the device. Error: %s", str(e))
+            self.errors.inc(stage='capture')
+            return []
+
+    def dispatch(self, data_source, data):
+        # Hands a capture to the next stage of the pipeline: people counting when the camera enables it, the upload otherwise
+        if data_source.people_count_policy is None:
+            self.upload_queue.put(data)
+            return
+        policy = data_source.people_count_policy
+        # People are counted in the encoded image
+        if not self.try_wait_for_encoding(data):
+            return
+
+        def on_count(data, count, duration):
+            self.inference_duration.observe(duration)
+            data.set_people_count(count)
+            if policy.should_upload(count):
+                self.upload_queue.put(data)
+            else:
+                # Only the count is published. The message has an empty file path
+                self.uploads_avoided.inc()
+                self.publish_queue.put(data)
+
+        def on_error(data, e):
+            logging.error("An error occurred that prevented the counting of people in the captured data. Error: %s", str(e))
+            self.errors.inc(stage='inference')
+            self.upload_queue.put(data)
+
+        self.inference_pool.submit(data, policy, on_count, on_error)
+
+    def start_upload_worker(self):
+        # Upload stage of the pipeline. Several workers run concurrently
+        while True:
+            data = self.pack(self.upload_queue.get())
+            if data is not None and self.try_upload(data):
+                self.publish_queue.put(data)
+
+    def pack(self, data):
+        # Adds a capture to the pack of its camera when packing is enabled. Returns the data to upload: the
+        # capture itself without packing, the pack once it is complete, None otherwise
+        if self.frame_packers is None or data.is_pack():
+            return data
+        if not self.try_wait_for_encoding(data):
+            return None
+        try:
+            if data.upload_data_exists():
+                content = data.get_upload_data()
+            else:
+                with open(data.get_upload_file_path(), 'rb') as upload_file:
+                    content = upload_file.read()
+            pack = self.frame_packers[data.device_id].add(data, content)
+        except Exception as e:
+            logging.error("An error occurred that prevented the packing of the captured data. Error: %s", str(e))
+            self.errors.inc(stage='pack')
+            return None
+        if pack is not None:
+            pack.set_object_name(self.key_layout.object_name(pack))
+        return pack
+
+    def flush_expired_packs(self):
+        # Returns the packs whose first image waited longer than the pack interval
+        packs = []
+        for frame_packer in self.frame_packers.values():
+            pack = frame_packer.flush_expired()
+            if pack is not None:
+                pack.set_object_name(self.key_layout.object_name(pack))
+                packs.append(pack)
+        return packs
+
+    def start_pack_flush(self):
+        # Uploads the incomplete packs once their first image waited for the pack interval
+        while True:
+            sleep(min(self.args.pack_interval_seconds / 4, 1))
+            for pack in self.flush_expired_packs():
+                if self.try_upload(pack):
+                    self.publish_queue.put(pack)
+
+    def try_wait_for_encoding(self, data):
+        # Waits for the captured data to be encoded when it is encoded in the background. Returns whether it succeeded
+        if not data.encoding_pending():
+            return True
+        try:
+            data.wait_for_encoding()
+        except Exception as e:
+            logging.error("An error occurred that prevented the encoding of the captured data. Error: %s", str(e))
+            self.errors.inc(stage='encode')
+            return False
+        self.encode_duration.observe(data.encode_duration_seconds)
+        return True
+
+    def try_upload(self, data):
+        # Uploads the captured data, or spools it when the upload fails. Returns whether the upload succeeded
+        if not self.try_wait_for_encoding(data):
+            return False
+        try:
+            if self.spool is not None and not data.upload_data_exists() and data.upload_file_exists():
+                # The local cache may delete the file while the upload is attempted, so its content is read
+                # first to be spooled if the upload fails
+                data.load_upload_file()
+            self.upload(data)
+        except Exception as e:
+            logging.error("An error occurred that prevented the upload of the captured data. Error: %s", str(e))
+            self.errors.inc(stage='upload')
+            self.spool_upload(data)
+            return False
+        return True
+
+    def upload(self, data):
+        upload_size = data.get_upload_size()
+        upload_start = time.monotonic()
+        self.upload_to_object_store(data)
+        upload_duration = time.monotonic() - upload_start
+        self.upload_duration.observe(upload_duration)
+        self.bytes_uploaded.inc(upload_size)
+        data.set_uploaded_size(upload_size)
+        data_source = self.data_sources_by_device_id.get(data.device_id)
+        if data_source is not None and data_source.bandwidth_controller is not None:
+            # The controller works per image, so a pack counts as its images
+            images = len(data.frames) if data.is_pack() else 1
+            data_source.bandwidth_controller.record_upload(upload_size, upload_start, upload_start + upload_duration, images)
+
+    def upload_to_object_store(self, data):
+        if data.upload_data_exists():
+            storage_path = self.object_store.upload_data(data.object_name, data.get_upload_data())
+            data.set_storage_path(storage_path)
+            self.index_upload(data.object_name)
+        elif data.upload_file_exists():
+            storage_path = self.object_store.upload(data.get_upload_file_path(), object_name=data.object_name)
+            data.set_storage_path(storage_path)
+            self.index_upload(data.object_name)
+
+    def index_upload(self, object_name):
+        # Records an uploaded object for the count-based cleanup
+        if self.retention_index is not None:
+            self.retention_index.add(object_name)
+
+    def start_publisher(self):
+        # Publish stage of the pipeline. Advertises the uploaded data over MQTT
+        while True:
+            self.publish_batch(self.collect_publish_batch())
+
+    def publish_batch(self, batch):
+        # Advertises one or more uploaded captures in a single MQTT message
+        if self.capture_log is not None:
+            for data in batch:
                 try:
-                    self.object_store.delete(target_file)
+                    self.capture_log.append(data, data.uploaded_size)
                 except Exception as e:
-                    logging.error("An error occurred that prevented the deletion of the file ({0}) in the image folder. Error: {1}".format(target_file, str(e)))
-                    continue
+                    logging.error("An error occurred that prevented the logging of the captured data. Error: %s", str(e))
+        try:
+            payload = self.payload_encoder.encode([data.to_dict() for data in batch])
+            publish_start = time.monotonic()
+            self.publish(self.args.mqtt_topic, payload)
+            self.publish_duration.observe(time.monotonic() - publish_start)
+            for data in batch:
+                if data.burst_id is not None:
+                    self.burst_tracker.record_publish(data.burst_id)
+        except Exception as e:
+            logging.error("An error occurred that prevented the publishing of the captured data. Error: %s", str(e))
+            self.errors.inc(stage='publish')
+
+    def collect_publish_batch(self):
+        # Waits for a capture to publish, then for more captures until the batch is full or the batch interval expires
+        batch = [self.publish_queue.get()]
+        deadline = time.monotonic() + self.args.mqtt_batch_interval_ms / 1000.0
+        while len(batch) < self.args.mqtt_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            data = self.publish_queue.get(remaining)
+            if data is None:
+                break
+            batch.append(data)
+        return batch
+
+    def publish(self, topic, payload):
+        # Publishes a message, or spools it while the broker is unreachable so it is not buffered in memory
+        if self.spool is not None and not self.mqtt_client.is_connected():
+            logging.debug("MQTT broker unreachable. Spooling message for topic: '%s'", topic)
+            self.spool.append(RECORD_MQTT_MESSAGE, topic, payload=self.payload_to_bytes(payload))
+            return
+        logging.debug("Publishing on topic: '%s' message: '%s'", topic, payload)
+        self.mqtt_inflight.inc()
+        result = self.mqtt_client.publish(topic, payload, self.args.mqtt_qos_level)
+        if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.messages_published.inc()
+        else:
+            self.mqtt_inflight.dec()
+            if self.spool is None:
+                raise Exception("Publishing failed with error code: {0}".format(result.rc))
+            self.spool.append(RECORD_MQTT_MESSAGE, topic, payload=self.payload_to_bytes(payload))
+
+    def payload_to_bytes(self, payload):
+        if isinstance(payload, str):
+            return payload.encode('utf-8')
+        return payload
 
-    def start_image_collection(self):
-        logging.info("Starting data collection")
+    def spool_upload(self, data):
+        # Keeps the content of a failed upload on disk along with its metadata so it can be sent later
+        if self.spool is None:
+            return
+        try:
+            filename = data.object_name
+            if data.upload_data_exists():
+                payload = data.get_upload_data()
+            elif data.upload_file_exists():
+                with open(data.get_upload_file_path(), 'rb') as upload_file:
+                    payload = upload_file.read()
+            else:
+                return
+            self.spool.append(RECORD_UPLOAD, filename, data.to_json().encode('utf-8'), payload)
+            logging.info("Spooled upload of '%s'", filename)
+        except Exception as e:
+            logging.error("An error occurred that prevented the spooling of the captured data. Error: %s", str(e))
+
+    def start_spool_drain(self):
+        # Sends the spooled uploads and messages in batches at a limited rate once connectivity returns
+        delay = 1.0 / self.args.spool_drain_rate
+        backoff = DrainBackoff()
         while True:
-            with self.folder_lock:
-                logging.debug('Lock acquired')
+            batch = self.spool.read_batch(self.args.spool_batch_size)
+            if len(batch) == 0:
+                sleep(1)
+                continue
+            logging.info("Draining %d records from the spool", len(batch))
+            for record, position in batch:
                 try:
-                    data = self.device.capture_data()
-                    if data.upload_file_exists():
-                        storage_path = self.object_store.upload(data.get_upload_file_path())
-                        data.set_storage_path(storage_path)
-                    data.set_device_id(self.args.pulse_device_id)
-                    json_payload = data.to_json()
-                    logging.debug("Publishing on topic: '%s' message: '%s'", self.args.mqtt_topic, json_payload)
-                    self.mqtt_client.publish(self.args.mqtt_topic, json_payload, self.mqtt_qos_level)
+                    self.drain_record(record)
                 except Exception as e:
-                    logging.error("An error occurred that prevented the capture of data with the device. Error: %s", str(e))
-                    logging.info("Sleeping for %d seconds before retrying data capture", self.args.image_capture_interval_seconds)
-                    sleep(self.args.image_capture_interval_seconds)
-                    logging.debug('About to release lock')
-                    continue
-                logging.debug('About to release lock')
+                    retry_delay = backoff.next_delay()
+                    logging.error("An error occurred that prevented the draining of the spool. Retrying in %d seconds. Error: %s",
+                        retry_delay, str(e))
+                    sleep(retry_delay)
+                    break
+                backoff.reset()
+                self.spool.commit(position)
+                sleep(delay)
 
-            logging.debug("Sleeping for %d seconds", self.args.image_capture_interval_seconds)
-            sleep(self.args.image_capture_interval_seconds)
+    def drain_record(self, record):
+        if record.kind == RECORD_UPLOAD:
+            data = CapturedData.from_dict(json.loads(record.metadata.decode('utf-8')))
+            data.set_storage_path(self.object_store.upload_data(record.key, record.payload))
+            data.set_uploaded_size(len(record.payload))
+            self.index_upload(record.key)
+            self.publish_queue.put(data)
+        elif record.kind == RECORD_MQTT_MESSAGE:
+            if not self.mqtt_client.is_connected():
+                raise Exception("The MQTT broker is still unreachable")
+            self.mqtt_inflight.inc()
+            result = self.mqtt_client.publish(record.key, record.payload, self.args.mqtt_qos_level)
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.messages_published.inc()
+            else:
+                self.mqtt_inflight.dec()
+                raise Exception("Publishing failed with error code: {0}".format(result.rc))
 
     def signal_handler(self, sig, frame):
         logging.info('You pressed Ctrl+C. Exiting program...')
         self.mqtt_client.loop_stop()
+        if self.capture_log is not None:
+            self.capture_log.close()
+        if self.inference_pool is not None:
+            self.inference_pool.close()
+        self.close_encoder_pools()
+        if self.spool is not None:
+            self.spool.close()
         sys.exit(0)
 
+    def close_encoder_pools(self):
+        # Stops the encoding workers of the cameras that encode in worker processes
+        for data_source in self.data_sources:
+            encoder_pool = getattr(data_source.device, 'encoder_pool', None)
+            if encoder_pool is not None:
+                encoder_pool.close()
+
     def run(self):
+        if self.args.async_core:
+            AsyncRunner(self).run()
+            return
+
         # Initialize the MQTT client
-        global mqtt_client_connection_error
         logging.info("Connecting to MQTT broker...")
         self.mqtt_client.username_pw_set(self.args.mqtt_username, self.args.mqtt_password)
         self.mqtt_client.connect(self.args.mqtt_hostname, self.args.mqtt_port)
+        connect_start = time.monotonic()
         self.mqtt_client.loop_start()
-        sleep(10)
+        # The object store is indexed while the broker answers the connection
+        with self.startup_timer.step('retention index'):
+            self.seed_retention_index()
+        self.wait_for_mqtt_connection()
+        self.startup_timer.record('mqtt', time.monotonic() - connect_start)
+        logging.info("Success")
+
+        self.start_threads()
+        self.startup_timer.report()
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.pause()
+
+    def wait_for_mqtt_connection(self):
+        # Blocks until the broker acknowledged the connection
+        if not self.mqtt_connected.wait(self.args.mqtt_connect_timeout_seconds):
+            raise Exception("The MQTT broker did not accept the connection within {0} seconds"
+                .format(self.args.mqtt_connect_timeout_seconds))
         if mqtt_client_connection_error != "":
             raise Exception(mqtt_client_connection_error)
-        logging.info("Success")
 
+    def start_threads(self):
         # Start all the threads
-        image_collection_thread = threading.Thread(target=self.start_image_collection, name='ImageCollectionThread', daemon=True)
+        if self.args.metrics_port is not None:
+            self.metrics_server = start_metrics_server(self.metrics, self.args.metrics_port)
         garbage_collection_thread = threading.Thread(target=self.start_garbage_collection, name='GarbageCollectionThread', daemon=True)
-        image_collection_thread.start()
+        publisher_thread = threading.Thread(target=self.start_publisher, name='PublisherThread', daemon=True)
+        for i, data_source in enumerate(self.data_sources):
+            image_collection_thread = threading.Thread(target=self.start_image_collection, args=(data_source,),
+                name='ImageCollectionThread-{0}'.format(i), daemon=True)
+            image_collection_thread.start()
         garbage_collection_thread.start()
+        publisher_thread.start()
+        if self.frame_packers is not None:
+            pack_flush_thread = threading.Thread(target=self.start_pack_flush, name='PackFlushThread', daemon=True)
+            pack_flush_thread.start()
+        if self.spool is not None:
+            spool_drain_thread = threading.Thread(target=self.start_spool_drain, name='SpoolDrainThread', daemon=True)
+            spool_drain_thread.start()
+        for i in range(self.args.upload_workers):
+            upload_thread = threading.Thread(target=self.start_upload_worker, name='UploadThread-{0}'.format(i), daemon=True)
+            upload_thread.start()
         logging.debug('All threads initialized')
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.pause()
 
-app = App()
-try:
-    app.run()
-except Exception as e:
-    # Make sure to end the MQTT connection in case of errors
-    logging.error("An error occurred that prevented the application from running. Error: %s", str(e))
-    if app.mqtt_client is not None:
-        app.mqtt_client.loop_stop()
+if __name__ == '__main__':
+    app = App()
+    try:
+        app.run()
+    except Exception as e:
+        # Make sure to end the MQTT connection in case of errors
+        logging.error("An error occurred that prevented the application from running. Error: %s", str(e))
+        if app.mqtt_client is not None:
+            app.mqtt_client.loop_stop()
         
\ No newline at end of file
@@ -0,0 +1,104 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import itertools
+import datetime
+import calendar
+import logging
+import os
+
+LAYOUT_FLAT = 'flat'
+LAYOUT_TIME_PARTITIONED = 'time-partitioned'
+KEY_LAYOUTS = [LAYOUT_FLAT, LAYOUT_TIME_PARTITIONED]
+
+# Wraps around so the sequence number keeps a fixed width
+SEQUENCE_MODULO = 1000000
+
+class FlatKeyLayout():
+    """
+    A class used to name the objects after the files or the in-memory images of the data sources, in a
+    single namespace shared by all the devices.
+    """
+    def object_name(self, data):
+        # The filename of in-memory images is known before their encoding finished
+        if data.get_upload_filename() is not None:
+            return data.get_upload_filename()
+        return os.path.basename(data.get_upload_file_path())
+
+class TimePartitionedKeyLayout():
+    """
+    A class used to name the objects as <device>/<yyyy>/<mm>/<dd>/<hh>/<timestamp>-<seq><extension>, in UTC.
+
+    Objects of a device and of a time window share a prefix, so they can be listed without listing the
+    whole bucket, and whole prefixes can be deleted once they are older than the retention period.
+    """
+    def __init__(self):
+        self._sequence = itertools.count()
+
+    def object_name(self, data):
+        if data.get_upload_filename() is not None:
+            extension = os.path.splitext(data.get_upload_filename())[1]
+        else:
+            extension = os.path.splitext(data.get_upload_file_path())[1]
+        created = datetime.datetime.utcfromtimestamp(data.creation_timestamp)
+        # next() on itertools.count is atomic, so concurrent captures never share a sequence number
+        sequence = next(self._sequence) % SEQUENCE_MODULO
+        return '{0}/{1:%Y/%m/%d/%H}/{2}-{3:06d}{4}'.format(data.device_id, created,
+            int(data.creation_timestamp * 1000), sequence, extension)
+
+    def expired_prefixes(self, object_store, device_id, cutoff_timestamp):
+        """
+        Finds the prefixes of a device whose whole time window ended before a cutoff. Only the prefixes
+        that straddle the cutoff are listed further down, so the cost depends on the retention period
+        rather than on the number of objects.
+
+        Parameters:
+        object_store (ObjectStoreInterface): The object store to list
+        device_id (string): The device whose objects are expired
+        cutoff_timestamp (float): Objects created before this time, in seconds since the epoch, are expired
+
+        Returns:
+        generator: The expired prefixes, each ending with "/"
+        """
+        return self.expired_prefixes_under(object_store, device_id + '/', [], cutoff_timestamp)
+
+    ######################HELPER METHODS########################
+
+    def expired_prefixes_under(self, object_store, prefix, components, cutoff_timestamp):
+        # Walks the year, month, day and hour levels below a prefix
+        for child in object_store.list_prefixes(prefix):
+            try:
+                child_components = components + [int(child[len(prefix):].rstrip('/'))]
+                window_start, window_end = time_window(child_components)
+            except ValueError:
+                logging.warning("Ignoring the prefix '%s' which does not follow the time-partitioned key layout", child)
+                continue
+            if window_end <= cutoff_timestamp:
+                yield child
+            elif window_start < cutoff_timestamp and len(child_components) < 4:
+                for expired in self.expired_prefixes_under(object_store, child, child_components, cutoff_timestamp):
+                    yield expired
+
+def time_window(components):
+    # Start and end in seconds since the epoch of the UTC year, month, day or hour given by [yyyy, mm, dd, hh]
+    defaults = [None, 1, 1, 0]
+    start = datetime.datetime(*(components + defaults[len(components):]))
+    if len(components) == 1:
+        end = start.replace(year=start.year + 1)
+    elif len(components) == 2:
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+    elif len(components) == 3:
+        end = start + datetime.timedelta(days=1)
+    else:
+        end = start + datetime.timedelta(hours=1)
+    return calendar.timegm(start.timetuple()), calendar.timegm(end.timetuple())
+
+def create_key_layout(name):
+    if name not in KEY_LAYOUTS:
+        raise Exception("The object key layout '{0}' is not supported. Supported layouts are: {1}"
+            .format(name, KEY_LAYOUTS))
+    if name == LAYOUT_TIME_PARTITIONED:
+        return TimePartitionedKeyLayout()
+    return FlatKeyLayout()
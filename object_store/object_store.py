@@ -5,6 +5,13 @@
 #
 import abc
 
+# How an object store module checks its configuration when it is initialized. "head" only checks that
+# the bucket exists, "probe" also uploads and deletes a test object and "none" skips the checks
+VALIDATION_NONE = 'none'
+VALIDATION_HEAD = 'head'
+VALIDATION_PROBE = 'probe'
+VALIDATION_MODES = [VALIDATION_NONE, VALIDATION_HEAD, VALIDATION_PROBE]
+
 class ObjectStoreInterface(abc.ABC):
 
     @abc.abstractmethod
@@ -18,6 +25,11 @@ class ObjectStoreInterface(abc.ABC):
         # The function should upload an object to the object store
         pass
 
+    @abc.abstractmethod
+    def upload_data(self):
+        # The function should upload an object held in memory to the object store
+        pass
+
     @abc.abstractmethod
     def download(self):
         # The function should download and object from the object store
@@ -28,8 +40,19 @@ class ObjectStoreInterface(abc.ABC):
         # The function should delete an object from the object store
         pass
 
+    @abc.abstractmethod
+    def delete_many(self):
+        # The function should delete several objects from the object store in as few requests as possible
+        pass
+
     @abc.abstractmethod
     def list_objects(self):
-        # The function should list the objects from an object store
+        # The function should list the objects from an object store, optionally under a prefix only.
+        # Implementations should stream the listing rather than build it in memory
+        pass
+
+    @abc.abstractmethod
+    def list_prefixes(self):
+        # The function should list the prefixes directly under a prefix, up to the next "/" of the object names
         pass
     
\ No newline at end of file
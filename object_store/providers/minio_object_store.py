@@ -3,12 +3,17 @@
 #
 # SPDX-License-Identifier: BSD-2-Clause
 #
-from object_store.object_store import ObjectStoreInterface
+from object_store.object_store import ObjectStoreInterface, VALIDATION_MODES, VALIDATION_NONE, VALIDATION_HEAD, VALIDATION_PROBE
 from minio import Minio
 from minio.error import ResponseError
 import logging
 import json
 import os
+import io
+import mimetypes
+
+# Max number of objects Minio accepts in a single multi-object delete request
+DELETE_BATCH_SIZE = 1000
 
 class MinioObjectStore(ObjectStoreInterface):
     
@@ -20,6 +25,9 @@ class MinioObjectStore(ObjectStoreInterface):
                         datefmt="%H:%M:%S")
         args = json.loads(jsonArgs)
 
+        # Setup default values
+        validation_default = VALIDATION_HEAD
+
         # Extract variables from JSON
         self.host = args['host']
         self.access_key = args['accessKey']
@@ -27,6 +35,10 @@ class MinioObjectStore(ObjectStoreInterface):
         self.https_enabled = args['httpsEnabled']
         if 'bucketName' in args:
             self.bucket_name = args['bucketName']
+        if 'validation' in args:
+            self.validation = args['validation']
+        else:
+            self.validation = validation_default
 
         # Instantiate client 
         self.minio_client = Minio(
@@ -38,7 +50,7 @@ class MinioObjectStore(ObjectStoreInterface):
 
         self.validate()
 
-    def upload(self, filepath, bucket_name = None):
+    def upload(self, filepath, bucket_name = None, object_name = None):
         """
         Uploads a file to Minio.
 
@@ -48,6 +60,7 @@ class MinioObjectStore(ObjectStoreInterface):
         Parameters:
         filepath (string): The absolute path of the file to upload
         bucket_name (string): Optional argument to indicate the bucket to use to upload the file
+        object_name (string): Optional name of the object to create. Defaults to the name of the file
 
         Returns:
         string: The location of the image in Minio
@@ -63,7 +76,7 @@ class MinioObjectStore(ObjectStoreInterface):
                 "The instance variable bucket_name was not initialized. You must either initialize it or pass it to the function")
 
         # Upload file to Algorithmia
-        filename = os.path.basename(filepath)
+        filename = object_name if object_name is not None else os.path.basename(filepath)
         logging.debug("Uploading file '%s' to bucket '%s'", filepath, bucket)
         try:
             self.minio_client.fput_object(
@@ -77,6 +90,51 @@ class MinioObjectStore(ObjectStoreInterface):
         logging.debug("Upload of file was successful")
 
         return bucket + '/' + filename
+
+    def upload_data(self, filename, data, bucket_name = None):
+        """
+        Uploads an object held in memory to Minio.
+
+        The function streams the bytes given straight to a bucket in Minio without
+        writing them to the filesystem first.
+
+        Parameters:
+        filename (string): The name of the object to create in the bucket
+        data (bytes-like): The encoded content of the object (bytes, bytearray or memoryview)
+        bucket_name (string): Optional argument to indicate the bucket to use to upload the object
+
+        Returns:
+        string: The location of the image in Minio
+        """
+
+        bucket = ""
+        if bucket_name is not None:
+            bucket = bucket_name
+        elif self.bucket_name is not None:
+            bucket = self.bucket_name
+        else:
+            raise Exception(
+                "The instance variable bucket_name was not initialized. You must either initialize it or pass it to the function")
+
+        content_type = mimetypes.guess_type(filename)[0]
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        length = memoryview(data).nbytes
+        logging.debug("Uploading %d bytes as '%s' to bucket '%s'", length, filename, bucket)
+        try:
+            self.minio_client.put_object(
+                bucket,
+                filename,
+                io.BytesIO(data),
+                length,
+                content_type=content_type
+                )
+        except ResponseError as err:
+            logging.error("Upload of object '%s' failed", filename)
+            raise err
+        logging.debug("Upload of object was successful")
+
+        return bucket + '/' + filename
     
     def download(self, filename, download_path, bucket_name = None):
         # Downloads an object from Minio
@@ -125,7 +183,18 @@ class MinioObjectStore(ObjectStoreInterface):
             raise err
         logging.debug('Deletion of file was successful')
 
-    def list_objects(self, bucket_name = None):
+    def delete_many(self, filenames, bucket_name = None):
+        """
+        Deletes several files from Minio using multi-object delete requests.
+
+        Parameters:
+        filenames (list): The names of the files to delete
+        bucket_name (string): Optional argument to indicate the bucket to delete the files from
+
+        Returns:
+        list: The names of the files that could not be deleted
+        """
+
         bucket = ""
         if bucket_name is not None:
             bucket = bucket_name
@@ -135,12 +204,69 @@ class MinioObjectStore(ObjectStoreInterface):
             raise Exception(
                 "The instance variable bucket_name was not initialized. You must either initialize it or pass it to the function")
 
-        objects = self.minio_client.list_objects(bucket)
-        object_list = []
+        failed = []
+        for i in range(0, len(filenames), DELETE_BATCH_SIZE):
+            batch = filenames[i:i + DELETE_BATCH_SIZE]
+            logging.debug("Deleting %d files from bucket '%s'", len(batch), bucket)
+            try:
+                # The errors are returned lazily so the generator must be consumed for the request to be sent
+                for err in self.minio_client.remove_objects(bucket, batch):
+                    logging.error("Deletion of file '%s' failed. Error: %s", err.object_name, err.error_message)
+                    failed.append(err.object_name)
+            except ResponseError as err:
+                logging.error("Deletion of %d files failed. Error: %s", len(batch), str(err))
+                failed.extend(batch)
+        logging.debug('Deletion of %d files completed with %d failures', len(filenames), len(failed))
+
+        return failed
+
+    def list_objects(self, bucket_name = None, prefix = None):
+        """
+        Lists the objects in a bucket in Minio.
+
+        Parameters:
+        bucket_name (string): Optional argument to indicate the bucket to list
+        prefix (string): Optional argument to only list the objects whose name starts with the prefix
+
+        Returns:
+        generator: Tuples of (object name, last modified) streamed from Minio as the listing is consumed
+        """
+        bucket = ""
+        if bucket_name is not None:
+            bucket = bucket_name
+        elif self.bucket_name is not None:
+            bucket = self.bucket_name
+        else:
+            raise Exception(
+                "The instance variable bucket_name was not initialized. You must either initialize it or pass it to the function")
+
+        objects = self.minio_client.list_objects(bucket, prefix=prefix, recursive=True)
         for obj in objects:
-            object_list.append((obj.object_name, obj.last_modified))
+            yield (obj.object_name, obj.last_modified)
 
-        return object_list
+    def list_prefixes(self, prefix = '', bucket_name = None):
+        """
+        Lists the prefixes directly under a prefix in a bucket in Minio, e.g. "camera-0/2020/" under "camera-0/".
+
+        Parameters:
+        prefix (string): The prefix to list under. Should end with "/"
+        bucket_name (string): Optional argument to indicate the bucket to list
+
+        Returns:
+        generator: The prefixes, each ending with "/"
+        """
+        bucket = ""
+        if bucket_name is not None:
+            bucket = bucket_name
+        elif self.bucket_name is not None:
+            bucket = self.bucket_name
+        else:
+            raise Exception(
+                "The instance variable bucket_name was not initialized. You must either initialize it or pass it to the function")
+
+        for obj in self.minio_client.list_objects(bucket, prefix=prefix, recursive=False):
+            if obj.is_dir:
+                yield obj.object_name
 
     ######################HELPER METHODS########################
 
@@ -148,13 +274,20 @@ class MinioObjectStore(ObjectStoreInterface):
         # The function should hold any validation that
         # needs to be run before the class can be used
 
-        if self.bucket_name is not None:
+        if self.validation not in VALIDATION_MODES:
+            raise Exception("The validation '{0}' is not supported. Supported validations are: {1}"
+                .format(self.validation, VALIDATION_MODES))
+        if self.bucket_name is not None and self.validation != VALIDATION_NONE:
             try:
-                self.minio_client.bucket_exists(self.bucket_name)
+                bucket_exists = self.minio_client.bucket_exists(self.bucket_name)
             except ResponseError as err:
                 logging.error("Validation failed for the input variable 'bucketName' with value '%s'", self.bucket_name)
                 raise err
-            
+            if not bucket_exists:
+                raise Exception("The bucket '{0}' does not exist".format(self.bucket_name))
+            if self.validation != VALIDATION_PROBE:
+                return
+
             logging.debug("Testing file upload with test file: %s to Minio", os.path.realpath(__file__))
             self.upload(os.path.realpath(__file__))
 
@@ -0,0 +1,312 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+from object_store.object_store import ObjectStoreInterface, VALIDATION_MODES, VALIDATION_NONE, VALIDATION_HEAD, VALIDATION_PROBE
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+import boto3
+import logging
+import json
+import os
+import io
+import mimetypes
+
+# Max number of objects S3 accepts in a single multi-object delete request
+DELETE_BATCH_SIZE = 1000
+MEGABYTE = 1024 * 1024
+
+class S3ObjectStore(ObjectStoreInterface):
+    
+    def initialize(self, jsonArgs):
+        # The function should initialize any connections that need
+        # to be made or any variables that will be required
+        format = "%(asctime)s - %(levelname)s: %(threadName)s - %(message)s"
+        logging.basicConfig(format=format, level=logging.DEBUG,
+                        datefmt="%H:%M:%S")
+        args = json.loads(jsonArgs)
+
+        # Setup default values
+        region_default = 'us-east-1'
+        max_pool_connections_default = 10
+        multipart_threshold_mb_default = 8
+        multipart_chunk_size_mb_default = 8
+        max_concurrency_default = 4
+        validation_default = VALIDATION_HEAD
+
+        # Extract variables from JSON
+        self.host = args['host']
+        self.access_key = args['accessKey']
+        self.secret_key = args['secretKey']
+        self.https_enabled = args['httpsEnabled']
+        self.bucket_name = None
+        if 'bucketName' in args:
+            self.bucket_name = args['bucketName']
+        if 'region' in args:
+            self.region = args['region']
+        else:
+            self.region = region_default
+        if 'maxPoolConnections' in args:
+            self.max_pool_connections = args['maxPoolConnections']
+        else:
+            self.max_pool_connections = max_pool_connections_default
+        if 'multipartThresholdMB' in args:
+            self.multipart_threshold_mb = args['multipartThresholdMB']
+        else:
+            self.multipart_threshold_mb = multipart_threshold_mb_default
+        if 'multipartChunkSizeMB' in args:
+            self.multipart_chunk_size_mb = args['multipartChunkSizeMB']
+        else:
+            self.multipart_chunk_size_mb = multipart_chunk_size_mb_default
+        if 'maxConcurrency' in args:
+            self.max_concurrency = args['maxConcurrency']
+        else:
+            self.max_concurrency = max_concurrency_default
+        if 'validation' in args:
+            self.validation = args['validation']
+        else:
+            self.validation = validation_default
+
+        # Instantiate a single client. Clients are thread-safe so every thread shares its connection pool
+        scheme = 'https' if self.https_enabled else 'http'
+        self.s3_client = boto3.session.Session().client(
+            's3',
+            endpoint_url='{0}://{1}'.format(scheme, self.host),
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key,
+            region_name=self.region,
+            config=Config(
+                max_pool_connections=self.max_pool_connections,
+                s3={'addressing_style': 'path'}
+                )
+            )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.multipart_threshold_mb * MEGABYTE,
+            multipart_chunksize=self.multipart_chunk_size_mb * MEGABYTE,
+            max_concurrency=self.max_concurrency
+            )
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='S3ObjectStore')
+
+        self.validate()
+
+    def upload(self, filepath, bucket_name = None, object_name = None):
+        """
+        Uploads a file to S3.
+
+        The function uploads a file from the path in the filesystem specified and uploads
+        it to a bucket. Files larger than the multipart threshold are uploaded in parts.
+
+        Parameters:
+        filepath (string): The absolute path of the file to upload
+        bucket_name (string): Optional argument to indicate the bucket to use to upload the file
+        object_name (string): Optional name of the object to create. Defaults to the name of the file
+
+        Returns:
+        string: The location of the image in S3
+        """
+
+        bucket = self.get_bucket(bucket_name)
+        filename = object_name if object_name is not None else os.path.basename(filepath)
+        logging.debug("Uploading file '%s' to bucket '%s'", filepath, bucket)
+        try:
+            self.s3_client.upload_file(
+                filepath,
+                bucket,
+                filename,
+                ExtraArgs={'ContentType': self.get_content_type(filename)},
+                Config=self.transfer_config
+                )
+        except (BotoCoreError, ClientError) as err:
+            logging.error("Upload of file '%s' failed", filepath)
+            raise err
+        logging.debug("Upload of file was successful")
+
+        return bucket + '/' + filename
+
+    def upload_data(self, filename, data, bucket_name = None):
+        """
+        Uploads an object held in memory to S3. Objects smaller than the multipart threshold are uploaded
+        with a single request, larger ones in parts.
+
+        Parameters:
+        filename (string): The name of the object to create in the bucket
+        data (bytes-like): The encoded content of the object (bytes, bytearray or memoryview)
+        bucket_name (string): Optional argument to indicate the bucket to use to upload the object
+
+        Returns:
+        string: The location of the image in S3
+        """
+
+        bucket = self.get_bucket(bucket_name)
+        size = memoryview(data).nbytes
+        logging.debug("Uploading %d bytes as '%s' to bucket '%s'", size, filename, bucket)
+        try:
+            if size < self.transfer_config.multipart_threshold:
+                # A single request, without the threads and the buffering of the transfer manager.
+                # The client only accepts bytes, bytearrays and files as a body
+                self.s3_client.put_object(
+                    Bucket=bucket,
+                    Key=filename,
+                    Body=data if isinstance(data, (bytes, bytearray)) else io.BytesIO(data),
+                    ContentType=self.get_content_type(filename)
+                    )
+            else:
+                self.s3_client.upload_fileobj(
+                    io.BytesIO(data),
+                    bucket,
+                    filename,
+                    ExtraArgs={'ContentType': self.get_content_type(filename)},
+                    Config=self.transfer_config
+                    )
+        except (BotoCoreError, ClientError) as err:
+            logging.error("Upload of object '%s' failed", filename)
+            raise err
+        logging.debug("Upload of object was successful")
+
+        return bucket + '/' + filename
+
+    def download(self, filename, download_path, bucket_name = None):
+        # Downloads an object from S3
+
+        bucket = self.get_bucket(bucket_name)
+        logging.debug("Downloading file '%s' from bucket '%s'", filename, bucket)
+        try:
+            self.s3_client.download_file(
+                bucket,
+                filename,
+                download_path,
+                Config=self.transfer_config
+                )
+        except (BotoCoreError, ClientError) as err:
+            logging.error("Download of file '%s' failed", filename)
+            raise err
+        logging.debug('File download was successful')
+
+    def delete(self, filename, bucket_name = None):
+        # Deletes a file from S3
+
+        bucket = self.get_bucket(bucket_name)
+        logging.debug("Deleting file '%s' from bucket '%s'", filename, bucket)
+        try:
+            self.s3_client.delete_object(
+                Bucket=bucket,
+                Key=filename
+                )
+        except (BotoCoreError, ClientError) as err:
+            logging.error("Deletion of file '%s' failed", filename)
+            raise err
+        logging.debug('Deletion of file was successful')
+
+    def delete_many(self, filenames, bucket_name = None):
+        """
+        Deletes several files from S3 using multi-object delete requests sent concurrently.
+
+        Parameters:
+        filenames (list): The names of the files to delete
+        bucket_name (string): Optional argument to indicate the bucket to delete the files from
+
+        Returns:
+        list: The names of the files that could not be deleted
+        """
+
+        bucket = self.get_bucket(bucket_name)
+        batches = [filenames[i:i + DELETE_BATCH_SIZE] for i in range(0, len(filenames), DELETE_BATCH_SIZE)]
+        failed = []
+        for batch_failures in self.executor.map(lambda batch: self.delete_batch(bucket, batch), batches):
+            failed.extend(batch_failures)
+        logging.debug('Deletion of %d files completed with %d failures', len(filenames), len(failed))
+
+        return failed
+
+    def list_objects(self, bucket_name = None, prefix = None):
+        """
+        Lists the objects in a bucket in S3.
+
+        Parameters:
+        bucket_name (string): Optional argument to indicate the bucket to list
+        prefix (string): Optional argument to only list the objects whose name starts with the prefix
+
+        Returns:
+        generator: Tuples of (object name, last modified) streamed page by page as the listing is consumed
+        """
+
+        bucket = self.get_bucket(bucket_name)
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix or ''):
+            for obj in page.get('Contents', []):
+                yield (obj['Key'], obj['LastModified'])
+
+    def list_prefixes(self, prefix = '', bucket_name = None):
+        """
+        Lists the prefixes directly under a prefix in a bucket in S3, e.g. "camera-0/2020/" under "camera-0/".
+
+        Parameters:
+        prefix (string): The prefix to list under. Should end with "/"
+        bucket_name (string): Optional argument to indicate the bucket to list
+
+        Returns:
+        generator: The prefixes, each ending with "/"
+        """
+
+        bucket = self.get_bucket(bucket_name)
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                yield common_prefix['Prefix']
+
+    ######################HELPER METHODS########################
+
+    def validate(self):
+        # The function should hold any validation that
+        # needs to be run before the class can be used
+
+        if self.validation not in VALIDATION_MODES:
+            raise Exception("The validation '{0}' is not supported. Supported validations are: {1}"
+                .format(self.validation, VALIDATION_MODES))
+        if self.bucket_name is not None and self.validation != VALIDATION_NONE:
+            try:
+                self.s3_client.head_bucket(Bucket=self.bucket_name)
+            except (BotoCoreError, ClientError) as err:
+                logging.error("Validation failed for the input variable 'bucketName' with value '%s'", self.bucket_name)
+                raise err
+            if self.validation != VALIDATION_PROBE:
+                return
+
+            logging.debug("Testing file upload with test file: %s to S3", os.path.realpath(__file__))
+            self.upload(os.path.realpath(__file__))
+
+            logging.debug('Starting test file deletion')
+            self.delete(os.path.basename(__file__))
+
+    def get_bucket(self, bucket_name):
+        if bucket_name is not None:
+            return bucket_name
+        elif self.bucket_name is not None:
+            return self.bucket_name
+        raise Exception(
+            "The instance variable bucket_name was not initialized. You must either initialize it or pass it to the function")
+
+    def get_content_type(self, filename):
+        content_type = mimetypes.guess_type(filename)[0]
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        return content_type
+
+    def delete_batch(self, bucket, batch):
+        logging.debug("Deleting %d files from bucket '%s'", len(batch), bucket)
+        try:
+            response = self.s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': filename} for filename in batch], 'Quiet': True}
+                )
+        except (BotoCoreError, ClientError) as err:
+            logging.error("Deletion of %d files failed. Error: %s", len(batch), str(err))
+            return batch
+        failed = []
+        for err in response.get('Errors', []):
+            logging.error("Deletion of file '%s' failed. Error: %s", err['Key'], err.get('Message'))
+            failed.append(err['Key'])
+        return failed
@@ -0,0 +1,332 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+from object_store.object_store import ObjectStoreInterface
+from object_store.providers.minio_object_store import MinioObjectStore
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import threading
+import logging
+import hashlib
+import bisect
+import queue
+import json
+import time
+import os
+
+# Number of points of each shard on the hash ring. More points spread the objects more evenly
+VIRTUAL_NODES_PER_SHARD = 100
+# Max number of listed objects buffered while the listings of the shards are merged
+LISTING_BUFFER_SIZE = 1000
+# Delay in seconds between two checks of whether the consumer of a listing stopped, while the buffer is full
+LISTING_STOP_CHECK_SECONDS = 0.1
+# Max number of deletions kept per shard while it is down. The oldest ones are given up past it
+MAX_PENDING_DELETIONS = 100000
+
+class ShardHealth():
+    """
+    A class used to track whether a shard should receive new objects.
+
+    A shard is avoided for a while after consecutive failures, or while its average request latency is
+    above the slow threshold.
+    """
+    def __init__(self, failure_threshold, slow_request_seconds, backoff_seconds):
+        self.failure_threshold = failure_threshold
+        self.slow_request_seconds = slow_request_seconds
+        self.backoff_seconds = backoff_seconds
+        self.consecutive_failures = 0
+        self.average_latency_seconds = 0.0
+        self._avoid_until = 0.0
+        self._lock = threading.Lock()
+
+    def is_healthy(self):
+        return time.monotonic() >= self._avoid_until
+
+    def record_success(self, latency_seconds):
+        with self._lock:
+            self.consecutive_failures = 0
+            # Exponentially weighted so a slow node is detected within a few requests
+            self.average_latency_seconds = 0.8 * self.average_latency_seconds + 0.2 * latency_seconds
+            if self.average_latency_seconds > self.slow_request_seconds:
+                self._avoid_until = time.monotonic() + self.backoff_seconds
+                # Starts over when the shard is retried so one slow request does not keep it out
+                self.average_latency_seconds = 0.0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self._avoid_until = time.monotonic() + self.backoff_seconds
+
+class ShardedMinioObjectStore(ObjectStoreInterface):
+    """
+    An object store that spreads the objects over several Minio endpoints and/or buckets.
+
+    Each object is placed on a shard by consistent hashing of its name. With the time-partitioned key
+    layout the name starts with the device ID, so the placement depends on both the device and the key.
+    A shard that fails or is slow is skipped in favor of the next shard on the ring until it recovers.
+    Since an object may therefore live on any shard, listings and deletions are sent to all the shards
+    in parallel. Deletions that a shard misses while it is down are kept and sent again once it recovers. The storage path of an object is a full URL so consumers can fetch it from the right endpoint.
+    """
+
+    def initialize(self, jsonArgs):
+        # The function should initialize any connections that need
+        # to be made or any variables that will be required
+        format = "%(asctime)s - %(levelname)s: %(threadName)s - %(message)s"
+        logging.basicConfig(format=format, level=logging.DEBUG,
+                        datefmt="%H:%M:%S")
+        args = json.loads(jsonArgs)
+
+        # Setup default values
+        failure_threshold_default = 3
+        slow_request_seconds_default = 5
+        backoff_seconds_default = 30
+
+        # Extract variables from JSON. The keys of each shard default to the top-level keys
+        if 'shards' not in args or len(args['shards']) == 0:
+            raise Exception("You must specify at least one shard with the key 'shards'")
+        shard_defaults = {key: value for key, value in args.items() if key != 'shards'}
+        self.shard_args = [dict(shard_defaults, **shard) for shard in args['shards']]
+        if 'failureThreshold' in args:
+            self.failure_threshold = args['failureThreshold']
+        else:
+            self.failure_threshold = failure_threshold_default
+        if 'slowRequestSeconds' in args:
+            self.slow_request_seconds = args['slowRequestSeconds']
+        else:
+            self.slow_request_seconds = slow_request_seconds_default
+        if 'backoffSeconds' in args:
+            self.backoff_seconds = args['backoffSeconds']
+        else:
+            self.backoff_seconds = backoff_seconds_default
+        self.validate()
+
+        # The shards are initialized, and validated, concurrently. The listings of the shards hold a thread each
+        # while they are consumed, so there are as many threads again for the deletions made meanwhile
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.shard_args), thread_name_prefix='ShardedMinioObjectStore')
+        self.shards = list(self.executor.map(self.create_shard, self.shard_args))
+        self.health = [ShardHealth(self.failure_threshold, self.slow_request_seconds, self.backoff_seconds)
+            for _ in self.shards]
+        # Names of the objects to delete from each shard once it is healthy again, oldest first
+        self.pending_deletions = [collections.OrderedDict() for _ in self.shards]
+        self.pending_deletions_lock = threading.Lock()
+        self.ring = []
+        for index, shard in enumerate(self.shards):
+            for point in range(VIRTUAL_NODES_PER_SHARD):
+                self.ring.append((self.hash('{0}/{1}#{2}'.format(shard.host, shard.bucket_name, point)), index))
+        self.ring.sort()
+        self.ring_hashes = [point_hash for point_hash, _ in self.ring]
+        logging.info("Sharding objects over %d Minio buckets", len(self.shards))
+
+    def upload(self, filepath, bucket_name = None, object_name = None):
+        """
+        Uploads a file to the shard of its object name.
+
+        Parameters:
+        filepath (string): The absolute path of the file to upload
+        bucket_name (string): Ignored. The bucket is given by the shard
+        object_name (string): Optional name of the object to create. Defaults to the name of the file
+
+        Returns:
+        string: The URL of the image
+        """
+        name = object_name if object_name is not None else os.path.basename(filepath)
+        return self.write(name, lambda shard: shard.upload(filepath, object_name=name))
+
+    def upload_data(self, filename, data, bucket_name = None):
+        """
+        Uploads an object held in memory to the shard of its name.
+
+        Parameters:
+        filename (string): The name of the object to create
+        data (bytes-like): The encoded content of the object (bytes, bytearray or memoryview)
+        bucket_name (string): Ignored. The bucket is given by the shard
+
+        Returns:
+        string: The URL of the image
+        """
+        return self.write(filename, lambda shard: shard.upload_data(filename, data))
+
+    def download(self, filename, download_path, bucket_name = None):
+        # Downloads an object from the first shard that holds it, in the order of the ring
+        error = None
+        for index in self.shards_for(filename):
+            try:
+                self.shards[index].download(filename, download_path)
+                return
+            except Exception as err:
+                error = err
+        raise error
+
+    def delete(self, filename, bucket_name = None):
+        failed = self.delete_many([filename])
+        if len(failed) > 0:
+            raise Exception("Deletion of file '{0}' failed".format(filename))
+
+    def delete_many(self, filenames, bucket_name = None):
+        """
+        Deletes several files from all the shards in parallel. Deleting an object a shard does not hold succeeds.
+        The deletions of a shard that is down or fails are kept and sent along with the next deletions once the
+        shard is healthy, so they are not reported as failed.
+
+        Parameters:
+        filenames (list): The names of the files to delete
+        bucket_name (string): Ignored. The deletions are sent to every shard
+
+        Returns:
+        list: The names of the files that could not be deleted. Always empty
+        """
+        list(self.executor.map(lambda index: self.delete_from_shard(index, filenames), range(len(self.shards))))
+        return []
+
+    def list_objects(self, bucket_name = None, prefix = None):
+        """
+        Lists the objects of all the shards in parallel. The objects of a shard whose listing fails are skipped.
+
+        Parameters:
+        bucket_name (string): Ignored. Every shard is listed
+        prefix (string): Optional argument to only list the objects whose name starts with the prefix
+
+        Returns:
+        generator: Tuples of (object name, last modified), streamed as the listings of the shards are consumed
+        """
+        listings = queue.Queue(LISTING_BUFFER_SIZE)
+        stopped = threading.Event()
+        done = object()
+
+        def list_shard(shard):
+            try:
+                for obj in shard.list_objects(prefix=prefix):
+                    if not self.put_listing(listings, obj, stopped):
+                        return
+            except Exception as err:
+                logging.error("Listing of shard %s/%s failed. Its objects are skipped. Error: %s", shard.host,
+                    shard.bucket_name, str(err))
+            self.put_listing(listings, done, stopped)
+
+        for shard in self.shards:
+            self.executor.submit(list_shard, shard)
+        remaining = len(self.shards)
+        try:
+            while remaining > 0:
+                item = listings.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            # Releases the listings of the shards when the consumer stops early
+            stopped.set()
+
+    def list_prefixes(self, prefix = '', bucket_name = None):
+        # Lists the prefixes of all the shards in parallel, without duplicates. The prefixes of a shard whose listing fails are skipped
+        prefixes = set()
+        for shard_prefixes in self.executor.map(lambda shard: self.list_shard_prefixes(shard, prefix), self.shards):
+            prefixes.update(shard_prefixes)
+        for common_prefix in sorted(prefixes):
+            yield common_prefix
+
+    ######################HELPER METHODS########################
+
+    def validate(self):
+        for shard in self.shard_args:
+            for key in ['host', 'accessKey', 'secretKey', 'httpsEnabled', 'bucketName']:
+                if key not in shard:
+                    raise Exception("The key '{0}' is missing from the shard {1}".format(key, shard.get('host')))
+        if self.failure_threshold <= 0:
+            raise Exception("The failure threshold must be a number greater than 0. Value given: {0}"
+                .format(self.failure_threshold))
+
+    def create_shard(self, shard_args):
+        shard = MinioObjectStore()
+        shard.initialize(json.dumps(shard_args))
+        return shard
+
+    def hash(self, key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def shards_for(self, name):
+        # Returns the indexes of the shards in the order of the ring starting at the position of the name
+        position = bisect.bisect(self.ring_hashes, self.hash(name))
+        indexes = []
+        for offset in range(len(self.ring)):
+            index = self.ring[(position + offset) % len(self.ring)][1]
+            if index not in indexes:
+                indexes.append(index)
+                if len(indexes) == len(self.shards):
+                    break
+        return indexes
+
+    def write(self, name, upload):
+        # Uploads to the first healthy shard of the name, then to the next ones if the upload fails.
+        # When no shard is healthy, the shards are tried anyway in the order of the ring
+        candidates = self.shards_for(name)
+        healthy = [index for index in candidates if self.health[index].is_healthy()]
+        error = None
+        for index in healthy or candidates:
+            shard = self.shards[index]
+            start = time.monotonic()
+            try:
+                upload(shard)
+            except Exception as err:
+                logging.warning("Upload of '%s' to shard %s/%s failed. Error: %s", name, shard.host, shard.bucket_name, str(err))
+                self.health[index].record_failure()
+                error = err
+                continue
+            self.health[index].record_success(time.monotonic() - start)
+            scheme = 'https' if shard.https_enabled else 'http'
+            return '{0}://{1}/{2}/{3}'.format(scheme, shard.host, shard.bucket_name, name)
+        raise error
+
+    def put_listing(self, listings, item, stopped):
+        # Waits for room in the buffer of a listing. Returns False once the consumer of the listing stopped
+        while not stopped.is_set():
+            try:
+                listings.put(item, timeout=LISTING_STOP_CHECK_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def list_shard_prefixes(self, shard, prefix):
+        try:
+            return list(shard.list_prefixes(prefix))
+        except Exception as err:
+            logging.error("Listing of the prefixes of shard %s/%s failed. They are skipped. Error: %s", shard.host,
+                shard.bucket_name, str(err))
+            return []
+
+    def delete_from_shard(self, index, filenames):
+        # Deletes the files from a shard along with its pending deletions, or keeps them all pending while it is down
+        shard = self.shards[index]
+        if not self.health[index].is_healthy():
+            self.add_pending_deletions(index, filenames)
+            return
+        with self.pending_deletions_lock:
+            pending = list(self.pending_deletions[index])
+            names = pending + [filename for filename in filenames if filename not in self.pending_deletions[index]]
+        try:
+            failed = shard.delete_many(names)
+        except Exception as err:
+            logging.error("Deletion of %d files from shard %s/%s failed. They are retried later. Error: %s", len(names),
+                shard.host, shard.bucket_name, str(err))
+            self.health[index].record_failure()
+            failed = names
+        with self.pending_deletions_lock:
+            for name in pending:
+                self.pending_deletions[index].pop(name, None)
+        self.add_pending_deletions(index, failed)
+
+    def add_pending_deletions(self, index, filenames):
+        with self.pending_deletions_lock:
+            pending = self.pending_deletions[index]
+            for filename in filenames:
+                pending[filename] = None
+            if len(pending) > MAX_PENDING_DELETIONS:
+                shard = self.shards[index]
+                logging.warning("Giving up %d deletions of shard %s/%s, which stayed down", len(pending) - MAX_PENDING_DELETIONS,
+                    shard.host, shard.bucket_name)
+                while len(pending) > MAX_PENDING_DELETIONS:
+                    pending.popitem(last=False)
@@ -0,0 +1,70 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import collections
+import threading
+import logging
+
+class RetentionIndex():
+    """
+    A class used to keep track, oldest first, of the objects kept in the object store.
+
+    The index is seeded once from a listing of the bucket and then updated with every upload, so
+    deciding which objects to evict costs O(evicted) instead of a full listing and sort.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def seed(self, objects):
+        """
+        Adds the objects already present in the object store to the index.
+
+        Parameters:
+        objects (iterable): Tuples of (object name, last modified) streamed from the object store
+        """
+        # The listing is sorted by age, so it is held in memory as (name, last modified) tuples. Every object is
+        # kept, including the ones past the capacity, since those are the next ones to delete
+        existing = sorted(objects, key=lambda x: x[1])
+        with self._lock:
+            uploaded_since = list(self._keys)
+            self._keys.clear()
+            for name, _ in existing:
+                self._keys[name] = None
+            for name in uploaded_since:
+                self._keys.pop(name, None)
+                self._keys[name] = None
+        logging.debug("Retention index seeded with %d objects", len(existing))
+
+    def add(self, name):
+        # Records an object that was just uploaded as the newest one
+        with self._lock:
+            self._keys.pop(name, None)
+            self._keys[name] = None
+
+    def pop_expired(self):
+        """
+        Removes the oldest objects that exceed the capacity from the index.
+
+        Returns:
+        list: The names of the objects to delete from the object store, oldest first
+        """
+        expired = []
+        with self._lock:
+            while len(self._keys) > self.capacity:
+                expired.append(self._keys.popitem(last=False)[0])
+        return expired
+
+    def restore(self, names):
+        # Puts back at the front of the index objects whose deletion failed so they are retried first
+        with self._lock:
+            for name in reversed(names):
+                self._keys[name] = None
+                self._keys.move_to_end(name, last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
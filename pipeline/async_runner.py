@@ -0,0 +1,261 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import concurrent.futures
+import asyncio
+import logging
+import signal
+import time
+import paho.mqtt.client as mqtt
+from pipeline.bounded_queue import AsyncBoundedQueue
+from pipeline.metrics import start_metrics_server
+from pipeline.spool import DrainBackoff, RECORD_UPLOAD
+
+# Period in seconds of the housekeeping of the MQTT client (keepalive pings and retries)
+MQTT_MISC_INTERVAL_SECONDS = 1
+# Delay in seconds between two attempts to reconnect to the MQTT broker
+MQTT_RECONNECT_DELAY_SECONDS = 5
+
+class MQTTSocketAdapter():
+    """
+    A class used to drive the network loop of a paho MQTT client from an asyncio event loop instead of
+    the thread started by loop_start(). The socket of the client is watched by the event loop and the
+    client reads or writes as soon as it is ready.
+    """
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self._misc_task = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        logging.debug("MQTT socket opened")
+        self.loop.add_reader(sock, client.loop_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        logging.debug("MQTT socket closed")
+        self.loop.remove_reader(sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self):
+        # Sends the keepalive pings and reconnects when the broker drops the connection
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                await asyncio.sleep(MQTT_RECONNECT_DELAY_SECONDS)
+                logging.info("Reconnecting to MQTT broker...")
+                try:
+                    self.client.reconnect()
+                except Exception as e:
+                    logging.error("An error occurred that prevented the reconnection to the MQTT broker. Error: %s", str(e))
+                continue
+            await asyncio.sleep(MQTT_MISC_INTERVAL_SECONDS)
+
+    def close(self):
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+        self.client.disconnect()
+
+class AsyncRunner():
+    """
+    A class used to run the pipeline of an App on a single asyncio event loop instead of a thread per stage.
+
+    Scheduling, batching, MQTT networking and shutdown happen on the event loop. The object store
+    clients and the data sources only offer blocking calls, so captures, uploads and cleanups run in a
+    thread pool sized for the number of cameras and upload workers, and never block the event loop.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(app.data_sources) + app.args.upload_workers + 2)
+        self.loop.set_default_executor(self.executor)
+        self.mqtt_adapter = None
+        self._stop_event = None
+        self._tasks = []
+        # The queues are swapped for their asyncio counterparts before anything uses them. The shared
+        # code of the App, e.g. its metrics and the spool drain, keeps working with the same attributes
+        self.app.upload_queue = AsyncBoundedQueue('upload', app.args.queue_size, app.args.queue_drop_policy, self.loop)
+        self.app.publish_queue = AsyncBoundedQueue('publish', app.args.queue_size, app.args.queue_drop_policy, self.loop)
+
+    def run(self):
+        # Connects to the MQTT broker and runs the pipeline until SIGINT or SIGTERM is received
+        asyncio.set_event_loop(self.loop)
+        self._stop_event = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.stop)
+        try:
+            self.loop.run_until_complete(self.main())
+        finally:
+            self.loop.close()
+
+    def run_pipeline(self):
+        # Runs the pipeline with an MQTT client that is already connected, until stop() is called
+        asyncio.set_event_loop(self.loop)
+        self._stop_event = asyncio.Event()
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        # Can be called from any thread
+        logging.info('Stopping the pipeline...')
+        self.loop.call_soon_threadsafe(self._stop_event.set)
+
+    async def main(self):
+        # The queues are bound first since MQTT callbacks, e.g. burst commands, can feed them once connected
+        self.bind_queues()
+        # The object store is indexed while the broker answers the connection
+        await asyncio.gather(self.connect(), self.seed_retention_index())
+        try:
+            await self.serve()
+        finally:
+            self.mqtt_adapter.close()
+
+    async def connect(self):
+        # Initialize the MQTT client. Its network loop runs on the event loop
+        logging.info("Connecting to MQTT broker...")
+        connect_start = time.monotonic()
+        self.mqtt_adapter = MQTTSocketAdapter(self.loop, self.app.mqtt_client)
+        self.app.mqtt_client.username_pw_set(self.app.args.mqtt_username, self.app.args.mqtt_password)
+        self.app.mqtt_client.connect(self.app.args.mqtt_hostname, self.app.args.mqtt_port)
+        await self.loop.run_in_executor(None, self.app.wait_for_mqtt_connection)
+        self.app.startup_timer.record('mqtt', time.monotonic() - connect_start)
+        logging.info("Success")
+
+    async def seed_retention_index(self):
+        with self.app.startup_timer.step('retention index'):
+            await self.loop.run_in_executor(None, self.app.seed_retention_index)
+
+    def bind_queues(self):
+        self.app.upload_queue.bind_to_current_thread()
+        self.app.publish_queue.bind_to_current_thread()
+
+    async def serve(self):
+        self.bind_queues()
+        if self.app.args.metrics_port is not None:
+            self.app.metrics_server = start_metrics_server(self.app.metrics, self.app.args.metrics_port)
+        for data_source in self.app.data_sources:
+            self._tasks.append(self.loop.create_task(self.image_collection(data_source)))
+        for i in range(self.app.args.upload_workers):
+            self._tasks.append(self.loop.create_task(self.upload_worker()))
+        self._tasks.append(self.loop.create_task(self.publisher()))
+        self._tasks.append(self.loop.create_task(self.garbage_collection()))
+        if self.app.frame_packers is not None:
+            self._tasks.append(self.loop.create_task(self.pack_flush()))
+        if self.app.spool is not None:
+            self._tasks.append(self.loop.create_task(self.spool_drain()))
+        logging.debug('All tasks started')
+        self.app.startup_timer.report()
+
+        await self._stop_event.wait()
+        await self.shutdown()
+
+    async def shutdown(self):
+        # Cancels the stages of the pipeline and waits for the operations running in the thread pool to
+        # finish so no upload or spool write is cut short
+        for task in self._tasks:
+            task.cancel()
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+                logging.error("A stage of the pipeline failed. Error: %s", str(result))
+        self.executor.shutdown(wait=True)
+        if self.app.inference_pool is not None:
+            self.app.inference_pool.close()
+        self.app.close_encoder_pools()
+        if self.app.spool is not None:
+            self.app.spool.close()
+        if self.app.capture_log is not None:
+            self.app.capture_log.close()
+        logging.info('Pipeline stopped')
+
+    async def image_collection(self, data_source):
+        logging.info("Starting data collection for device '%s'", data_source.device_id)
+        while True:
+            deadline = data_source.scheduler.advance()
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            data_source.scheduler.record_jitter(time.monotonic() - deadline)
+            for data in await self.loop.run_in_executor(None, self.app.capture, data_source):
+                # People are counted in the encoded image, which is waited for off the event loop
+                if data_source.people_count_policy is not None and data.encoding_pending():
+                    if not await self.loop.run_in_executor(None, self.app.try_wait_for_encoding, data):
+                        continue
+                self.app.dispatch(data_source, data)
+
+    async def upload_worker(self):
+        while True:
+            data = await self.loop.run_in_executor(None, self.app.pack, await self.app.upload_queue.get())
+            if data is not None and await self.loop.run_in_executor(None, self.app.try_upload, data):
+                self.app.publish_queue.put(data)
+
+    async def publisher(self):
+        # MQTT messages are published from the event loop, which also owns the socket of the client
+        while True:
+            self.app.publish_batch(await self.collect_publish_batch())
+
+    async def collect_publish_batch(self):
+        batch = [await self.app.publish_queue.get()]
+        deadline = time.monotonic() + self.app.args.mqtt_batch_interval_ms / 1000.0
+        while len(batch) < self.app.args.mqtt_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            data = await self.app.publish_queue.get(remaining)
+            if data is None:
+                break
+            batch.append(data)
+        return batch
+
+    async def garbage_collection(self):
+        while True:
+            logging.debug("Sleeping for %d minutes", self.app.args.image_cleanup_interval_minutes)
+            await asyncio.sleep(self.app.args.image_cleanup_interval_minutes * 60)
+            await self.loop.run_in_executor(None, self.app.clean_up)
+
+    async def pack_flush(self):
+        while True:
+            await asyncio.sleep(min(self.app.args.pack_interval_seconds / 4, 1))
+            for pack in self.app.flush_expired_packs():
+                if await self.loop.run_in_executor(None, self.app.try_upload, pack):
+                    self.app.publish_queue.put(pack)
+
+    async def spool_drain(self):
+        delay = 1.0 / self.app.args.spool_drain_rate
+        backoff = DrainBackoff()
+        while True:
+            batch = await self.loop.run_in_executor(None, self.app.spool.read_batch, self.app.args.spool_batch_size)
+            if len(batch) == 0:
+                await asyncio.sleep(1)
+                continue
+            logging.info("Draining %d records from the spool", len(batch))
+            for record, position in batch:
+                try:
+                    if record.kind == RECORD_UPLOAD:
+                        await self.loop.run_in_executor(None, self.app.drain_record, record)
+                    else:
+                        # Spooled MQTT messages are published from the event loop like the others
+                        self.app.drain_record(record)
+                except Exception as e:
+                    retry_delay = backoff.next_delay()
+                    logging.error("An error occurred that prevented the draining of the spool. Retrying in %d seconds. Error: %s",
+                        retry_delay, str(e))
+                    await asyncio.sleep(retry_delay)
+                    break
+                backoff.reset()
+                self.app.spool.commit(position)
+                await asyncio.sleep(delay)
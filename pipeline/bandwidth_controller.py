@@ -0,0 +1,166 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import collections
+import threading
+import logging
+
+# Weight of the latest upload in the moving averages
+SMOOTHING_FACTOR = 0.2
+# Fraction of the budget below which the encoding is allowed to improve again
+HEADROOM = 0.7
+QUALITY_STEP = 10
+SCALE_STEP = 0.75
+INTERVAL_STEP = 1.25
+# Period in seconds over which the throughput of the uplink is measured
+THROUGHPUT_WINDOW_SECONDS = 10
+
+class BandwidthController():
+    """
+    A class used to keep the uplink usage of a camera under a bytes-per-second budget.
+
+    The controller measures the size of every upload and the throughput of the uplink: the bytes uploaded
+    over the last seconds divided by the time at least one upload was in flight, so concurrent uploads
+    are not counted as a slower link. When the camera produces more
+    bytes per second than the budget, or than the uplink actually delivers, it lowers the JPEG quality
+    first, then the resolution, then the capture rate. When there is headroom again, it restores them
+    in the reverse order. All the parameters stay within the bounds given. The quality is left alone
+    for lossless images, which it does not affect.
+    """
+    def __init__(self, jsonArgs, jpeg_quality, image_capture_interval_seconds, lossy=True):
+        # Setup default values
+        min_jpeg_quality_default = 40
+        min_image_scale_default = 0.25
+        max_interval_factor_default = 4
+
+        # Initialize variables to defaults if they were not provided in the JSON payload
+        args = jsonArgs
+        if 'budget_bytes_per_second' in args:
+            self.budget_bytes_per_second = args['budget_bytes_per_second']
+        else:
+            raise Exception("You must specify a budget in bytes per second for adaptive encoding")
+        if 'min_jpeg_quality' in args:
+            self.min_jpeg_quality = args['min_jpeg_quality']
+        else:
+            self.min_jpeg_quality = min(min_jpeg_quality_default, jpeg_quality)
+        if 'min_image_scale' in args:
+            self.min_image_scale = args['min_image_scale']
+        else:
+            self.min_image_scale = min_image_scale_default
+        if 'max_image_capture_interval_seconds' in args:
+            self.max_interval_seconds = args['max_image_capture_interval_seconds']
+        else:
+            self.max_interval_seconds = image_capture_interval_seconds * max_interval_factor_default
+        self.max_jpeg_quality = jpeg_quality
+        self.lossy = lossy
+        self.min_interval_seconds = image_capture_interval_seconds
+        self.validate()
+
+        self.jpeg_quality = jpeg_quality
+        self.image_scale = 1.0
+        self.interval_seconds = image_capture_interval_seconds
+        self._bytes_per_image = None
+        self._throughput = None
+        # Uploads within the throughput window as tuples of (start, end, bytes), in time.monotonic() seconds
+        self._uploads = collections.deque()
+        self._lock = threading.Lock()
+
+    def record_upload(self, size_bytes, start_time, end_time, images=1):
+        """
+        Records an upload and adjusts the encoding parameters accordingly.
+
+        Parameters:
+        size_bytes (int): Number of bytes uploaded
+        start_time (float): time.monotonic() when the upload started
+        end_time (float): time.monotonic() when the upload ended
+        images (int): Number of images in the upload, e.g. of a pack
+        """
+        with self._lock:
+            self._bytes_per_image = self.smooth(self._bytes_per_image, size_bytes / images)
+            self._uploads.append((start_time, end_time, size_bytes))
+            while self._uploads[0][1] < end_time - THROUGHPUT_WINDOW_SECONDS:
+                self._uploads.popleft()
+            busy_seconds = self.busy_seconds()
+            if busy_seconds > 0:
+                self._throughput = sum(upload[2] for upload in self._uploads) / busy_seconds
+            budget = self.budget_bytes_per_second
+            if self._throughput is not None:
+                budget = min(budget, self._throughput)
+            demand = self._bytes_per_image / self.interval_seconds
+
+            if demand > budget:
+                self.decrease()
+            elif demand < HEADROOM * budget:
+                self.increase()
+
+    def get_parameters(self):
+        """
+        Returns:
+        tuple: The JPEG quality, image scale and capture interval to use for the next capture
+        """
+        with self._lock:
+            return self.jpeg_quality, self.image_scale, self.interval_seconds
+
+    ######################HELPER METHODS########################
+
+    def busy_seconds(self):
+        # Time during which at least one of the uploads of the window was in flight
+        busy_seconds = 0.0
+        busy_until = None
+        for start_time, end_time, _ in sorted(self._uploads):
+            if busy_until is None or start_time > busy_until:
+                busy_seconds += end_time - start_time
+                busy_until = end_time
+            elif end_time > busy_until:
+                busy_seconds += end_time - busy_until
+                busy_until = end_time
+        return busy_seconds
+
+    def smooth(self, average, value):
+        if average is None:
+            return value
+        return (1 - SMOOTHING_FACTOR) * average + SMOOTHING_FACTOR * value
+
+    def decrease(self):
+        # Cheapest degradation first: quality, then resolution, then capture rate
+        if self.lossy and self.jpeg_quality > self.min_jpeg_quality:
+            self.jpeg_quality = max(self.jpeg_quality - QUALITY_STEP, self.min_jpeg_quality)
+        elif self.image_scale > self.min_image_scale:
+            self.image_scale = max(self.image_scale * SCALE_STEP, self.min_image_scale)
+        elif self.interval_seconds < self.max_interval_seconds:
+            self.interval_seconds = min(self.interval_seconds * INTERVAL_STEP, self.max_interval_seconds)
+        else:
+            return
+        # The size of the next images is unknown until they are measured
+        self._bytes_per_image = None
+        logging.debug("Uplink over budget. Encoding with quality %d, scale %.2f, interval %.2f s",
+            self.jpeg_quality, self.image_scale, self.interval_seconds)
+
+    def increase(self):
+        if self.interval_seconds > self.min_interval_seconds:
+            self.interval_seconds = max(self.interval_seconds / INTERVAL_STEP, self.min_interval_seconds)
+        elif self.image_scale < 1.0:
+            self.image_scale = min(self.image_scale / SCALE_STEP, 1.0)
+        elif self.lossy and self.jpeg_quality < self.max_jpeg_quality:
+            self.jpeg_quality = min(self.jpeg_quality + QUALITY_STEP, self.max_jpeg_quality)
+        else:
+            return
+        self._bytes_per_image = None
+        logging.debug("Uplink under budget. Encoding with quality %d, scale %.2f, interval %.2f s",
+            self.jpeg_quality, self.image_scale, self.interval_seconds)
+
+    def validate(self):
+        if self.budget_bytes_per_second <= 0:
+            raise Exception("The budget in bytes per second for adaptive encoding must be a number greater than 0. Value given: {0}"
+                .format(self.budget_bytes_per_second))
+        if self.min_jpeg_quality < 1 or self.min_jpeg_quality > self.max_jpeg_quality:
+            raise Exception("The min JPEG quality for adaptive encoding must be between 1 and the JPEG quality ({0}). Value given: {1}"
+                .format(self.max_jpeg_quality, self.min_jpeg_quality))
+        if self.min_image_scale <= 0 or self.min_image_scale > 1:
+            raise Exception("The min image scale for adaptive encoding must be greater than 0 and at most 1. Value given: {0}"
+                .format(self.min_image_scale))
+        if self.max_interval_seconds < self.min_interval_seconds:
+            raise Exception("The max capture interval for adaptive encoding must be at least the capture interval ({0}). Value given: {1}"
+                .format(self.min_interval_seconds, self.max_interval_seconds))
@@ -0,0 +1,151 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import collections
+import threading
+import logging
+import asyncio
+import sys
+
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+DROP_POLICIES = [DROP_OLDEST, DROP_NEWEST]
+
+class BoundedQueue():
+    """
+    A thread-safe FIFO queue with a fixed capacity used to connect the stages of the pipeline.
+
+    Producers never block: when the queue is full an item is discarded according to the
+    drop policy, which gives backpressure when the downstream stage falls behind.
+    """
+    def __init__(self, name, maxsize, drop_policy=DROP_OLDEST):
+        if maxsize <= 0:
+            raise Exception("The size of the queue '{0}' must be a number greater than 0. Value given: {1}"
+                .format(name, maxsize))
+        if drop_policy not in DROP_POLICIES:
+            raise Exception("The drop policy '{0}' is not supported. Supported policies are: {1}"
+                .format(drop_policy, DROP_POLICIES))
+        self.name = name
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.dropped_count = 0
+        self._items = collections.deque()
+        self._not_empty = threading.Condition(threading.Lock())
+
+    def put(self, item):
+        """
+        Adds an item to the end of the queue without blocking.
+
+        Parameters:
+        item (object): The item to add to the queue
+
+        Returns:
+        object: The item that was discarded to respect the capacity of the queue, None otherwise
+        """
+        dropped = None
+        with self._not_empty:
+            if len(self._items) >= self.maxsize:
+                self.dropped_count += 1
+                if self.drop_policy == DROP_NEWEST:
+                    dropped = item
+                else:
+                    dropped = self._items.popleft()
+                    self._items.append(item)
+            else:
+                self._items.append(item)
+            self._not_empty.notify()
+        if dropped is not None:
+            logging.warning("Queue '%s' is full (%d items). Dropped the %s item", self.name, self.maxsize, self.drop_policy)
+        return dropped
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the item at the front of the queue, waiting until one is available.
+
+        Parameters:
+        timeout (float): Optional number of seconds to wait for an item
+
+        Returns:
+        object: The item at the front of the queue, None if the timeout expired
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: len(self._items) > 0, timeout):
+                return None
+            return self._items.popleft()
+
+    def qsize(self):
+        with self._not_empty:
+            return len(self._items)
+
+class AsyncBoundedQueue():
+    """
+    The asyncio counterpart of BoundedQueue, with the same capacity and drop policy.
+
+    put() never blocks and can be called from any thread: calls made outside the event loop are
+    handed over to it, so the code shared with the threaded pipeline can keep feeding the queue.
+    """
+    def __init__(self, name, maxsize, drop_policy, loop):
+        if maxsize <= 0:
+            raise Exception("The size of the queue '{0}' must be a number greater than 0. Value given: {1}"
+                .format(name, maxsize))
+        if drop_policy not in DROP_POLICIES:
+            raise Exception("The drop policy '{0}' is not supported. Supported policies are: {1}"
+                .format(drop_policy, DROP_POLICIES))
+        self.name = name
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.dropped_count = 0
+        self._loop = loop
+        self._loop_thread_id = None
+        self._items = None
+
+    def bind_to_current_thread(self):
+        # Must be called from the thread running the event loop before the queue is used. The asyncio queue is
+        # only created then: before Python 3.10 it binds to the current event loop when it is created
+        self._loop_thread_id = threading.get_ident()
+        if self._items is None:
+            self._items = asyncio.Queue(loop=self._loop) if sys.version_info < (3, 8) else asyncio.Queue()
+
+    def put(self, item):
+        if threading.get_ident() != self._loop_thread_id:
+            self._loop.call_soon_threadsafe(self.put_in_loop, item)
+            return None
+        return self.put_in_loop(item)
+
+    def put_in_loop(self, item):
+        dropped = None
+        if self._items.qsize() >= self.maxsize:
+            self.dropped_count += 1
+            if self.drop_policy == DROP_NEWEST:
+                dropped = item
+            else:
+                dropped = self._items.get_nowait()
+                self._items.put_nowait(item)
+            logging.warning("Queue '%s' is full (%d items). Dropped the %s item", self.name, self.maxsize, self.drop_policy)
+        else:
+            self._items.put_nowait(item)
+        return dropped
+
+    async def get(self, timeout=None):
+        """
+        Removes and returns the item at the front of the queue, waiting until one is available.
+
+        Parameters:
+        timeout (float): Optional number of seconds to wait for an item
+
+        Returns:
+        object: The item at the front of the queue, None if the timeout expired
+        """
+        if timeout is None:
+            return await self._items.get()
+        try:
+            return await asyncio.wait_for(self._items.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def qsize(self):
+        if self._items is None:
+            return 0
+        return self._items.qsize()
@@ -0,0 +1,99 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import threading
+import logging
+import json
+import time
+import uuid
+
+class BurstCommand():
+    """
+    A class used to hold a request, received over MQTT, to capture several frames back-to-back with a device.
+
+    The command is a JSON object such as {"deviceID": "camera-1", "frames": 20, "fps": 10}. An optional
+    "burstID" is echoed in the messages of the captures so the consumer can tell them apart.
+    """
+    def __init__(self, device_id, frames, fps, burst_id, received_at):
+        self.device_id = device_id
+        self.frames = frames
+        self.fps = fps
+        self.burst_id = burst_id
+        # In time.monotonic() seconds, to measure the latency of the burst
+        self.received_at = received_at
+
+    @classmethod
+    def from_payload(cls, payload, default_device_id, max_frames, max_fps, max_duration_seconds):
+        """
+        Parses a burst command.
+
+        Parameters:
+        payload (bytes): The payload of the MQTT message
+        default_device_id (string): The device to use when the command does not name one
+        max_frames (int): The max number of frames of a burst
+        max_fps (float): The max capture rate of a burst
+        max_duration_seconds (float): The max time a burst lasts, i.e. its number of frames over its capture rate
+
+        Returns:
+        BurstCommand: The command, received now
+        """
+        received_at = time.monotonic()
+        try:
+            args = json.loads(payload.decode('utf-8'))
+        except ValueError as e:
+            raise Exception("The burst command is not valid JSON. Error: {0}".format(str(e)))
+        if not isinstance(args, dict) or 'frames' not in args or 'fps' not in args:
+            raise Exception("The burst command must be a JSON object with the keys 'frames' and 'fps'")
+        frames = args['frames']
+        fps = args['fps']
+        if not isinstance(frames, int) or frames <= 0 or frames > max_frames:
+            raise Exception("The number of frames of a burst must be a number between 1 and {0}. Value given: {1}"
+                .format(max_frames, frames))
+        if not isinstance(fps, (int, float)) or fps <= 0 or fps > max_fps:
+            raise Exception("The frame rate of a burst must be a number greater than 0 and up to {0}. Value given: {1}"
+                .format(max_fps, fps))
+        if frames / fps > max_duration_seconds:
+            raise Exception("A burst must last up to {0} seconds. Value given: {1} frames at {2} fps"
+                .format(max_duration_seconds, frames, fps))
+        burst_id = str(args.get('burstID', uuid.uuid4().hex[:8]))
+        return cls(args.get('deviceID', default_device_id), frames, float(fps), burst_id, received_at)
+
+class BurstTracker():
+    """
+    A class used to keep track of the bursts in progress: one burst per device at a time, and the time
+    from the receipt of each command to the publish of its first capture.
+    """
+    def __init__(self, latency_histogram):
+        self.latency_histogram = latency_histogram
+        self._lock = threading.Lock()
+        self._active_devices = set()
+        self._awaiting_publish = {}
+
+    def start(self, command):
+        # Returns False when a burst of the device is already in progress
+        with self._lock:
+            if command.device_id in self._active_devices:
+                return False
+            self._active_devices.add(command.device_id)
+            self._awaiting_publish[command.burst_id] = command.received_at
+            return True
+
+    def finish(self, command):
+        with self._lock:
+            self._active_devices.discard(command.device_id)
+
+    def record_publish(self, burst_id):
+        # Called for every published capture of a burst. Only the first one is measured
+        with self._lock:
+            received_at = self._awaiting_publish.pop(burst_id, None)
+        if received_at is not None:
+            latency = time.monotonic() - received_at
+            self.latency_histogram.observe(latency)
+            logging.info("First capture of burst '%s' published %.1f ms after the command", burst_id, latency * 1000)
+
+    def discard(self, burst_id):
+        # Forgets a burst none of whose captures could be published
+        with self._lock:
+            self._awaiting_publish.pop(burst_id, None)
@@ -0,0 +1,225 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Prints the records of a capture log as JSON lines, e.g. the captures of the last hour:
+#   python3 -m pipeline.capture_log /var/lib/people-counter/captures.log --since -3600
+#
+import argparse
+import threading
+import logging
+import struct
+import json
+import mmap
+import time
+import os
+
+FILE_HEADER = struct.Struct('<4sHH')
+FILE_MAGIC = b'PCCL'
+FILE_VERSION = 2
+# Longer device IDs and storage paths are truncated. Records with a truncated storage path are flagged
+DEVICE_ID_SIZE = 32
+STORAGE_PATH_SIZE = 512
+FLAG_TRUNCATED_STORAGE_PATH = 0x01
+# logged at, creation timestamp, uploaded bytes, JPEG quality, image scale, people count, flags, device ID, storage path
+RECORD = struct.Struct('<ddQhfiB{0}s{1}s'.format(DEVICE_ID_SIZE, STORAGE_PATH_SIZE))
+ROTATED_EXTENSION = '.1'
+# Logs written with another version are moved aside with this extension
+INCOMPATIBLE_EXTENSION = '.incompatible'
+
+class CaptureRecord():
+    """
+    A class used to hold a record of the capture log. Quality and people count are -1 when unknown. The
+    storage path is only a prefix of the actual path when it is flagged as truncated.
+    """
+    __slots__ = ['logged_at', 'creation_timestamp', 'size', 'jpeg_quality', 'image_scale', 'people_count',
+        'truncated', 'device_id', 'storage_path']
+
+    def __init__(self, logged_at, creation_timestamp, size, jpeg_quality, image_scale, people_count, truncated,
+        device_id, storage_path):
+        self.logged_at = logged_at
+        self.creation_timestamp = creation_timestamp
+        self.size = size
+        self.jpeg_quality = jpeg_quality
+        self.image_scale = image_scale
+        self.people_count = people_count
+        self.truncated = truncated
+        self.device_id = device_id
+        self.storage_path = storage_path
+
+    @classmethod
+    def unpack_from(cls, buffer, offset):
+        fields = RECORD.unpack_from(buffer, offset)
+        return cls(*fields[:6], bool(fields[6] & FLAG_TRUNCATED_STORAGE_PATH),
+            fields[7].rstrip(b'\0').decode('utf-8', 'ignore'), fields[8].rstrip(b'\0').decode('utf-8', 'ignore'))
+
+    def pack(self):
+        flags = FLAG_TRUNCATED_STORAGE_PATH if self.truncated else 0
+        return RECORD.pack(self.logged_at, self.creation_timestamp, self.size, self.jpeg_quality, self.image_scale,
+            self.people_count, flags, self.device_id.encode('utf-8'), self.storage_path.encode('utf-8'))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class CaptureLog():
+    """
+    A compact, append-only log of the captures advertised by the daemon, kept on disk.
+
+    Every record has the same size, so the log is looked up by time range with a binary search over a
+    memory map of the file instead of being parsed. Records are ordered by the time they were logged,
+    which follows the capture time except for uploads drained late from the spool. Past its max size,
+    the log is rotated once, so it never uses more than twice its max size.
+    """
+    def __init__(self, path, max_size_bytes):
+        self.path = path
+        self.max_size_bytes = max(max_size_bytes, FILE_HEADER.size + RECORD.size)
+        self._lock = threading.Lock()
+        self._last_logged_at = 0.0
+        for path in [self.path + ROTATED_EXTENSION, self.path]:
+            discard_incompatible(path)
+        self._file = self.open_for_append()
+
+    def append(self, data, size):
+        """
+        Appends the record of captured data to the log.
+
+        Parameters:
+        data (CapturedData): The captured data, once it is uploaded or its upload was skipped
+        size (int): Number of bytes uploaded, 0 when the upload was skipped
+        """
+        encoding = data.encoding or {}
+        storage_path = data.storage_path or ''
+        device_id = data.device_id or ''
+        truncated = len(storage_path.encode('utf-8')) > STORAGE_PATH_SIZE
+        if truncated or len(device_id.encode('utf-8')) > DEVICE_ID_SIZE:
+            logging.warning("The storage path '%s' or the device ID '%s' is truncated in the capture log", storage_path, device_id)
+        with self._lock:
+            # The log time never goes backwards, even if the clock does, so the log stays sorted
+            self._last_logged_at = max(time.time(), self._last_logged_at)
+            record = CaptureRecord(self._last_logged_at, data.creation_timestamp, size, encoding.get('quality', -1),
+                encoding.get('scale', 1.0), data.people_count if data.people_count is not None else -1,
+                truncated, device_id, storage_path)
+            self._file.write(record.pack())
+            self._file.flush()
+            if self._file.tell() >= self.max_size_bytes:
+                self._file.close()
+                os.replace(self.path, self.path + ROTATED_EXTENSION)
+                self._file = self.open_for_append()
+
+    def between(self, start, end):
+        """
+        Looks up the records logged in a time range.
+
+        Parameters:
+        start (float): Start of the range, in seconds since the epoch
+        end (float): End of the range, in seconds since the epoch. Records logged at the end are excluded
+
+        Returns:
+        list: The records, oldest first
+        """
+        with self._lock:
+            records = []
+            for path in [self.path + ROTATED_EXTENSION, self.path]:
+                records.extend(read_records(path, start, end))
+            return records
+
+    def newest(self, count):
+        # Returns the newest records, oldest first
+        with self._lock:
+            records = read_records(self.path, newest=count)
+            if len(records) < count:
+                records = read_records(self.path + ROTATED_EXTENSION, newest=count - len(records)) + records
+            return records
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    ######################HELPER METHODS########################
+
+    def open_for_append(self):
+        # Opens the log, writing its header if it is new and dropping a record torn by a crash
+        log_file = open(self.path, 'ab')
+        if log_file.tell() == 0:
+            log_file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD.size))
+            log_file.flush()
+            return log_file
+        validate_header(self.path)
+        whole_size = FILE_HEADER.size + (log_file.tell() - FILE_HEADER.size) // RECORD.size * RECORD.size
+        if whole_size != log_file.tell():
+            logging.warning("Dropping a partial record at the end of the capture log '%s'", self.path)
+            log_file.truncate(whole_size)
+            log_file.seek(whole_size)
+        last = read_records(self.path, newest=1)
+        if len(last) > 0:
+            self._last_logged_at = last[0].logged_at
+        return log_file
+
+def discard_incompatible(path):
+    # Moves aside a log written with another version of the format, so a new log is started
+    try:
+        validate_header(path)
+    except Exception as e:
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            logging.warning("%s. Moving it to '%s'", str(e), path + INCOMPATIBLE_EXTENSION)
+            os.replace(path, path + INCOMPATIBLE_EXTENSION)
+
+def validate_header(path):
+    with open(path, 'rb') as log_file:
+        header = log_file.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header) != (FILE_MAGIC, FILE_VERSION, RECORD.size):
+        raise Exception("The file '{0}' is not a capture log with version {1}".format(path, FILE_VERSION))
+
+def read_records(path, start=None, end=None, newest=None):
+    """
+    Reads the records of a capture log file logged in a time range, or the newest records.
+
+    Parameters:
+    path (string): Path of the capture log file
+    start (float): Optional start of the range, in seconds since the epoch
+    end (float): Optional end of the range, in seconds since the epoch. Records logged at the end are excluded
+    newest (int): Optional max number of records to read, from the end of the range
+
+    Returns:
+    list: The records, oldest first. Empty if the file does not exist
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < FILE_HEADER.size + RECORD.size:
+        return []
+    validate_header(path)
+    with open(path, 'rb') as log_file, mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        count = (len(buffer) - FILE_HEADER.size) // RECORD.size
+        first = 0 if start is None else bisect_logged_at(buffer, count, start)
+        last = count if end is None else bisect_logged_at(buffer, count, end)
+        if newest is not None:
+            first = max(first, last - newest)
+        return [CaptureRecord.unpack_from(buffer, FILE_HEADER.size + i * RECORD.size) for i in range(first, last)]
+
+def bisect_logged_at(buffer, count, logged_at):
+    # Index of the first record logged at or after the given time. The log time is the first field of a record
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if struct.unpack_from('<d', buffer, FILE_HEADER.size + middle * RECORD.size)[0] < logged_at:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints the records of a capture log as JSON lines')
+    parser.add_argument('path', help='Path of the capture log')
+    parser.add_argument('--since', dest='since', type=float, default=None,
+        help='Start of the range in seconds since the epoch, or relative to now when negative (default: none)')
+    parser.add_argument('--until', dest='until', type=float, default=None,
+        help='End of the range in seconds since the epoch, or relative to now when negative (default: none)')
+    args = parser.parse_args()
+    now = time.time()
+    since = now + args.since if args.since is not None and args.since < 0 else args.since
+    until = now + args.until if args.until is not None and args.until < 0 else args.until
+    for path in [args.path + ROTATED_EXTENSION, args.path]:
+        for record in read_records(path, since, until):
+            print(json.dumps(record.to_dict()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+from data_source.data import CapturedData
+import threading
+import tarfile
+import struct
+import json
+import time
+import uuid
+import os
+import io
+
+PACK_FORMAT_TAR = 'tar'
+PACK_FORMAT_SEGMENT = 'segment'
+PACK_FORMATS = [PACK_FORMAT_TAR, PACK_FORMAT_SEGMENT]
+PACK_EXTENSIONS = {PACK_FORMAT_TAR: '.tar', PACK_FORMAT_SEGMENT: '.seg'}
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+# Ends a segment: the size of the JSON offset table written before it, and a magic number
+SEGMENT_FOOTER = struct.Struct('<I4s')
+SEGMENT_MAGIC = b'PCSG'
+
+class FramePacker():
+    """
+    A class used to pack the images of a camera into a single object, so several images cost a single
+    upload, a single MQTT message and a single entry in the bucket listings.
+
+    A pack is complete once it holds its max number of frames or once its first frame is older than its
+    max age. Each frame is stored whole, at a byte offset published in the MQTT message, so a consumer
+    can fetch a single frame with an HTTP range request. Packs are either plain tar archives, or segments
+    of concatenated images followed by their offset table as JSON and a footer.
+    """
+    def __init__(self, device_id, pack_format, max_frames, max_age_seconds):
+        if pack_format not in PACK_FORMATS:
+            raise Exception("The pack format '{0}' is not supported. Supported formats are: {1}"
+                .format(pack_format, PACK_FORMATS))
+        self.device_id = device_id
+        self.pack_format = pack_format
+        self.max_frames = max_frames
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add(self, data, content):
+        """
+        Appends an image to the pack.
+
+        Parameters:
+        data (CapturedData): The captured image
+        content (bytes-like): The encoded image
+
+        Returns:
+        CapturedData: The completed pack, to upload, or None while the pack is not complete
+        """
+        with self._lock:
+            if len(self._frames) == 0:
+                self._started_at = time.monotonic()
+            length = memoryview(content).nbytes
+            if self.pack_format == PACK_FORMAT_TAR:
+                self.write_tar_header(data, length)
+            offset = self._buffer.tell()
+            self._buffer.write(content)
+            if self.pack_format == PACK_FORMAT_TAR:
+                self._buffer.write(b'\0' * (-length % TAR_BLOCK_SIZE))
+            frame = data.to_dict()
+            for key in ["type", "deviceID", "filePath"]:
+                frame.pop(key, None)
+            frame["offset"] = offset
+            frame["length"] = length
+            self._frames.append(frame)
+            if len(self._frames) >= self.max_frames:
+                return self.complete()
+            return None
+
+    def flush_expired(self):
+        # Returns the pack if its first frame is older than the max age, None otherwise
+        with self._lock:
+            if len(self._frames) > 0 and time.monotonic() - self._started_at >= self.max_age_seconds:
+                return self.complete()
+            return None
+
+    ######################HELPER METHODS########################
+
+    def reset(self):
+        self._buffer = io.BytesIO()
+        self._frames = []
+        self._started_at = None
+
+    def write_tar_header(self, data, length):
+        # Members are named after their creation time in milliseconds and their index in the pack
+        extension = os.path.splitext(data.get_upload_filename() or data.get_upload_file_path() or '')[1]
+        member = tarfile.TarInfo('{0}-{1:04d}{2}'.format(int(data.creation_timestamp * 1000), len(self._frames), extension))
+        member.size = length
+        member.mtime = int(data.creation_timestamp)
+        self._buffer.write(member.tobuf(tarfile.USTAR_FORMAT))
+
+    def complete(self):
+        if self.pack_format == PACK_FORMAT_TAR:
+            # A tar archive ends with two empty blocks
+            self._buffer.write(b'\0' * (2 * TAR_BLOCK_SIZE))
+        else:
+            offset_table = json.dumps([[frame["offset"], frame["length"]] for frame in self._frames]).encode('utf-8')
+            self._buffer.write(offset_table)
+            self._buffer.write(SEGMENT_FOOTER.pack(len(offset_table), SEGMENT_MAGIC))
+        pack = CapturedData(self._frames[0]["creationTimestamp"], device_id=self.device_id,
+            upload_data=self._buffer.getbuffer(),
+            upload_filename='pack-' + str(uuid.uuid4()) + PACK_EXTENSIONS[self.pack_format])
+        pack.set_pack(self.pack_format, self._frames)
+        self.reset()
+        return pack
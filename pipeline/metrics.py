@@ -0,0 +1,154 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import threading
+import bisect
+import logging
+
+# Buckets in seconds of the duration histograms, from 1 ms to 30 s
+DURATION_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(key, value) for key, value in labels) + '}'
+
+class Counter():
+    """
+    A monotonically increasing value, optionally split by labels. When a callback is given, the values
+    are read from it at scrape time as a list of (labels, value) tuples
+    """
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text, callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [(self.name, labels, value) for labels, value in values]
+
+class Gauge(Counter):
+    """
+    A value that can go up and down
+    """
+    metric_type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram():
+    """
+    A distribution of observed values counted in fixed buckets
+    """
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = list(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        # The bucket is found before taking the lock so the critical section is a couple of additions
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ['+Inf'], counts):
+            cumulative += count
+            samples.append((self.name + '_bucket', (('le', str(bound)),), cumulative))
+        samples.append((self.name + '_sum', (), total))
+        samples.append((self.name + '_count', (), cumulative))
+        return samples
+
+class MetricsRegistry():
+    """
+    A class used to hold the metrics of the daemon and render them in the Prometheus text format
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, callback=None):
+        return self.register(Counter(name, help_text, callback))
+
+    def gauge(self, name, help_text, callback=None):
+        return self.register(Gauge(name, help_text, callback))
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help_text))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.metric_type))
+            for name, labels, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def start_metrics_server(registry, port, host=''):
+    """
+    Serves the metrics of the registry given at /metrics from a background thread.
+
+    Parameters:
+    registry (MetricsRegistry): The metrics to serve
+    port (int): The port to listen on
+    host (string): Optional address to bind to. Binds to all interfaces by default
+
+    Returns:
+    HTTPServer: The running server
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug("Metrics request: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='MetricsThread', daemon=True)
+    thread.start()
+    logging.info("Serving metrics on port %d", port)
+    return server
@@ -0,0 +1,59 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import json
+
+FORMAT_JSON = 'json'
+FORMAT_MSGPACK = 'msgpack'
+PAYLOAD_FORMATS = [FORMAT_JSON, FORMAT_MSGPACK]
+
+# Version of the layout of the payloads. Increase it whenever fields are renamed or removed
+PAYLOAD_SCHEMA_VERSION = 1
+
+class PayloadEncoder():
+    """
+    A class used to serialize the metadata of one or more captures into an MQTT payload.
+
+    A single capture encoded as JSON keeps the original message layout. Several captures are grouped
+    into a single "batch" message holding a list of records. The MessagePack format carries the
+    schema version in every payload so consumers can tell layouts apart.
+    """
+    def __init__(self, payload_format=FORMAT_JSON):
+        if payload_format not in PAYLOAD_FORMATS:
+            raise Exception("The payload format '{0}' is not supported. Supported formats are: {1}"
+                .format(payload_format, PAYLOAD_FORMATS))
+        self.payload_format = payload_format
+        if payload_format == FORMAT_MSGPACK:
+            try:
+                import msgpack
+            except ImportError:
+                raise Exception("The msgpack package is required to publish MessagePack payloads. Install it with: pip3 install msgpack")
+            self._packer = msgpack.Packer(use_bin_type=True)
+
+    def encode(self, records):
+        """
+        Serializes the records given into a single payload.
+
+        Parameters:
+        records (list): The dictionaries produced by CapturedData.to_dict
+
+        Returns:
+        string or bytes: A JSON string or MessagePack bytes
+        """
+        if len(records) == 1:
+            message = records[0]
+        else:
+            message = {
+                "type": "batch",
+                "records": records
+            }
+
+        if self.payload_format == FORMAT_MSGPACK:
+            message = dict(message)
+            message["version"] = PAYLOAD_SCHEMA_VERSION
+            return self._packer.pack(message)
+        if len(records) > 1:
+            message["version"] = PAYLOAD_SCHEMA_VERSION
+        return json.dumps(message)
@@ -0,0 +1,243 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+from data_source.worker_pool import create_worker_pool
+import threading
+import logging
+import time
+
+UPLOAD_ALWAYS = 'always'
+UPLOAD_ON_COUNT_CHANGE = 'count_change'
+UPLOAD_KEYFRAMES = 'keyframe'
+UPLOAD_POLICIES = [UPLOAD_ALWAYS, UPLOAD_ON_COUNT_CHANGE, UPLOAD_KEYFRAMES]
+
+# Factors by which OpenCV can downscale a JPEG image while decoding it, which is much cheaper than
+# decoding it at full resolution and resizing it
+DECODE_SCALES = [1, 2, 4, 8]
+
+# Person detector of the worker process. Created once per process since it is costly to build
+_detector = None
+
+def count_people(image, decode_scale, win_stride, detection_scale):
+    """
+    Counts the people in an encoded image with the HOG person detector of OpenCV. Runs in a worker process.
+
+    Parameters:
+    image (bytes or string): The encoded image, or the path of the image file
+    decode_scale (int): Factor by which the image is downscaled while it is decoded
+    win_stride (int): Step in pixels of the detection window
+    detection_scale (float): Factor between two levels of the detection pyramid
+
+    Returns:
+    tuple: The number of people detected and the time spent in seconds
+    """
+    # OpenCV and numpy are only imported by the worker processes
+    import numpy as np
+    import cv2 as cv
+    global _detector
+    start = time.monotonic()
+    if _detector is None:
+        _detector = cv.HOGDescriptor()
+        _detector.setSVMDetector(cv.HOGDescriptor_getDefaultPeopleDetector())
+    flags = cv.IMREAD_COLOR
+    if decode_scale > 1:
+        flags = getattr(cv, 'IMREAD_REDUCED_COLOR_{0}'.format(decode_scale))
+    if isinstance(image, str):
+        frame = cv.imread(image, flags)
+    else:
+        frame = cv.imdecode(np.frombuffer(image, dtype=np.uint8), flags)
+    if frame is None:
+        raise Exception("Could not decode the image to count people")
+    rects, _ = _detector.detectMultiScale(frame, winStride=(win_stride, win_stride), padding=(8, 8),
+        scale=detection_scale)
+    return len(rects), time.monotonic() - start
+
+class PeopleCountPolicy():
+    """
+    A class used to hold the people counting settings of a camera and to decide which of its images to upload.
+
+    With the "always" policy every image is uploaded. With the "count_change" policy an image is only uploaded
+    when the number of people differs from the previous image. With the "keyframe" policy an image is only
+    uploaded every keyframe interval. The count of every image is published either way.
+    """
+    def __init__(self, args_dict):
+        # Setup default values
+        upload_policy_default = UPLOAD_ALWAYS
+        keyframe_interval_seconds_default = 60
+        decode_scale_default = 2
+        win_stride_default = 8
+        detection_scale_default = 1.05
+
+        # Initialize variables to defaults if they were not provided in the JSON payload
+        if 'upload_policy' in args_dict:
+            self.upload_policy = args_dict['upload_policy']
+        else:
+            self.upload_policy = upload_policy_default
+        if 'keyframe_interval_seconds' in args_dict:
+            self.keyframe_interval_seconds = args_dict['keyframe_interval_seconds']
+        else:
+            self.keyframe_interval_seconds = keyframe_interval_seconds_default
+        if 'decode_scale' in args_dict:
+            self.decode_scale = args_dict['decode_scale']
+        else:
+            self.decode_scale = decode_scale_default
+        if 'win_stride' in args_dict:
+            self.win_stride = args_dict['win_stride']
+        else:
+            self.win_stride = win_stride_default
+        if 'detection_scale' in args_dict:
+            self.detection_scale = args_dict['detection_scale']
+        else:
+            self.detection_scale = detection_scale_default
+
+        self._last_count = None
+        self._last_upload_time = None
+        self.validate()
+
+    def should_upload(self, count):
+        """
+        Tells whether the image of a new count should be uploaded. Must be called once per image.
+
+        Parameters:
+        count (int): Number of people detected in the image
+
+        Returns:
+        bool: True when the image should be uploaded
+        """
+        now = time.monotonic()
+        if self.upload_policy == UPLOAD_ALWAYS:
+            upload = True
+        elif self.upload_policy == UPLOAD_ON_COUNT_CHANGE:
+            upload = count != self._last_count
+        else:
+            upload = self._last_upload_time is None or now - self._last_upload_time >= self.keyframe_interval_seconds
+        self._last_count = count
+        if upload:
+            self._last_upload_time = now
+        return upload
+
+    def get_detection_parameters(self):
+        return (self.decode_scale, self.win_stride, self.detection_scale)
+
+    def validate(self):
+        if self.upload_policy not in UPLOAD_POLICIES:
+            raise Exception("The upload policy '{0}' is not supported. Supported policies are: {1}"
+                .format(self.upload_policy, UPLOAD_POLICIES))
+        if self.keyframe_interval_seconds <= 0:
+            raise Exception("The keyframe interval must be a number greater than 0. Value given: {0}"
+                .format(self.keyframe_interval_seconds))
+        if self.decode_scale not in DECODE_SCALES:
+            raise Exception("The decode scale must be one of {0}. Value given: {1}"
+                .format(DECODE_SCALES, self.decode_scale))
+        if self.win_stride <= 0:
+            raise Exception("The window stride must be a number greater than 0. Value given: {0}"
+                .format(self.win_stride))
+        if self.detection_scale <= 1:
+            raise Exception("The detection scale must be a number greater than 1. Value given: {0}"
+                .format(self.detection_scale))
+
+class ResultSequencer():
+    """
+    A class used to deliver the results of the images of a camera in the order the images were submitted,
+    although the workers may finish them in any order. A result is held until the results of all the images
+    submitted before it are delivered.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_sequence = 0
+        self._next_delivery = 0
+        self._ready = {}
+
+    def next_sequence(self):
+        with self._lock:
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            return sequence
+
+    def complete(self, sequence, deliver):
+        # Runs the delivery of a result once it is its turn, along with the held deliveries that follow it
+        with self._lock:
+            self._ready[sequence] = deliver
+            while self._next_delivery in self._ready:
+                self._ready.pop(self._next_delivery)()
+                self._next_delivery += 1
+
+class InferencePool():
+    """
+    A class used to count people in captured images on all the cores of the device.
+
+    Images are handed to a pool of worker processes in their encoded form, which is far smaller than the
+    decoded frame, and the workers decode them at a reduced resolution. The results are delivered to a
+    callback on a thread of the pool, in the order the images of each camera were submitted, so the upload
+    policy compares every image with the previous one. Like the queues of the pipeline, the pool has a bounded number of
+    pending images and drops the new ones past it.
+    """
+    def __init__(self, workers, max_pending):
+        if workers <= 0:
+            raise Exception("The number of inference workers must be a number greater than 0. Value given: {0}"
+                .format(workers))
+        self.name = 'inference'
+        self.max_pending = max_pending
+        self.dropped_count = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._sequencers = {}
+        self._pool = create_worker_pool(workers)
+        logging.info("Started %d inference workers", workers)
+
+    def submit(self, data, policy, callback, error_callback):
+        """
+        Counts the people in captured data without blocking the caller.
+
+        Parameters:
+        data (CapturedData): The captured image, in memory or on disk
+        policy (PeopleCountPolicy): The people counting settings of the camera
+        callback (function): Called with the data, the count and the time spent once the people are counted
+        error_callback (function): Called with the data and the exception if the people could not be counted
+
+        Returns:
+        bool: False when the image was dropped because too many images are pending
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped_count += 1
+                logging.warning("%d images are waiting for people counting. Dropped the newest image", self._pending)
+                return False
+            self._pending += 1
+            sequencer = self._sequencers.setdefault(policy, ResultSequencer())
+        sequence = sequencer.next_sequence()
+        if data.upload_data_exists():
+            image = bytes(data.get_upload_data())
+        else:
+            image = data.get_upload_file_path()
+
+        def on_result(result):
+            self.release()
+            count, duration = result
+            sequencer.complete(sequence, lambda: callback(data, count, duration))
+
+        def on_error(e):
+            self.release()
+            sequencer.complete(sequence, lambda: error_callback(data, e))
+
+        try:
+            self._pool.apply_async(count_people, (image,) + policy.get_detection_parameters(),
+                callback=on_result, error_callback=on_error)
+        except Exception:
+            # The pool is closed. The image is skipped so the results of the next images are not held
+            self.release()
+            sequencer.complete(sequence, lambda: None)
+            raise
+        return True
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def qsize(self):
+        return self._pending
+
+    def close(self):
+        self._pool.terminate()
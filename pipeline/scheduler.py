@@ -0,0 +1,88 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import logging
+import time
+
+OVERRUN_SKIP = 'skip'
+OVERRUN_CATCH_UP = 'catch-up'
+OVERRUN_POLICIES = [OVERRUN_SKIP, OVERRUN_CATCH_UP]
+
+# Number of ticks between two jitter reports
+JITTER_REPORT_INTERVAL = 100
+
+class FixedRateScheduler():
+    """
+    A class used to run a task at a fixed rate based on monotonic deadlines.
+
+    The deadlines do not depend on how long the task takes, so the period does not drift. When the
+    task overruns one or more deadlines, the "skip" policy drops the missed ticks and waits for the
+    next deadline while the "catch-up" policy runs the missed ticks back-to-back.
+    """
+    def __init__(self, name, interval_seconds, overrun_policy=OVERRUN_SKIP):
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise Exception("The overrun policy '{0}' is not supported. Supported policies are: {1}"
+                .format(overrun_policy, OVERRUN_POLICIES))
+        self.name = name
+        self.overrun_policy = overrun_policy
+        self.set_interval(interval_seconds)
+        self.skipped_ticks = 0
+        self._next_deadline = None
+        self._ticks = 0
+        self._jitter_sum = 0.0
+        self._jitter_max = 0.0
+
+    def set_interval(self, interval_seconds):
+        # Changes the period of the schedule. Takes effect from the next deadline
+        if interval_seconds <= 0:
+            raise Exception("The interval of the schedule '{0}' must be a number greater than 0. Value given: {1}"
+                .format(self.name, interval_seconds))
+        self.interval_seconds = interval_seconds
+
+    def wait(self):
+        """
+        Blocks until the next deadline of the schedule. The first call returns immediately.
+
+        Returns:
+        float: The deadline the caller was woken up for, in time.monotonic() seconds
+        """
+        deadline = self.advance()
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.record_jitter(time.monotonic() - deadline)
+        return deadline
+
+    def advance(self):
+        """
+        Moves the schedule to its next deadline without waiting for it, e.g. to wait for it in an event loop.
+        The caller should report how late it woke up with record_jitter().
+
+        Returns:
+        float: The next deadline, in time.monotonic() seconds
+        """
+        now = time.monotonic()
+        if self._next_deadline is None:
+            self._next_deadline = now
+        else:
+            self._next_deadline += self.interval_seconds
+            if now > self._next_deadline + self.interval_seconds and self.overrun_policy == OVERRUN_SKIP:
+                missed = int((now - self._next_deadline) // self.interval_seconds)
+                self.skipped_ticks += missed
+                self._next_deadline += missed * self.interval_seconds
+                logging.warning("Schedule '%s' overran by %d ticks. Skipping them", self.name, missed)
+        return self._next_deadline
+
+    def record_jitter(self, jitter):
+        # Accumulates how late the caller woke up after a deadline and reports it periodically
+        self._ticks += 1
+        self._jitter_sum += jitter
+        self._jitter_max = max(self._jitter_max, jitter)
+        if self._ticks % JITTER_REPORT_INTERVAL == 0:
+            logging.info("Schedule '%s' jitter over the last %d ticks: mean %.1f ms, max %.1f ms. Skipped ticks: %d",
+                self.name, JITTER_REPORT_INTERVAL, self._jitter_sum / JITTER_REPORT_INTERVAL * 1000,
+                self._jitter_max * 1000, self.skipped_ticks)
+            self._jitter_sum = 0.0
+            self._jitter_max = 0.0
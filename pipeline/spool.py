@@ -0,0 +1,244 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import threading
+import logging
+import struct
+import zlib
+import json
+import os
+
+RECORD_UPLOAD = 1
+RECORD_MQTT_MESSAGE = 2
+
+# kind, key length, metadata length, payload length, CRC32 of the record body
+RECORD_HEADER = struct.Struct('<BHIII')
+SEGMENT_EXTENSION = '.seg'
+INDEX_FILENAME = 'index.json'
+# Delays in seconds before the drain is retried after a failure: doubled after each failure, up to the max
+DRAIN_RETRY_INITIAL_SECONDS = 1
+DRAIN_RETRY_MAX_SECONDS = 60
+
+class SpoolRecord():
+    """
+    A class used to hold a record read back from the spool
+    """
+    def __init__(self, kind, key, metadata, payload):
+        self.kind = kind
+        self.key = key
+        self.metadata = metadata
+        self.payload = payload
+
+class DrainBackoff():
+    """
+    A class used to space out the retries of the spool drain while the object store or the MQTT broker
+    stays unreachable. The delay doubles after every failure up to a max, and is reset by a success.
+    """
+    def __init__(self, initial_seconds=DRAIN_RETRY_INITIAL_SECONDS, max_seconds=DRAIN_RETRY_MAX_SECONDS):
+        self.initial_seconds = initial_seconds
+        self.max_seconds = max_seconds
+        self._delay_seconds = initial_seconds
+
+    def next_delay(self):
+        # Returns the delay before the next retry, and doubles the one after
+        delay = self._delay_seconds
+        self._delay_seconds = min(self._delay_seconds * 2, self.max_seconds)
+        return delay
+
+    def reset(self):
+        self._delay_seconds = self.initial_seconds
+
+class Spool():
+    """
+    A durable, append-only store-and-forward queue kept on disk.
+
+    Records are appended to segment files and read back oldest first. A small index file holds the
+    position of the next record to read so the spool survives restarts. When the spool exceeds its
+    size cap, the oldest segments are discarded. Only one batch of records is ever held in memory.
+    """
+    def __init__(self, directory, max_size_bytes, segment_size_bytes=8 * 1024 * 1024):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.segment_size_bytes = min(segment_size_bytes, max(max_size_bytes // 4, 1))
+        self.discarded_records = 0
+        self._lock = threading.Lock()
+        self.validate()
+
+        segments = sorted(int(name[:-len(SEGMENT_EXTENSION)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_EXTENSION))
+        self._read_segment, self._read_offset = self.load_index(segments)
+        # Segments before the read position were fully handled before the last shutdown
+        for segment in segments:
+            if segment < self._read_segment:
+                os.remove(self.segment_path(segment))
+        self._segments = [segment for segment in segments if segment >= self._read_segment]
+        if len(self._segments) == 0:
+            self._segments.append(self._read_segment)
+        elif self._segments[0] != self._read_segment:
+            self._read_segment, self._read_offset = self._segments[0], 0
+        self._size_bytes = sum(os.path.getsize(self.segment_path(segment)) for segment in self._segments
+            if os.path.exists(self.segment_path(segment)))
+        # Always write to a fresh segment so a record torn by a crash is never followed by new records
+        if os.path.exists(self.segment_path(self._segments[-1])) and os.path.getsize(self.segment_path(self._segments[-1])) > 0:
+            self._segments.append(self._segments[-1] + 1)
+        self._write_file = open(self.segment_path(self._segments[-1]), 'ab')
+
+    def append(self, kind, key, metadata=b'', payload=b''):
+        """
+        Appends a record to the spool.
+
+        Parameters:
+        kind (int): RECORD_UPLOAD or RECORD_MQTT_MESSAGE
+        key (string): The object name of an upload or the topic of an MQTT message
+        metadata (bytes): The JSON metadata of the captured data
+        payload (bytes-like): The content of the object or of the MQTT message
+        """
+        key = key.encode('utf-8')
+        body = key + bytes(metadata) + bytes(payload)
+        header = RECORD_HEADER.pack(kind, len(key), len(metadata), len(payload), zlib.crc32(body))
+        with self._lock:
+            if self._write_file.tell() > 0 and self._write_file.tell() + len(header) + len(body) > self.segment_size_bytes:
+                self.roll_segment()
+            self._write_file.write(header)
+            self._write_file.write(body)
+            self._write_file.flush()
+            self._size_bytes += len(header) + len(body)
+            self.enforce_size_cap()
+
+    def read_batch(self, max_records):
+        """
+        Reads the oldest records of the spool without removing them.
+
+        Parameters:
+        max_records (int): Max number of records to read
+
+        Returns:
+        list: Tuples of (SpoolRecord, position) where position is passed to commit() once the record is handled
+        """
+        batch = []
+        with self._lock:
+            segment, offset = self._read_segment, self._read_offset
+            while len(batch) < max_records:
+                record, next_offset = self.read_record(segment, offset)
+                if record is not None:
+                    batch.append((record, (segment, next_offset)))
+                    offset = next_offset
+                    continue
+                # Move on to the next segment once the current one has been fully read
+                later_segments = [s for s in self._segments if s > segment]
+                if len(later_segments) == 0:
+                    break
+                segment, offset = later_segments[0], 0
+                batch_end = (segment, offset)
+                if len(batch) > 0:
+                    batch[-1] = (batch[-1][0], batch_end)
+                else:
+                    self.commit_locked(batch_end)
+        return batch
+
+    def commit(self, position):
+        # Marks every record up to the position given as handled
+        with self._lock:
+            self.commit_locked(position)
+
+    def is_empty(self):
+        with self._lock:
+            return self._read_segment == self._segments[-1] and self._read_offset >= self._write_file.tell()
+
+    def close(self):
+        with self._lock:
+            self._write_file.close()
+
+    ######################HELPER METHODS########################
+
+    def validate(self):
+        if not os.access(self.directory, os.F_OK):
+            raise Exception("The folder ({0}) specified for the spool does not exist"
+                .format(self.directory))
+        if not os.access(self.directory, os.W_OK):
+            raise Exception("The folder ({0}) specified for the spool is not writtable"
+                .format(self.directory))
+        if self.max_size_bytes <= 0:
+            raise Exception("The max size of the spool must be a number greater than 0. Value given: {0}"
+                .format(self.max_size_bytes))
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, '{0:012d}{1}'.format(segment, SEGMENT_EXTENSION))
+
+    def load_index(self, segments):
+        default_position = (segments[0] if len(segments) > 0 else 0), 0
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            return default_position
+        try:
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+            return index['segment'], index['offset']
+        except Exception as e:
+            logging.error("An error occurred that prevented the loading of the spool index. Error: %s", str(e))
+            return default_position
+
+    def commit_locked(self, position):
+        segment, offset = position
+        # Segments that were fully read are no longer needed
+        while self._segments[0] < segment:
+            self.remove_segment(self._segments.pop(0))
+        self._read_segment, self._read_offset = segment, offset
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump({'segment': segment, 'offset': offset}, index_file)
+        os.replace(index_path + '.tmp', index_path)
+
+    def roll_segment(self):
+        self._write_file.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._write_file = open(self.segment_path(self._segments[-1]), 'ab')
+
+    def remove_segment(self, segment):
+        path = self.segment_path(segment)
+        try:
+            self._size_bytes -= os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def enforce_size_cap(self):
+        # Discards the oldest segments, even if they were not read yet, to respect the size cap
+        while self._size_bytes > self.max_size_bytes and len(self._segments) > 1:
+            segment = self._segments.pop(0)
+            discarded = self.count_records(segment, self._read_offset if segment == self._read_segment else 0)
+            self.discarded_records += discarded
+            logging.warning("Spool exceeded its size cap of %d bytes. Discarding %d records", self.max_size_bytes, discarded)
+            self.remove_segment(segment)
+            if segment == self._read_segment:
+                self._read_segment, self._read_offset = self._segments[0], 0
+
+    def count_records(self, segment, offset):
+        count = 0
+        while True:
+            record, offset = self.read_record(segment, offset)
+            if record is None:
+                return count
+            count += 1
+
+    def read_record(self, segment, offset):
+        # Reads the record at the offset given. Returns (None, offset) at the end of the segment or on a torn write
+        path = self.segment_path(segment)
+        try:
+            with open(path, 'rb') as segment_file:
+                segment_file.seek(offset)
+                header = segment_file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return None, offset
+                kind, key_length, metadata_length, payload_length, crc = RECORD_HEADER.unpack(header)
+                body = segment_file.read(key_length + metadata_length + payload_length)
+        except FileNotFoundError:
+            return None, offset
+        if len(body) < key_length + metadata_length + payload_length or zlib.crc32(body) != crc:
+            logging.warning("Spool segment %d has an incomplete record at offset %d", segment, offset)
+            return None, offset
+        record = SpoolRecord(kind, body[:key_length].decode('utf-8'),
+            body[key_length:key_length + metadata_length], body[key_length + metadata_length:])
+        return record, offset + RECORD_HEADER.size + len(body)
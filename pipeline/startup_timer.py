@@ -0,0 +1,39 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+import collections
+import contextlib
+import logging
+import time
+
+class StartupTimer():
+    """
+    A class used to measure how long each step of the startup of the daemon takes and to report it once
+    the pipeline is running. Steps may overlap, so their durations do not have to add up to the total.
+    """
+    def __init__(self, start_time=None):
+        if start_time is None:
+            start_time = time.monotonic()
+        self.start_time = start_time
+        self.steps = collections.OrderedDict()
+        self.total_seconds = None
+
+    def record(self, name, duration_seconds):
+        self.steps[name] = duration_seconds
+
+    @contextlib.contextmanager
+    def step(self, name):
+        # Records the time spent in the body of the with statement under the given name
+        step_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - step_start)
+
+    def report(self):
+        # Logs the time since the start along with the duration of every step
+        self.total_seconds = time.monotonic() - self.start_time
+        logging.info("Startup took %.2f seconds (%s)", self.total_seconds,
+            ', '.join('{0}: {1:.2f} s'.format(name, duration) for name, duration in self.steps.items()))
@@ -0,0 +1,38 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Run from the root of the repository with: python3 -m unittest discover tests
+#
+import threading
+import unittest
+import logging
+import json
+import time
+from image_capture_daemon import App
+from pipeline.async_runner import AsyncRunner
+from benchmarks.fakes import SyntheticCamera, InMemoryObjectStore, FakeMQTTClient
+
+class AsyncRunnerTest(unittest.TestCase):
+
+    def test_run_pipeline_publishes_captures(self):
+        logging.getLogger().setLevel(logging.ERROR)
+        mqtt_client = FakeMQTTClient()
+        object_store = InMemoryObjectStore()
+        argv = ['-n', 'test', '-p', 'test', '-s', 'localhost', '-e', '1883', '-v', 'test', '-b', '{}',
+            '-a', json.dumps({'image_resolution': [160, 120]}), '-i', '0.05', '--async-core']
+        app = App(argv, mqtt_client=mqtt_client, object_store=object_store, data_source_class=SyntheticCamera)
+        runner = AsyncRunner(app)
+        runner_thread = threading.Thread(target=runner.run_pipeline, daemon=True)
+        runner_thread.start()
+        time.sleep(1)
+        runner.stop()
+        runner_thread.join(10)
+
+        self.assertFalse(runner_thread.is_alive())
+        self.assertGreater(len(mqtt_client.published), 0)
+        self.assertGreater(object_store.bytes_uploaded, 0)
+
+if __name__ == '__main__':
+    unittest.main()
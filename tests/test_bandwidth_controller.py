@@ -0,0 +1,41 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Run from the root of the repository with: python3 -m unittest discover tests
+#
+import unittest
+from pipeline.bandwidth_controller import BandwidthController
+
+class BandwidthControllerTest(unittest.TestCase):
+
+    def test_concurrent_uploads_measure_the_whole_link(self):
+        # Four workers each take 1 s to upload 100 kB at the same time: the link delivers 400 kB/s
+        controller = BandwidthController({'budget_bytes_per_second': 1000000}, 90, 1)
+        for worker in range(4):
+            controller.record_upload(100000, 0.0, 1.0)
+
+        self.assertAlmostEqual(controller._throughput, 400000)
+
+    def test_idle_time_between_uploads_is_not_counted(self):
+        controller = BandwidthController({'budget_bytes_per_second': 1000000}, 90, 1)
+        controller.record_upload(50000, 0.0, 0.5)
+        controller.record_upload(50000, 2.0, 2.5)
+
+        self.assertAlmostEqual(controller._throughput, 100000)
+
+    def test_quality_is_lowered_first_when_over_budget(self):
+        controller = BandwidthController({'budget_bytes_per_second': 10000}, 90, 1)
+        controller.record_upload(100000, 0.0, 0.1)
+
+        self.assertEqual(controller.get_parameters(), (80, 1.0, 1))
+
+    def test_quality_is_kept_for_lossless_images(self):
+        controller = BandwidthController({'budget_bytes_per_second': 10000}, 90, 1, lossy=False)
+        controller.record_upload(100000, 0.0, 0.1)
+
+        self.assertEqual(controller.get_parameters(), (90, 0.75, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Run from the root of the repository with: python3 -m unittest discover tests
+#
+import unittest
+from pipeline.people_counter import PeopleCountPolicy, ResultSequencer, UPLOAD_ON_COUNT_CHANGE
+
+class ResultSequencerTest(unittest.TestCase):
+
+    def test_results_are_delivered_in_submission_order(self):
+        sequencer = ResultSequencer()
+        sequences = [sequencer.next_sequence() for _ in range(4)]
+        delivered = []
+        for sequence in [2, 0, 3, 1]:
+            sequencer.complete(sequences[sequence], lambda sequence=sequence: delivered.append(sequence))
+            if sequence == 2:
+                self.assertEqual(delivered, [])
+        self.assertEqual(delivered, [0, 1, 2, 3])
+
+    def test_count_change_policy_compares_with_the_previous_image(self):
+        # The images are counted 1, 1, 2, but the worker of the second image finishes last
+        policy = PeopleCountPolicy({'upload_policy': UPLOAD_ON_COUNT_CHANGE})
+        sequencer = ResultSequencer()
+        counts = [1, 1, 2]
+        sequences = [sequencer.next_sequence() for _ in counts]
+        uploads = {}
+        for index in [0, 2, 1]:
+            sequencer.complete(sequences[index],
+                lambda index=index: uploads.__setitem__(index, policy.should_upload(counts[index])))
+        self.assertEqual(uploads, {0: True, 1: False, 2: True})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Run from the root of the repository with: python3 -m unittest discover tests
+#
+import unittest
+import tempfile
+import logging
+import os
+from object_store.providers.s3_object_store import DELETE_BATCH_SIZE
+from benchmarks.fakes import StubbedS3ObjectStore
+
+MEGABYTE = 1024 * 1024
+
+class S3ObjectStoreTest(unittest.TestCase):
+    """
+    Runs the S3 object store against S3 requests answered in process, so the requests are still built
+    and signed, and the responses parsed, by the S3 client.
+    """
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.ERROR)
+        self.object_store = StubbedS3ObjectStore(bucket_name='test')
+
+    def test_upload_data(self):
+        storage_path = self.object_store.upload_data('camera-0/image.jpg', memoryview(b'\xff\xd8' * 1000))
+
+        self.assertEqual(storage_path, 'test/camera-0/image.jpg')
+        self.assertEqual(self.object_store.objects['camera-0/image.jpg'][0], 2000)
+
+    def test_upload_data_in_parts(self):
+        data = bytearray(self.object_store.transfer_config.multipart_threshold + MEGABYTE)
+
+        self.object_store.upload_data('pack.tar', data)
+
+        self.assertIn('pack.tar', self.object_store.objects)
+        self.assertEqual(self.object_store.bytes_uploaded, len(data))
+
+    def test_upload_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as image_file:
+            image_file.write(b'\xff\xd8' * 10)
+        try:
+            storage_path = self.object_store.upload(image_file.name, object_name='camera-0/file.jpg')
+        finally:
+            os.remove(image_file.name)
+
+        self.assertEqual(storage_path, 'test/camera-0/file.jpg')
+        self.assertEqual(self.object_store.objects['camera-0/file.jpg'][0], 20)
+
+    def test_list_objects_and_prefixes(self):
+        for name in ['camera-0/2020/a.jpg', 'camera-0/2021/b.jpg', 'camera-1/2020/c.jpg']:
+            self.object_store.upload_data(name, b'image')
+
+        names = [name for name, _ in self.object_store.list_objects(prefix='camera-0/')]
+        prefixes = list(self.object_store.list_prefixes('camera-0/'))
+
+        self.assertEqual(names, ['camera-0/2020/a.jpg', 'camera-0/2021/b.jpg'])
+        self.assertEqual(prefixes, ['camera-0/2020/', 'camera-0/2021/'])
+
+    def test_delete_many(self):
+        # More objects than a single multi-object delete request accepts
+        names = ['image-{0}.jpg'.format(i) for i in range(DELETE_BATCH_SIZE + 10)]
+        for name in names:
+            self.object_store.objects[name] = (1, None)
+        self.object_store.objects['kept.jpg'] = (1, None)
+
+        failed = self.object_store.delete_many(names)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(list(self.object_store.objects), ['kept.jpg'])
+
+if __name__ == '__main__':
+    unittest.main()
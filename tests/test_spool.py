@@ -0,0 +1,85 @@
+#
+# Copyright © 2019 VMware, Inc. All Rights Reserved.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Run from the root of the repository with: python3 -m unittest discover tests
+#
+import unittest
+import tempfile
+import logging
+import shutil
+import json
+import os
+from image_capture_daemon import App
+from pipeline.spool import RECORD_UPLOAD
+from benchmarks.fakes import SyntheticCamera, InMemoryObjectStore, FakeMQTTClient
+
+IMAGE_CACHE_SIZE = 2
+
+class UnreachableObjectStore(InMemoryObjectStore):
+    """
+    An object store whose requests fail after running a callback, e.g. to capture while the upload is attempted.
+    """
+    def __init__(self):
+        super().__init__()
+        self.on_request = None
+
+    def simulate_request(self):
+        if self.on_request is not None:
+            self.on_request()
+        raise Exception("Simulated object store outage")
+
+class SpoolUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.ERROR)
+        self.image_folder = tempfile.mkdtemp()
+        self.spool_folder = tempfile.mkdtemp()
+        self.object_store = UnreachableObjectStore()
+        cameras = {'image_resolution': [160, 120], 'in_memory_capture': False, 'image_storage_folder': self.image_folder,
+            'image_cache_size': IMAGE_CACHE_SIZE}
+        argv = ['-n', 'test', '-p', 'test', '-s', 'localhost', '-e', '1883', '-v', 'test', '-b', '{}',
+            '-a', json.dumps(cameras), '--spool-directory', self.spool_folder]
+        self.app = App(argv, mqtt_client=FakeMQTTClient(), object_store=self.object_store, data_source_class=SyntheticCamera)
+        self.data_source = self.app.data_sources[0]
+
+    def tearDown(self):
+        self.app.spool.close()
+        shutil.rmtree(self.image_folder)
+        shutil.rmtree(self.spool_folder)
+
+    def test_failed_upload_is_spooled(self):
+        data = self.app.capture(self.data_source)[0]
+
+        self.assertFalse(self.app.try_upload(data))
+
+        batch = self.app.spool.read_batch(10)
+        self.assertEqual(len(batch), 1)
+        record = batch[0][0]
+        self.assertEqual(record.kind, RECORD_UPLOAD)
+        self.assertEqual(record.key, data.object_name)
+        with open(data.get_upload_file_path(), 'rb') as upload_file:
+            self.assertEqual(bytes(record.payload), upload_file.read())
+
+    def test_file_evicted_during_failed_upload_is_spooled(self):
+        data = self.app.capture(self.data_source)[0]
+        with open(data.get_upload_file_path(), 'rb') as upload_file:
+            content = upload_file.read()
+
+        def capture_more():
+            # Newer captures evict the file of the capture being uploaded from the local cache
+            for _ in range(IMAGE_CACHE_SIZE):
+                self.app.capture(self.data_source)
+        self.object_store.on_request = capture_more
+
+        self.assertFalse(self.app.try_upload(data))
+
+        self.assertFalse(os.path.exists(data.get_upload_file_path()))
+        batch = self.app.spool.read_batch(10)
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(batch[0][0].key, data.object_name)
+        self.assertEqual(bytes(batch[0][0].payload), content)
+
+if __name__ == '__main__':
+    unittest.main()